@@ -26,6 +26,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Metadatos de las respuestas binarias de /api/render (ver API_DOCUMENTATION.md)
+    expose_headers=["X-Signatures", "X-Image-Info", "X-Page-Count", "Content-Disposition", "ETag"],
 )
 
 logger.info("🔄 Incluyendo routers...")
@@ -1,11 +1,31 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-from typing import Literal, Optional
+from fastapi import APIRouter, File, HTTPException, Request, UploadFile
+from fastapi.exceptions import RequestValidationError
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Annotated, Any, Dict, Iterator, List, Literal, Optional, Tuple
 from ..services.template_store import TemplateStore
-from ..services.renderer import Renderer
+from ..services.asset_store import ASSET_MAX_BYTES, AssetStore, describe_image
+from ..services.renderer import DETERMINISTIC_PDF, Renderer, get_render_cache_stats
+from ..utils import metrics
+from ..utils.image_cache import ASSET_PREFIX, asset_id, content_key, get_decoded_cache_stats, pinned_images, set_asset_loader
+from ..utils.image_fetcher import get_cache_stats as get_remote_image_cache_stats
+from ..utils.image_optimizer import IMAGE_MIME_TYPES, sniff_image_format
+from ..utils.single_flight import canonical_key, coalesce, get_single_flight
+from ..utils.spool_pipe import SpoolPipe
+from ..utils import fast_json
+from ..utils.fast_json import FastJSONResponse
+from ..utils.row_stream import NDJSON_MEDIA_TYPES, RowStream, spool_ndjson
+from contextlib import ExitStack
+from functools import partial
+import asyncio
+import hashlib
 import io
+import json
 import re
+import time
+import uuid
+import zipfile
 from pypdf import PdfReader
 from openpyxl import load_workbook
 
@@ -13,12 +33,30 @@ router = APIRouter()
 
 store = TemplateStore(base_path="storage/templates")
 renderer = Renderer(store)
+assets = AssetStore(base_path="storage/assets")
+set_asset_loader(assets.get_asset)
 
 class RenderRequest(BaseModel):
     template_id: str
     data: dict
     output_format: Literal["pdf", "image"] = "pdf"
     image_format: Optional[Literal["webp", "png", "jpeg"]] = "webp"  # Nuevo parámetro con valor por defecto
+    # Esfuerzo del codificador: "fast" | "balanced" | "smallest" (por defecto GENDOC_IMAGE_PROFILE)
+    image_profile: Optional[Literal["fast", "balanced", "smallest"]] = None
+    # Tamaño de la imagen: se rasteriza directamente a esa resolución (sin reescalar después)
+    dpi: Optional[float] = Field(None, gt=0, le=600)
+    max_width: Optional[int] = Field(None, gt=0, le=10000)
+    max_height: Optional[int] = Field(None, gt=0, le=10000)
+    # Varias páginas como imágenes: "all" o rangos base 1 ("1-3,5"); None = solo la primera (JSON)
+    pages: Optional[str] = Field(None, max_length=200)
+    # Contenedor de la salida de varias páginas
+    pages_format: Literal["zip", "multipart"] = "zip"
+    # Varias salidas de un único render (sustituye a output_format)
+    outputs: Optional[List[Literal["pdf", "image", "thumbnail"]]] = Field(None, min_length=1)
+    # Lado máximo (px) de cada miniatura; por defecto [256]
+    thumbnail_sizes: Optional[List[Annotated[int, Field(gt=0, le=2000)]]] = Field(None, min_length=1, max_length=8)
+    # PDF binario enviado por partes según se terminan las páginas (plantillas overlay)
+    stream: bool = False
 
 class MappingRequest(BaseModel):
     mapping: dict | None = None
@@ -166,159 +204,635 @@ async def set_mapping(template_id: str, body: MappingRequest):
         raise HTTPException(status_code=404, detail="Plantilla no encontrada")
     return {"ok": True}
 
-@router.post("/render")
-async def render_document(req: RenderRequest):
+@router.post("/assets")
+async def upload_asset(file: UploadFile = File(...)):
+    """Guarda una imagen reutilizable (logo, sello); en los renders se referencia como "asset:<id>"."""
+    data = await file.read(ASSET_MAX_BYTES + 1)
+    try:
+        return assets.save_asset(data)
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+
+@router.delete("/assets/{asset_id}")
+async def delete_asset(asset_id: str):
+    if not assets.delete_asset(asset_id):
+        raise HTTPException(status_code=404, detail="Asset no encontrado")
+    return {"deleted": True}
+
+@router.get("/metrics")
+async def get_metrics():
+    """Métricas en memoria de este worker (encoder, cachés)."""
+    return {
+        "metrics": metrics.snapshot(),
+        "caches": {
+            "remote_images": get_remote_image_cache_stats(),
+            "decoded_images": get_decoded_cache_stats(),
+            **get_render_cache_stats(),
+        },
+    }
+
+class _StreamBuffer:
+    """Destino de escritura sin seek para zipfile: acumula lo escrito hasta que se vacía."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _page_entries(page_numbers: List[int], images: Iterator[Tuple[bytes, int, int]], default_format: str):
+    for page, (image_bytes, width, height) in zip(page_numbers, images):
+        image_format = sniff_image_format(image_bytes) or default_format
+        yield page, image_bytes, {
+            "page": page,
+            "file": f"page-{page}.{image_format}",
+            "format": image_format,
+            "mime_type": IMAGE_MIME_TYPES.get(image_format, "application/octet-stream"),
+            "width": width,
+            "height": height,
+        }
+
+
+def _zip_pages(page_numbers: List[int], images: Iterator[Tuple[bytes, int, int]], default_format: str) -> Iterator[bytes]:
+    """ZIP (sin compresión: las imágenes ya lo están) emitido página a página, con manifest.json al final."""
+    buf = _StreamBuffer()
+    manifest = []
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zf:
+        for _, image_bytes, info in _page_entries(page_numbers, images, default_format):
+            zf.writestr(info["file"], image_bytes)
+            manifest.append(info)
+            yield buf.drain()
+        zf.writestr("manifest.json", json.dumps({"pages": manifest}, ensure_ascii=False))
+    yield buf.drain()
+
+
+def _multipart_pages(page_numbers: List[int], images: Iterator[Tuple[bytes, int, int]], default_format: str, boundary: str) -> Iterator[bytes]:
+    """multipart/mixed con una parte por página; los metadatos van en las cabeceras de cada parte."""
+    for page, image_bytes, info in _page_entries(page_numbers, images, default_format):
+        headers = (
+            f"--{boundary}\r\n"
+            f"Content-Type: {info['mime_type']}\r\n"
+            f"Content-Disposition: attachment; filename=\"{info['file']}\"\r\n"
+            f"X-Page: {page}\r\n"
+            f"X-Image-Width: {info['width']}\r\n"
+            f"X-Image-Height: {info['height']}\r\n\r\n"
+        )
+        yield headers.encode("ascii") + image_bytes + b"\r\n"
+    yield f"--{boundary}--\r\n".encode("ascii")
+
+
+async def _render_pages_response(req: RenderRequest, resources: ExitStack) -> StreamingResponse:
+    """
+    Varias páginas como imágenes. El PDF pasa por el turno de render y la
+    deduplicación (es el mismo que el de output_format "pdf"); las páginas se
+    rasterizan en el pool de procesos y se leen fuera del bucle de eventos.
+    """
+    pdf_bytes = await _coalesced("render_to_pdf", req, resources, renderer.render_to_pdf)
+    page_numbers, images = await run_in_threadpool(partial(
+        renderer.render_pages_to_images, req.template_id, req.data, pages=req.pages, dpi=req.dpi, max_width=req.max_width,
+        max_height=req.max_height, image_format=req.image_format, profile=req.image_profile, pdf_bytes=pdf_bytes,
+    ))
+    default_format = req.image_format or "webp"
+    headers = {"X-Page-Count": str(len(page_numbers))}
+    if req.pages_format == "multipart":
+        boundary = uuid.uuid4().hex
+        return StreamingResponse(
+            _multipart_pages(page_numbers, images, default_format, boundary),
+            media_type=f"multipart/mixed; boundary={boundary}", headers=headers,
+        )
+    headers["Content-Disposition"] = f'attachment; filename="{req.template_id}-pages.zip"'
+    return StreamingResponse(_zip_pages(page_numbers, images, default_format), media_type="application/zip", headers=headers)
+
+def _image_info(image_bytes: bytes, image_width: int, image_height: int, requested_format: Optional[str], page_size: List[float]) -> dict:
+    # Formato real de los bytes (el fallback del optimizador puede devolver JPEG)
+    image_format = sniff_image_format(image_bytes) or requested_format or "webp"
+    page_width, page_height = page_size
+    return {
+        "format": image_format,
+        "mime_type": IMAGE_MIME_TYPES.get(image_format, "application/octet-stream"),
+        "width": image_width,
+        "height": image_height,
+        "original_pdf_width_points": page_width,
+        "original_pdf_height_points": page_height,
+        "scale_x": image_width / page_width,
+        "scale_y": image_height / page_height,
+        "coordinate_system_origin": "top-left"
+    }
+
+
+def _image_signatures(geometry: dict, image_width: int, image_height: int) -> dict:
+    """
+    Coordenadas de las firmas escaladas a la imagen (origen arriba-izquierda).
+    La geometría viene normalizada de la plantilla compilada: solo se multiplica.
+    """
+    return {
+        key: {
+            "x": int(box["nx"] * image_width),
+            "y": int(box["ny"] * image_height),
+            "width": int(box["nw"] * image_width),
+            "height": int(box["nh"] * image_height)
+        }
+        for key, box in geometry["signatures"].items()
+    }
+
+
+def _pdf_signatures(geometry: dict) -> dict:
+    """Coordenadas de las firmas en puntos PDF (esquina superior izquierda, origen abajo-izquierda)."""
+    return {
+        key: {"x": box["x"], "y": box["y"], "width": box["width"], "height": box["height"]}
+        for key, box in geometry["signatures"].items()
+    }
+
+
+def _parse_accept(accept: Optional[str]) -> List[Tuple[str, float]]:
+    """Rangos de medios de la cabecera Accept con su q, en el orden en que llegan."""
+    ranges = []
+    for item in (accept or "").split(","):
+        parts = [p.strip() for p in item.split(";")]
+        if not parts[0]:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        ranges.append((parts[0].lower(), q))
+    return ranges
+
+
+def _negotiate(accept: Optional[str], binary_types: List[str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Modo de respuesta pedido explícitamente en Accept: ("json" | "multipart" |
+    "binary", tipo binario concreto o None). Los comodines (*/*) no cuentan: sin
+    una petición explícita se devuelve (None, None) y se mantiene la respuesta
+    de siempre.
+    """
+    best = (None, None)
+    best_q = 0.0
+    for media, q in _parse_accept(accept):
+        if q <= 0:
+            continue
+        if media == "application/json":
+            mode = ("json", None)
+        elif media == "multipart/mixed":
+            mode = ("multipart", None)
+        elif media in binary_types:
+            mode = ("binary", media)
+        elif media.endswith("/*") and any(t.startswith(media[:-1]) for t in binary_types) and media != "*/*":
+            mode = ("binary", None)
+        else:
+            continue
+        if q > best_q:
+            best, best_q = mode, q
+    return best
+
+
+def _meta_headers(meta: dict) -> dict:
+    # Metadatos (firmas, datos de la imagen) como JSON compacto en cabeceras
+    return {
+        f"X-{name.replace('_', '-').title()}": json.dumps(value, separators=(",", ":"))
+        for name, value in meta.items()
+    }
+
+
+def _binary_response(body: bytes, media_type: str, meta: dict, mode: str, filename: str, boundary: Optional[str] = None) -> Response:
+    """
+    Cuerpo binario sin base64: "binary" lleva los metadatos en cabeceras
+    (X-Signatures, X-Image-Info); "multipart" los manda en una primera parte JSON
+    seguida de la parte binaria.
+    """
+    headers = {"Vary": "Accept"}
+    if mode == "binary":
+        headers.update(_meta_headers(meta))
+        headers["Content-Disposition"] = f'inline; filename="{filename}"'
+        return Response(content=body, media_type=media_type, headers=headers)
+
+    return _multipart_response(meta, [(media_type, filename, body, {})], boundary)
+
+
+def _multipart_response(meta: dict, files: List[Tuple[str, str, bytes, dict]], boundary: Optional[str] = None) -> StreamingResponse:
+    """
+    multipart/mixed: una parte JSON con 'meta' y una parte por fichero (tipo,
+    nombre, bytes, cabeceras extra). Con un 'boundary' fijo (p. ej. derivado del
+    ETag) la respuesta es estable byte a byte.
+    """
+    boundary = boundary or uuid.uuid4().hex
+
+    def parts():
+        yield (
+            f"--{boundary}\r\n"
+            "Content-Type: application/json\r\n\r\n"
+        ).encode("ascii") + fast_json.dumps(meta) + b"\r\n"
+        for media_type, filename, body, extra in files:
+            headers = "".join(f"{name}: {value}\r\n" for name, value in extra.items())
+            yield (
+                f"--{boundary}\r\n"
+                f"Content-Type: {media_type}\r\n"
+                f"Content-Disposition: attachment; filename=\"{filename}\"\r\n"
+                f"{headers}\r\n"
+            ).encode("ascii")
+            yield body
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode("ascii")
+
+    return StreamingResponse(parts(), media_type=f"multipart/mixed; boundary={boundary}", headers={"Vary": "Accept"})
+
+
+def _etag(*parts) -> str:
+    """ETag fuerte de una representación: hash de sus bytes y metadatos (el PDF es determinista)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"\0")
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def _not_modified(request: Request, etag: str, headers: dict) -> Optional[Response]:
+    """304 sin cuerpo si If-None-Match incluye 'etag' (o "*"); si no, None."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # Comparación débil (RFC 9110 §13.1.2): se ignora el prefijo W/
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or etag in tags:
+            metrics.incr("render.not_modified")
+            return Response(status_code=304, headers=headers)
+    return None
+
+
+def _with_etag(request: Request, etag: str, build):
+    """
+    304 sin cuerpo si If-None-Match incluye 'etag'; si no, la respuesta de
+    build(boundary) con la cabecera ETag (los dict se devuelven como FastJSONResponse).
+    """
+    headers = {"ETag": etag, "Vary": "Accept"}
+    not_modified = _not_modified(request, etag, headers)
+    if not_modified is not None:
+        return not_modified
+    response = build(etag.strip('"'))
+    if isinstance(response, dict):
+        return FastJSONResponse(response, headers=headers)
+    response.headers.update(headers)
+    return response
+
+
+async def _coalesced(operation: str, req: RenderRequest, resources: ExitStack, render, **params):
+    """
+    Ejecuta renderer.<operation>(template_id, data, **params) deduplicando las
+    peticiones idénticas en curso (misma plantilla y versión, payload y parámetros).
+    'resources' (items NDJSON, imágenes subidas) se libera al terminar el render,
+    aunque el cliente se haya desconectado antes.
+    """
+    key = canonical_key(operation, req.template_id, store.get_template_version(req.template_id), req.data, params)
+    return await coalesce(key, partial(render, req.template_id, req.data, **params), on_done=resources.pop_all().close)
+
+
+async def _stream_pdf_response(req: RenderRequest, request: Request, geometry: dict, resources: ExitStack) -> Response:
+    """
+    PDF binario por partes ("stream": true): el render escribe cada lote de
+    páginas en un SpoolPipe desde el threadpool y la respuesta lo envía en
+    cuanto está escrito. Los errores anteriores al primer trozo (plantilla,
+    validación) siguen siendo 4xx; uno posterior corta la respuesta.
+
+    Sin single-flight: cada petición tiene su propio render (sí ocupa un turno
+    de GENDOC_RENDER_CONCURRENCY). El render cierra 'resources' al terminar.
+    """
+    signatures = _pdf_signatures(geometry)
+    headers = {"Content-Disposition": f'inline; filename="{req.template_id}.pdf"', **_meta_headers({"signatures": signatures})}
+    if DETERMINISTIC_PDF:
+        # Mismos datos y versión -> mismos bytes: el ETag se conoce antes de renderizar
+        version = store.get_template_version(req.template_id)
+        headers["ETag"] = _etag("pdf-stream", canonical_key("pdf-stream", req.template_id, version, req.data), signatures)
+        not_modified = _not_modified(request, headers["ETag"], headers)
+        if not_modified is not None:
+            resources.close()
+            return not_modified
+
+    chunks = renderer.render_to_pdf_chunks(req.template_id, req.data)
+    pipe = SpoolPipe()
+    started = time.perf_counter()
+
+    def produce():
+        try:
+            with get_single_flight().slot():
+                for chunk in chunks:
+                    pipe.write(chunk)
+            pipe.finish()
+        except BaseException as ex:
+            pipe.finish(ex)
+        finally:
+            resources.close()
+
+    task = asyncio.ensure_future(run_in_threadpool(produce))
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+    try:
+        first = await run_in_threadpool(pipe.read, 0)
+    except BaseException:
+        pipe.close()
+        raise
+    metrics.observe("render.stream_first_chunk_seconds", time.perf_counter() - started)
+
+    def body() -> Iterator[bytes]:
+        try:
+            yield first
+            yield from pipe.chunks(len(first))
+        finally:
+            # Cliente desconectado: el siguiente write() del render falla y lo detiene
+            pipe.close()
+
+    return StreamingResponse(body(), media_type="application/pdf", headers=headers)
+
+
+# Renders por partes en curso (referencia para que el bucle de eventos no los recoja)
+_stream_tasks: set = set()
+
+
+async def _render_outputs_response(req: RenderRequest, request: Request, geometry: dict, resources: ExitStack):
+    """
+    Salidas múltiples de un único render: JSON con un *_base64 por salida o, con
+    Accept: multipart/mixed, una parte JSON de metadatos y una parte binaria por salida.
+    """
+    results = await _coalesced(
+        "render_outputs", req, resources, renderer.render_outputs, outputs=req.outputs, thumbnail_sizes=req.thumbnail_sizes,
+        dpi=req.dpi, max_width=req.max_width, max_height=req.max_height,
+        image_format=req.image_format, profile=req.image_profile,
+    )
+    meta: dict = {"signatures": _pdf_signatures(geometry)}
+    files: List[Tuple[str, str, bytes, dict]] = []
+    json_fields = {}
+    if "pdf" in results:
+        files.append(("application/pdf", f"{req.template_id}.pdf", results["pdf"], {"X-Output": "pdf"}))
+        json_fields["pdf_base64"] = results["pdf"]
+    if "image" in results:
+        image_bytes, width, height = results["image"]
+        info = _image_info(image_bytes, width, height, req.image_format, geometry["page_size"])
+        meta["image_info"] = info
+        # Firmas escaladas a la imagen completa (las de "signatures" van en puntos PDF)
+        meta["image_signatures"] = _image_signatures(geometry, width, height)
+        files.append((info["mime_type"], f"{req.template_id}.{info['format']}", image_bytes, {"X-Output": "image"}))
+        json_fields["image_base64"] = image_bytes
+    if "thumbnails" in results:
+        meta["thumbnails"] = []
+        for size, thumb_bytes, width, height in results["thumbnails"]:
+            thumb_format = sniff_image_format(thumb_bytes) or req.image_format or "webp"
+            entry = {
+                "max_side": size,
+                "format": thumb_format,
+                "mime_type": IMAGE_MIME_TYPES.get(thumb_format, "application/octet-stream"),
+                "width": width,
+                "height": height,
+            }
+            meta["thumbnails"].append(entry)
+            files.append((entry["mime_type"], f"{req.template_id}-{size}.{thumb_format}", thumb_bytes, {"X-Output": "thumbnail", "X-Max-Side": size}))
+
+    mode, _ = _negotiate(request.headers.get("accept"), [])
+    etag = _etag("outputs", mode, meta, *(body for _, _, body, _ in files))
+    if mode == "multipart":
+        return _with_etag(request, etag, lambda boundary: _multipart_response(meta, files, boundary))
+
+    def build_json(_):
+        import base64
+        response = {name: base64.b64encode(body).decode("ascii") for name, body in json_fields.items()}
+        for entry, (_, thumb_bytes, _, _) in zip(meta.get("thumbnails", []), results.get("thumbnails", [])):
+            entry["image_base64"] = base64.b64encode(thumb_bytes).decode("ascii")
+        response.update(meta)
+        return response
+    return _with_etag(request, etag, build_json)
+
+def _render_request_from(raw: bytes) -> RenderRequest:
+    """
+    RenderRequest a partir del JSON 'raw': se parsea con fast_json y pydantic
+    valida solo las opciones. 'data' (libre; lo valida después el esquema de la
+    plantilla) se asigna tal cual, sin recorrerlo ni copiarlo.
+    """
+    try:
+        payload = fast_json.loads(raw)
+    except ValueError as ex:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ("body",), "msg": "JSON decode error", "input": {}, "ctx": {"error": str(ex)}}])
+    if not isinstance(payload, dict):
+        raise RequestValidationError([{"type": "model_attributes_type", "loc": ("body",), "msg": "Input should be a valid dictionary or object to extract fields from", "input": payload}])
+    data = payload.pop("data", None)
+    errors = []
+    if not isinstance(data, dict):
+        errors.append({"type": "missing" if data is None else "dict_type", "loc": ("body", "data"),
+                       "msg": "Field required" if data is None else "Input should be a valid dictionary", "input": data})
+    try:
+        req = RenderRequest.model_validate({**payload, "data": {}})
+    except ValidationError as ex:
+        errors.extend({**error, "loc": ("body", *error["loc"])} for error in ex.errors(include_url=False))
+    if errors:
+        raise RequestValidationError(errors)
+    req.data = data
+    return req
+
+
+async def _parse_ndjson_render_request(request: Request) -> Tuple[RenderRequest, RowStream]:
+    """
+    Entrada NDJSON (ver row_stream): la primera línea es la petición y el resto,
+    los items del array de _repeat_rows de la plantilla, que se colocan en
+    'data' como un RowStream que el motor de filas lee página a página.
+    """
+    header, rows = await spool_ndjson(request.stream())
+    try:
+        req = _render_request_from(header or b"{}")
+        try:
+            meta = store.get_template_meta(req.template_id)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Plantilla no encontrada")
+        mapping = meta.get("mapping", {}) or {}
+        repeat_rows = mapping.get("_repeat_rows") or {}
+        if meta.get("kind") != "pdf" or not mapping.get("_positions") or not repeat_rows:
+            raise HTTPException(status_code=400, detail="La entrada NDJSON solo está disponible para plantillas PDF overlay con _repeat_rows")
+        rows.path = next(iter(repeat_rows))
+        parent, last = _ensure_path(req.data, rows.path)
+        parent[last] = rows
+        metrics.observe("render.ndjson_items", len(rows))
+        return req, rows
+    except BaseException:
+        rows.close()
+        raise
+
+
+async def _parse_multipart_render_request(request: Request) -> Tuple[RenderRequest, Dict[str, bytes]]:
+    """
+    multipart/form-data: el campo "request" lleva la petición en JSON y cada
+    parte de fichero, una imagen en binario cuyo nombre es su ruta en 'data'
+    ("firma_cliente", "cliente.logo"). Cada imagen se coloca en 'data' como
+    "asset:<id>" (hash de su contenido), igual que un asset guardado.
+
+    Returns:
+        (petición, id -> bytes de las imágenes subidas)
+    """
+    form = await request.form()
+    try:
+        raw = form.get("request")
+        if raw is None:
+            raise RequestValidationError([{"type": "missing", "loc": ("body", "request"), "msg": "Field required", "input": None}])
+        req = _render_request_from(raw.encode("utf-8") if isinstance(raw, str) else await raw.read())
+        uploads: Dict[str, bytes] = {}
+        for name, value in form.multi_items():
+            if name == "request":
+                continue
+            if isinstance(value, str):
+                raise HTTPException(status_code=400, detail=f"Campo multipart no esperado: {name}")
+            data = await value.read(ASSET_MAX_BYTES + 1)
+            try:
+                describe_image(data)
+            except ValueError as ex:
+                raise HTTPException(status_code=400, detail=f"Imagen '{name}': {ex}")
+            key = content_key(data)
+            uploads[key] = data
+            parent, last = _ensure_path(req.data, name)
+            if last is None:
+                raise HTTPException(status_code=400, detail="Cada imagen debe nombrarse con su campo en 'data'")
+            parent[last] = ASSET_PREFIX + key
+        metrics.observe("render.uploaded_images", len(uploads))
+        return req, uploads
+    finally:
+        await form.close()
+
+
+def _asset_refs(value: Any, parts: List[str]) -> Iterator[str]:
+    """Ids "asset:<id>" en la ruta 'parts' de 'value' (en cada elemento de los arrays que atraviesa)."""
+    if not parts:
+        ref = asset_id(value)
+        if ref is not None:
+            yield ref
+    elif isinstance(value, dict):
+        yield from _asset_refs(value.get(parts[0]), parts[1:])
+    elif isinstance(value, list):
+        for item in value:
+            yield from _asset_refs(item, parts)
+
+
+def _check_assets(data: dict, geometry: dict, uploads: Dict[str, bytes]):
+    """Los campos imagen que referencian "asset:<id>" deben apuntar a un asset guardado o subido."""
+    for path in geometry.get("image_paths", ()):
+        for ref in _asset_refs(data, path.split(".")):
+            if ref not in uploads and not assets.has_asset(ref):
+                raise ValueError(f"Asset no encontrado: {ref}")
+
+
+@router.post("/render", openapi_extra={"requestBody": {"required": True, "content": {
+    "application/json": {"schema": RenderRequest.model_json_schema()},
+    "application/x-ndjson": {"schema": {"type": "string", "description": "1ª línea: la petición en JSON; después, un item de _repeat_rows por línea"}},
+    "multipart/form-data": {"schema": {"type": "object", "required": ["request"], "properties": {
+        "request": {"type": "string", "description": "La petición en JSON"},
+    }, "additionalProperties": {"type": "string", "format": "binary", "description": "Imagen; el nombre de la parte es su ruta en data"}}},
+}}})
+async def render_document(request: Request):
+    # Recursos de la petición que duran hasta que termina el render (items NDJSON, imágenes subidas)
+    resources = ExitStack()
+    uploads: Dict[str, bytes] = {}
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in NDJSON_MEDIA_TYPES:
+        req, rows = await _parse_ndjson_render_request(request)
+        resources.callback(rows.close)
+    elif content_type == "multipart/form-data":
+        req, uploads = await _parse_multipart_render_request(request)
+        resources.enter_context(pinned_images(uploads))
+    else:
+        req = _render_request_from(await request.body())
     try:
         # Debug: Log the request parameters
         print(f"🔍 DEBUG: output_format = {req.output_format}")
         print(f"🔍 DEBUG: template_id = {req.template_id}")
         
-        # Get template metadata to check for signatures
-        meta = store.get_template_meta(req.template_id)
-        mapping = meta.get("mapping", {})
-        
-        # Extract signature coordinates from _positions
-        positions = mapping.get("_positions", {})
-        signatures_cfg = {}
-        
-        # Look for signature fields in positions
-        for field_name, coords in positions.items():
-            if "firma" in field_name.lower() or "signature" in field_name.lower():
-                signatures_cfg[field_name] = {
-                    "x": coords[0] if isinstance(coords, list) and len(coords) >= 2 else 0,
-                    "y": coords[1] if isinstance(coords, list) and len(coords) >= 2 else 0,
-                    "width": 200,  # Default width
-                    "height": 100   # Default height
-                }
-        
-        # Render PDF synchronously
-        pdf_bytes = renderer.render_to_pdf(req.template_id, req.data)
+        # Geometría de firmas y tamaño de página, resueltos al guardar el mapping
+        geometry = store.get_compiled(req.template_id)
+        _check_assets(req.data, geometry, uploads)
         
+        # PDF por partes: el render entrega los lotes de páginas según los termina
+        if req.stream:
+            if req.outputs or req.output_format != "pdf":
+                raise ValueError('"stream" solo está disponible con output_format "pdf" (sin "outputs")')
+            return await _stream_pdf_response(req, request, geometry, resources.pop_all())
+
+        # Varias salidas (pdf, imagen, miniaturas) de un único render
+        if req.outputs:
+            return await _render_outputs_response(req, request, geometry, resources)
+
+        # Varias páginas: se rasterizan en el pool de procesos y se emiten según terminan
+        if req.output_format == "image" and req.pages:
+            return await _render_pages_response(req, resources)
+
         # Handle different output formats
         if req.output_format == "image":
-            print("🖼️  DEBUG: Converting PDF to image...")
-            # Convert PDF to image
-            image_bytes, final_image_width, final_image_height = renderer.convert_pdf_to_image(pdf_bytes)
+            print("🖼️  DEBUG: Rendering image...")
+            # Negociación: Accept con un tipo de imagen concreto elige el formato
+            # si el cliente no lo ha fijado en el payload
+            requested_format = req.image_format
+            mode, accepted_type = _negotiate(request.headers.get("accept"), list(IMAGE_MIME_TYPES.values()))
+            if accepted_type and "image_format" not in req.model_fields_set:
+                requested_format = next(fmt for fmt, mime in IMAGE_MIME_TYPES.items() if mime == accepted_type)
+            # Las plantillas overlay se rasterizan directamente, sin PDF intermedio
+            image_bytes, final_image_width, final_image_height = await _coalesced(
+                "render_to_image", req, resources, renderer.render_to_image, dpi=req.dpi, max_width=req.max_width,
+                max_height=req.max_height, image_format=requested_format, profile=req.image_profile,
+            )
             print(f"🖼️  DEBUG: Image conversion complete, size: {len(image_bytes)} bytes")
             
-            # Prepare response with image and signature coordinates
-            import base64
-            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-            
-            # Get image dimensions for coordinate scaling
-            from PIL import Image
-            import io
-            pil_image = Image.open(io.BytesIO(image_bytes))
-            image_width, image_height = pil_image.size
-            
-            # Las dimensiones del PDF original están hardcodeadas para este template específico
-            # Basándome en el debug, el PDF original tiene dimensiones A4 estándar
-            original_pdf_width_points = 595.32
-            original_pdf_height_points = 841.92
-            
             response_data = {
-                "image_base64": image_base64,
-                "image_info": {
-                    "width": image_width,
-                    "height": image_height,
-                    "original_pdf_width_points": original_pdf_width_points,
-                    "original_pdf_height_points": original_pdf_height_points,
-                    "scale_x": image_width / original_pdf_width_points,
-                    "scale_y": image_height / original_pdf_height_points,
-                    "coordinate_system_origin": "top-left"
-                },
-                "signatures": {}
+                "image_info": _image_info(image_bytes, final_image_width, final_image_height, requested_format, geometry["page_size"]),
+                "signatures": _image_signatures(geometry, final_image_width, final_image_height),
             }
+            image_format = response_data["image_info"]["format"]
+            etag = _etag("image", mode, response_data, image_bytes)
             
-            # Add signature coordinates if any exist (scaled to image dimensions)
-            if signatures_cfg:
-                print(f"🔍 DEBUG: Found {len(signatures_cfg)} signature fields")
-                for key, meta in signatures_cfg.items():
-                    # Obtener coordenadas originales del template
-                    x_template = meta.get("x", 0)
-                    y_template = meta.get("y", 0)
-                    
-                    print(f"🔍 DEBUG: Template coordinates for '{key}': x={x_template}, y={y_template}")
-                    print(f"🔍 DEBUG: Image dimensions: {image_width} x {image_height}")
-                    
-                    # Calcular factores de escalado dinámicamente
-                    # Intentar diferentes métodos de escalado y elegir el más apropiado
-                    
-                    # Método 1: Escalado basado en dimensiones del PDF (estándar)
-                    scale_x_pdf = image_width / original_pdf_width_points
-                    scale_y_pdf = image_height / original_pdf_height_points
-                    
-                    # Método 2: Escalado directo (para sistemas personalizados)
-                    # Usar un factor de escalado basado en la relación entre coordenadas típicas
-                    # Para este template específico, las coordenadas están en un sistema personalizado
-                    # pero podemos detectar automáticamente el factor
-                    
-                    # Detectar si las coordenadas están en un rango razonable para el PDF
-                    if x_template <= original_pdf_width_points and y_template <= original_pdf_height_points:
-                        # Coordenadas están en el sistema del PDF
-                        x_image = int(x_template * scale_x_pdf)
-                        y_image = int((original_pdf_height_points - y_template) * scale_y_pdf)
-                        final_x = x_image
-                        final_y = y_image
-                        final_width = int(meta.get("width", 200) * scale_x_pdf)
-                        final_height = int(meta.get("height", 100) * scale_y_pdf)
-                    else:
-                        # Coordenadas están en un sistema personalizado
-                        # Calcular factores de escalado basados en las dimensiones de la imagen
-                        # y las coordenadas típicas de este tipo de template
-                        
-                        # Para templates con coordenadas personalizadas, usar un escalado proporcional
-                        # basado en las dimensiones de la imagen final
-                        ratio_x = image_width / 1000  # Asumiendo coordenadas en escala de 1000
-                        ratio_y = image_height / 1000
-                        
-                        final_x = int(x_template * ratio_x)
-                        final_y = int(y_template * ratio_y)
-                        final_width = int(meta.get("width", 200) * ratio_x)
-                        final_height = int(meta.get("height", 100) * ratio_y)
-                    
-                    print(f"🔍 DEBUG: Converted coordinates for '{key}': x={final_x}, y={final_y}, w={final_width}, h={final_height}")
-                    
-                    response_data["signatures"][key] = {
-                        "x": final_x,
-                        "y": final_y,
-                        "width": final_width,
-                        "height": final_height
-                    }
-            
-            return response_data
+            if mode in ("binary", "multipart"):
+                mime_type = response_data["image_info"]["mime_type"]
+                return _with_etag(request, etag, lambda boundary: _binary_response(
+                    image_bytes, mime_type, response_data, mode, f"{req.template_id}.{image_format}", boundary))
+
+            import base64
+            return _with_etag(request, etag, lambda _: {"image_base64": base64.b64encode(image_bytes).decode('utf-8'), **response_data})
         
         print("📄 DEBUG: Returning PDF format...")
+        pdf_bytes = await _coalesced("render_to_pdf", req, resources, renderer.render_to_pdf)
         # Default: PDF output
         # Prepare response with signature coordinates if any
         response_data = {
             "pdf": pdf_bytes,
-            "signatures": {}
+            # PDF coordinates, no scaling needed
+            "signatures": _pdf_signatures(geometry)
         }
         
-        # Add signature coordinates if any exist (PDF coordinates, no scaling needed)
-        if signatures_cfg:
-            for key, meta in signatures_cfg.items():
-                response_data["signatures"][key] = {
-                    "x": meta.get("x", 0),
-                    "y": meta.get("y", 0),
-                    "width": meta.get("width", 200),
-                    "height": meta.get("height", 100)
-                }
-        
-        # If no signatures, return just the PDF
-        if not signatures_cfg:
-            return StreamingResponse(io.BytesIO(pdf_bytes), media_type="application/pdf")
+        mode, _ = _negotiate(request.headers.get("accept"), ["application/pdf"])
+        # Sin campos firma/signature en _positions: solo el PDF (compatibilidad)
+        raw_pdf = mode not in ("binary", "multipart") and not any(box["source"] == "positions" for box in geometry["signatures"].values())
+        etag = _etag("pdf", "raw" if raw_pdf else mode, response_data["signatures"], pdf_bytes)
+        if mode in ("binary", "multipart"):
+            return _with_etag(request, etag, lambda boundary: _binary_response(
+                pdf_bytes, "application/pdf", {"signatures": response_data["signatures"]}, mode, f"{req.template_id}.pdf", boundary))
+
+        if raw_pdf:
+            return _with_etag(request, etag, lambda _: StreamingResponse(io.BytesIO(pdf_bytes), media_type="application/pdf"))
         else:
             # Return JSON with PDF as base64 and signature coordinates
             import base64
-            pdf_base64 = base64.b64encode(pdf_bytes).decode('utf-8')
-            return {
-                "pdf_base64": pdf_base64,
+            return _with_etag(request, etag, lambda _: {
+                "pdf_base64": base64.b64encode(pdf_bytes).decode('utf-8'),
                 "signatures": response_data["signatures"]
-            }
+            })
             
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Plantilla no encontrada")
     except Exception as ex:
-        raise HTTPException(status_code=400, detail=str(ex))
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(ex))
+    finally:
+        # Lo que sigue aquí no lo usa ningún render: los renders compartidos y por
+        # partes se quedan 'resources' y lo liberan al terminar
+        resources.close()
\ No newline at end of file
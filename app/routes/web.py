@@ -7,6 +7,7 @@ from ..utils.auth import get_session_user, login_user, require_user, set_auth_co
 from ..services.template_store import TemplateStore
 from ..services.renderer import Renderer
 from ..utils.pdf_preview import render_pdf_page_png, get_preview_scale
+from ..utils.image_optimizer import IMAGE_MIME_TYPES, sniff_image_format
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 import io
 import json
@@ -231,14 +232,13 @@ async def test_render(template_id: str, data_json: str = Form("{}"), format: str
         data = json.loads(data_json) if data_json else {}
         
         if format == "image":
-            # Generar imagen PNG
-            pdf_bytes = renderer.render_to_pdf(template_id, data)
-            # Convertir PDF a imagen optimizada
-            image_bytes, _, _ = renderer.convert_pdf_to_image(pdf_bytes)
+            # Generar imagen optimizada (WebP por defecto; el tipo se toma de los bytes)
+            image_bytes, _, _ = renderer.render_to_image(template_id, data)
+            image_format = sniff_image_format(image_bytes) or "png"
             return StreamingResponse(
                 io.BytesIO(image_bytes), 
-                media_type="image/png", 
-                headers={"Content-Disposition": f"inline; filename=debug-{template_id}.png"}
+                media_type=IMAGE_MIME_TYPES.get(image_format, "application/octet-stream"), 
+                headers={"Content-Disposition": f"inline; filename=debug-{template_id}.{image_format}"}
             )
         else:
             # Generar PDF (por defecto)
@@ -340,14 +340,13 @@ async def test_render_get(template_id: str, format: str = Query("pdf"), user: st
         sample = {"nombre": "Ana"}
 
     if format == "image":
-        # Generar imagen PNG
-        pdf_bytes = renderer.render_to_pdf(template_id, sample)
-        # Convertir PDF a imagen optimizada
-        image_bytes, _, _ = renderer.convert_pdf_to_image(pdf_bytes)
+        # Generar imagen optimizada (WebP por defecto; el tipo se toma de los bytes)
+        image_bytes, _, _ = renderer.render_to_image(template_id, sample)
+        image_format = sniff_image_format(image_bytes) or "png"
         return StreamingResponse(
             io.BytesIO(image_bytes), 
-            media_type="image/png", 
-            headers={"Content-Disposition": f"inline; filename=debug-get-{template_id}.png"}
+            media_type=IMAGE_MIME_TYPES.get(image_format, "application/octet-stream"), 
+            headers={"Content-Disposition": f"inline; filename=debug-get-{template_id}.{image_format}"}
         )
     else:
         # Generar PDF (por defecto)
@@ -0,0 +1,77 @@
+import io
+import os
+import re
+import tempfile
+from typing import Any, Dict, Optional
+from PIL import Image
+from ..utils.image_cache import ASSET_PREFIX, content_key
+
+# Tamaño máximo de una imagen subida (POST /api/assets o parte de un render multipart)
+ASSET_MAX_BYTES = int(float(os.getenv("GENDOC_ASSET_MAX_MB", "10")) * 1024 * 1024)
+
+_ASSET_ID_RE = re.compile(r"^[0-9a-f]{40}$")
+
+
+def describe_image(data: bytes) -> Dict[str, Any]:
+    """
+    Comprueba que 'data' es una imagen que se puede dibujar y devuelve sus datos.
+    Lanza ValueError si no lo es o supera ASSET_MAX_BYTES.
+    """
+    if len(data) > ASSET_MAX_BYTES:
+        raise ValueError(f"La imagen supera el tamaño máximo ({ASSET_MAX_BYTES // (1024 * 1024)} MB)")
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.verify()
+            image_format, (width, height) = (img.format or "").lower(), img.size
+    except Exception:
+        raise ValueError("El fichero no es una imagen válida")
+    return {"format": image_format, "width": width, "height": height, "size": len(data)}
+
+
+class AssetStore:
+    """
+    Imágenes reutilizables (logos, sellos) subidas una vez y referenciadas en
+    los renders como "asset:<id>". El id es el hash del contenido: subir dos
+    veces la misma imagen devuelve el mismo id.
+    """
+
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        os.makedirs(self.base_path, exist_ok=True)
+
+    def _asset_path(self, asset_id: str) -> Optional[str]:
+        if not _ASSET_ID_RE.match(asset_id or ""):
+            return None
+        return os.path.join(self.base_path, asset_id)
+
+    def save_asset(self, data: bytes) -> Dict[str, Any]:
+        info = describe_image(data)
+        asset_id = content_key(data)
+        path = self._asset_path(asset_id)
+        if not os.path.exists(path):
+            fd, tmp_path = tempfile.mkstemp(dir=self.base_path, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return {"asset_id": asset_id, "ref": ASSET_PREFIX + asset_id, **info}
+
+    def get_asset(self, asset_id: str) -> Optional[bytes]:
+        path = self._asset_path(asset_id)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def has_asset(self, asset_id: str) -> bool:
+        path = self._asset_path(asset_id)
+        return path is not None and os.path.exists(path)
+
+    def delete_asset(self, asset_id: str) -> bool:
+        path = self._asset_path(asset_id)
+        if path is None or not os.path.exists(path):
+            return False
+        os.remove(path)
+        return True
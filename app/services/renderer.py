@@ -1,19 +1,167 @@
 import os
-import tempfile
-import math
-from typing import Dict, Any, List
+from functools import lru_cache, partial
+from itertools import islice
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
 from .template_store import TemplateStore
-from ..utils.soffice import convert_to_pdf
+from .repeat_rows import RepeatRowLayout
+from ..utils.soffice import convert_to_pdf, scratch_tempdir
 from ..utils.validation import validate_payload
 from ..utils.pdf_preview import get_preview_scale
+from ..utils.pdf_incremental import fill_acroform_incremental
+from ..utils.image_fetcher import prefetch_images, is_remote_url
+from ..utils.image_cache import ByteBoundedLRU, get_image_reader
+from ..utils.pdf_merge import merge_overlay
+from ..utils.pdf_stream import STREAM_BATCH_PAGES, stream_overlay
+from ..utils.raster_canvas import RasterCanvas, rasterize_page
+from ..utils.raster_pool import encode_outputs, get_raster_pool
+from ..utils.pdf_normalize import document_id, normalize_pdf
+from ..utils.row_stream import RowStream
+from ..utils.single_flight import canonical_key
 from docxtpl import DocxTemplate
 from openpyxl import load_workbook
 from reportlab.pdfgen import canvas
 from reportlab.lib.colors import HexColor
-from reportlab.lib.utils import ImageReader
 from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, ByteStringObject
 import io
 
+# Capas estáticas de plantillas overlay ya fusionadas con la página base (bytes PDF)
+_static_layers = ByteBoundedLRU(int(float(os.getenv("GENDOC_STATIC_LAYER_CACHE_MB", "64")) * 1024 * 1024))
+
+
+def _compose_static_layer(tpl_path: str, layer_pdf: bytes) -> bytes:
+    """Estampa la capa estática (una página) sobre todas las páginas de la plantilla."""
+    layer_pages = PdfReader(io.BytesIO(layer_pdf)).pages
+    if not layer_pages:
+        # Capa vacía (p. ej. textos estáticos sin valor): la plantilla tal cual
+        with open(tpl_path, "rb") as f:
+            return f.read()
+    layer_page = layer_pages[0]
+    writer = PdfWriter()
+    for page in PdfReader(tpl_path).pages:
+        writer.add_page(page).merge_page(layer_page)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+# Bitmaps de la página base (con la capa estática) para la salida "image" directa
+_raster_bases = ByteBoundedLRU(int(float(os.getenv("GENDOC_RASTER_BASE_CACHE_MB", "64")) * 1024 * 1024))
+
+# Salida "image" de plantillas overlay dibujada directamente con Pillow, sin PDF intermedio
+RASTER_FAST_PATH = os.getenv("GENDOC_RASTER_FAST_PATH", "1").lower() not in ("0", "false", "no")
+# Sin dpi ni tamaño pedidos: escala 2.0 limitada a una caja de 1600px
+RASTER_SCALE = 2.0
+RASTER_MAX_SIDE = 1600
+
+
+def raster_box(dpi: Optional[float] = None, max_width: Optional[int] = None, max_height: Optional[int] = None) -> Tuple[Optional[int], Optional[int]]:
+    """Caja máxima (px) de la imagen final; sin parámetros, la caja por defecto."""
+    if dpi or max_width or max_height:
+        return max_width, max_height
+    return RASTER_MAX_SIDE, RASTER_MAX_SIDE
+
+
+def raster_scale(page_width: float, page_height: float, dpi: Optional[float] = None, max_width: Optional[int] = None, max_height: Optional[int] = None) -> float:
+    """
+    Escala de pdfium (px por punto) que produce directamente el tamaño pedido, de
+    modo que el optimizador no tenga que volver a redimensionar.
+    """
+    box_w, box_h = raster_box(dpi, max_width, max_height)
+    if dpi:
+        scale = float(dpi) / 72.0
+    elif max_width or max_height:
+        scale = float("inf")
+    else:
+        scale = RASTER_SCALE
+    if box_w:
+        scale = min(scale, box_w / page_width)
+    if box_h:
+        scale = min(scale, box_h / page_height)
+    # pdfium redondea el tamaño del bitmap hacia arriba (y mide la página en float32):
+    # un pelo por debajo para no salir de la caja
+    return scale * (1 - 1e-6)
+
+
+def _page_encode_kwargs(box: Tuple[Optional[int], Optional[int]], quality_key: Any, image_format: Optional[str], profile: Optional[str]) -> Dict[str, Any]:
+    """Argumentos de optimize_image para una página (los mismos que _encode_page_image / _optimize_image)."""
+    return {
+        "target_kb": int(216 * 1.2),
+        "format_hint": image_format or "webp",
+        "max_width": box[0],
+        "max_height": box[1],
+        "doc_mode": False,
+        "quality_key": quality_key,
+        "profile": profile,
+    }
+
+
+def _raster_outputs(pdf_bytes: bytes, scale, encode_kwargs: Optional[Dict[str, Any]], thumbnail_sizes: Optional[List[int]] = None, thumbnail_kwargs: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Primera página codificada en el pool (ver RasterPool.render_outputs)."""
+    # El worker abre el PDF desde disco en lugar de recibir una copia en la tarea
+    with scratch_tempdir() as td:
+        pdf_path = os.path.join(td, "document.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(pdf_bytes)
+        return get_raster_pool().render_outputs(pdf_path, scale, encode_kwargs, thumbnail_sizes or [], thumbnail_kwargs)
+
+
+@lru_cache(maxsize=256)
+def _cached_page_size(tpl_path: str, template_version: str) -> Tuple[float, float]:
+    first_page = PdfReader(tpl_path).pages[0]
+    return float(first_page.mediabox.width), float(first_page.mediabox.height)
+
+
+def _template_page_size(tpl_path: str, template_version: Optional[str]) -> Tuple[float, float]:
+    """Tamaño (puntos) de la primera página de la plantilla, cacheado por versión."""
+    if template_version is None:
+        return _cached_page_size.__wrapped__(tpl_path, template_version)
+    return _cached_page_size(tpl_path, template_version)
+
+def parse_page_range(spec: Optional[str], page_count: int) -> List[int]:
+    """
+    Páginas pedidas (base 0) a partir de "all" o de una lista de rangos base 1
+    como "1-3,5,8-" (un rango abierto llega hasta la última página).
+    """
+    spec = (spec or "all").strip().lower()
+    if spec == "all":
+        return list(range(page_count))
+    pages: List[int] = []
+    for part in spec.split(","):
+        part = part.strip()
+        try:
+            if "-" in part:
+                first, last = part.split("-", 1)
+                first = int(first) if first.strip() else 1
+                last = int(last) if last.strip() else page_count
+            else:
+                first = last = int(part)
+        except ValueError:
+            raise ValueError(f"Rango de páginas no válido: {part!r}")
+        if first < 1 or last < first or last > page_count:
+            raise ValueError(f"Rango de páginas fuera del documento ({page_count} páginas): {part!r}")
+        pages.extend(p for p in range(first - 1, last) if p not in pages)
+    return pages
+
+def get_render_cache_stats() -> Dict[str, Dict[str, int]]:
+    return {"static_layers": _static_layers.stats(), "raster_bases": _raster_bases.stats()}
+
+
+# "incremental": añade solo los objetos modificados al PDF original (por defecto)
+# "rewrite": reescribe el documento completo con PdfWriter
+ACROFORM_MODE = os.getenv("GENDOC_ACROFORM_MODE", "incremental").lower()
+
+# PDFs reproducibles: mismas plantilla (versión) y datos -> mismos bytes (ETag, cachés, dedupe)
+DETERMINISTIC_PDF = os.getenv("GENDOC_DETERMINISTIC_PDF", "1").lower() not in ("0", "false", "no")
+
+
+def _version_timestamp(version: str) -> float:
+    """Fecha de la versión de la plantilla (mtime de meta.json, primer campo de la versión)."""
+    try:
+        return int(version.split("-", 1)[0], 16) / 1e9
+    except (AttributeError, ValueError):
+        return 0.0
+
 
 class Renderer:
     def __init__(self, store: TemplateStore):
@@ -30,20 +178,194 @@ class Renderer:
         validate_payload(data, schema)
 
         context = self._apply_mapping(data, mapping)
+        version = self.store.get_template_version(template_id)
+        seed = bytes.fromhex(canonical_key("pdf", template_id, version, data)) if DETERMINISTIC_PDF else None
+
+        def finish(pdf_bytes: bytes) -> bytes:
+            # Fechas e /ID de LibreOffice y pdfium derivados de la versión y los datos
+            return normalize_pdf(pdf_bytes, seed, _version_timestamp(version)) if seed is not None else pdf_bytes
+
         if kind == "docx":
-            return self._render_docx_to_pdf(tpl_path, context)
+            return finish(self._render_docx_to_pdf(tpl_path, context))
         if kind == "xlsx":
-            return self._render_xlsx_to_pdf(tpl_path, context)
+            return finish(self._render_xlsx_to_pdf(tpl_path, context))
         if kind == "pdf":
             # Prefer overlay if positions mapping exists; otherwise try AcroForm then fallback
             if mapping.get("_positions"):
-                return self._render_pdf_overlay(tpl_path, context, original_data=data, mapping=mapping)
+                return finish(self._render_pdf_overlay(tpl_path, context, original_data=data, mapping=mapping, template_version=version))
             try:
-                return self._render_pdf_acroform(tpl_path, context)
+                return self._render_pdf_acroform(tpl_path, context, revision_id=document_id(seed) if seed is not None else None)
             except Exception:
-                return self._render_pdf_overlay(tpl_path, context, original_data=data, mapping=mapping)
+                return finish(self._render_pdf_overlay(tpl_path, context, original_data=data, mapping=mapping, template_version=version))
         raise ValueError("Tipo de plantilla no soportado")
 
+    def render_to_pdf_chunks(self, template_id: str, data: Dict[str, Any]) -> Iterator[bytes]:
+        """
+        Como render_to_pdf, pero devuelve el PDF por partes: las plantillas
+        overlay se escriben por lotes de páginas según se dibujan (el primer
+        trozo sale antes de terminar el documento). El resto de tipos se
+        renderiza entero y se devuelve en un solo trozo.
+
+        El render empieza al pedir el primer trozo (errores de validación incluidos).
+        """
+        meta = self.store.get_template_meta(template_id)
+        mapping = meta.get("mapping", {})
+        if meta["kind"] != "pdf" or not mapping.get("_positions"):
+            yield self.render_to_pdf(template_id, data)
+            return
+        validate_payload(data, meta.get("schema"))
+        context = self._apply_mapping(data, mapping)
+        version = self.store.get_template_version(template_id)
+        # /ID derivado de la versión y los datos: mismos bytes para la misma petición
+        file_id = document_id(bytes.fromhex(canonical_key("pdf-stream", template_id, version, data))) if DETERMINISTIC_PDF else os.urandom(16)
+        yield from self._render_pdf_overlay(
+            self.store.get_template_file(template_id), context, original_data=data, mapping=mapping,
+            template_version=version, stream_id=file_id,
+        )
+
+    def render_to_image(self, template_id: str, data: Dict[str, Any], dpi: Optional[float] = None, max_width: Optional[int] = None, max_height: Optional[int] = None, image_format: Optional[str] = None, profile: Optional[str] = None) -> tuple[bytes, float, float]:
+        """
+        Renderiza la primera página del documento como imagen optimizada.
+
+        Las plantillas overlay se dibujan directamente sobre el bitmap cacheado de la
+        página base; el resto (y cualquier fallo del camino directo) pasa por
+        render_to_pdf + convert_pdf_to_image.
+
+        Args:
+            dpi: Resolución de rasterizado (por defecto escala 2.0)
+            max_width: Ancho máximo de la imagen en px
+            max_height: Alto máximo de la imagen en px
+            image_format: "webp" (por defecto) | "jpeg" | "png"
+            profile: "fast" | "balanced" | "smallest" (ver ENCODE_PROFILES)
+
+        Returns:
+            Tuple con (bytes de imagen optimizada, ancho_imagen, alto_imagen)
+        """
+        version = self.store.get_template_version(template_id)
+        # Memo de calidad del codificador por plantilla (ver save_with_target_filesize)
+        quality_key = (template_id, version)
+        pil_image = self._raster_overlay_first_page(template_id, data, version, dpi, max_width, max_height)
+        if pil_image is not None:
+            return self._encode_page_image(
+                pil_image, *raster_box(dpi, max_width, max_height),
+                quality_key=quality_key, image_format=image_format, profile=profile,
+            )
+        return self.convert_pdf_to_image(
+            self.render_to_pdf(template_id, data), dpi, max_width, max_height,
+            quality_key=quality_key, image_format=image_format, profile=profile,
+        )
+
+    def _raster_overlay_first_page(self, template_id: str, data: Dict[str, Any], version: Optional[str], dpi: Optional[float], max_width: Optional[int], max_height: Optional[int]):
+        """
+        Primera página de una plantilla overlay dibujada directamente sobre el
+        bitmap cacheado de la página base (sin PDF intermedio). Devuelve None si la
+        plantilla no es overlay, el camino directo está desactivado o falla.
+        """
+        meta = self.store.get_template_meta(template_id)
+        mapping = meta.get("mapping", {})
+        if not (RASTER_FAST_PATH and meta["kind"] == "pdf" and mapping.get("_positions")):
+            return None
+        validate_payload(data, meta.get("schema"))
+        context = self._apply_mapping(data, mapping)
+        tpl_path = self.store.get_template_file(template_id)
+        try:
+            scale = raster_scale(*_template_page_size(tpl_path, version), dpi, max_width, max_height)
+            return self._render_pdf_overlay(
+                tpl_path, context, original_data=data, mapping=mapping,
+                template_version=version, raster_scale=scale,
+            )
+        except Exception as e:
+            print(f"⚠️  Rasterizado directo falló, usando PDF intermedio: {e}")
+            return None
+
+    def render_outputs(self, template_id: str, data: Dict[str, Any], outputs: List[str], thumbnail_sizes: Optional[List[int]] = None, dpi: Optional[float] = None, max_width: Optional[int] = None, max_height: Optional[int] = None, image_format: Optional[str] = None, profile: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Genera varias salidas ("pdf", "image", "thumbnail") de un único render.
+
+        El documento se renderiza una vez y su primera página se rasteriza una vez
+        (al tamaño de "image" o, si solo hay miniaturas, al de la mayor); la imagen
+        y las miniaturas salen de ese mismo bitmap, de mayor a menor tamaño. Sin
+        "pdf", las plantillas overlay usan el rasterizado directo.
+
+        Args:
+            outputs: Salidas pedidas
+            thumbnail_sizes: Lado máximo (px) de cada miniatura (por defecto [256])
+            dpi, max_width, max_height, image_format, profile: como render_to_image
+
+        Returns:
+            Dict con "pdf" (bytes), "image" (bytes, ancho, alto) y "thumbnails"
+            [(lado máximo, bytes, ancho, alto)], según lo pedido
+        """
+        wanted = set(outputs)
+        result: Dict[str, Any] = {}
+        pdf_bytes = None
+        if "pdf" in wanted:
+            pdf_bytes = self.render_to_pdf(template_id, data)
+            result["pdf"] = pdf_bytes
+        if not wanted & {"image", "thumbnail"}:
+            return result
+
+        version = self.store.get_template_version(template_id)
+        sizes = sorted(set(thumbnail_sizes or [256]), reverse=True) if "thumbnail" in wanted else []
+        if "image" not in wanted:
+            # Solo miniaturas: basta rasterizar al tamaño de la mayor
+            dpi, max_width, max_height = None, sizes[0], sizes[0]
+        encode_kwargs = _page_encode_kwargs(raster_box(dpi, max_width, max_height), (template_id, version), image_format, profile) if "image" in wanted else None
+        thumbnail_kwargs = {"target_kb": None, "format_hint": image_format or "webp", "max_width": None, "max_height": None, "profile": profile}
+
+        page = self._raster_overlay_first_page(template_id, data, version, dpi, max_width, max_height) if pdf_bytes is None else None
+        if page is not None:
+            result.update(encode_outputs(page, encode_kwargs, sizes, thumbnail_kwargs))
+            return result
+        if pdf_bytes is None:
+            pdf_bytes = self.render_to_pdf(template_id, data)
+        # Rasterizado y codificación en el pool: solo vuelven los bytes codificados
+        result.update(_raster_outputs(pdf_bytes, partial(raster_scale, dpi=dpi, max_width=max_width, max_height=max_height), encode_kwargs, sizes, thumbnail_kwargs))
+        return result
+
+    def render_pages_to_images(self, template_id: str, data: Dict[str, Any], pages: Optional[str] = None, dpi: Optional[float] = None, max_width: Optional[int] = None, max_height: Optional[int] = None, image_format: Optional[str] = None, profile: Optional[str] = None, pdf_bytes: Optional[bytes] = None) -> Tuple[List[int], Iterator[Tuple[bytes, int, int]]]:
+        """
+        Renderiza varias páginas del documento como imágenes optimizadas.
+
+        El PDF se genera una vez en este proceso; el rasterizado y la codificación
+        de las páginas se reparten en el pool de procesos (ver raster_pool).
+        Los errores de plantilla, datos o rango saltan aquí, antes de devolver el
+        iterador, para que el llamador pueda responder con un error normal.
+
+        Args:
+            pages: "all" (por defecto) o rangos base 1, p. ej. "1-3,5"
+            dpi, max_width, max_height, image_format, profile: como render_to_image
+            pdf_bytes: PDF ya renderizado de (template_id, data), si lo hay
+
+        Returns:
+            Tuple con (números de página base 1, iterador de (bytes, ancho, alto)
+            en ese mismo orden)
+        """
+        if pdf_bytes is None:
+            pdf_bytes = self.render_to_pdf(template_id, data)
+        page_indices = parse_page_range(pages, len(PdfReader(io.BytesIO(pdf_bytes)).pages))
+        version = self.store.get_template_version(template_id)
+        encode_kwargs = _page_encode_kwargs(raster_box(dpi, max_width, max_height), (template_id, version), image_format, profile)
+        # Los workers abren el PDF desde disco en lugar de recibir una copia por tarea
+        tmp = scratch_tempdir()
+        pdf_path = os.path.join(tmp.name, "document.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(pdf_bytes)
+        results = get_raster_pool().render_pages(
+            pdf_path, page_indices,
+            partial(raster_scale, dpi=dpi, max_width=max_width, max_height=max_height),
+            encode_kwargs,
+        )
+
+        def iter_results() -> Iterator[Tuple[bytes, int, int]]:
+            try:
+                yield from results
+            finally:
+                results.close()
+                tmp.cleanup()
+
+        return [i + 1 for i in page_indices], iter_results()
+
     def _apply_mapping(self, data: Dict[str, Any], mapping: Dict[str, Any]) -> Dict[str, Any]:
         if not mapping:
             return data
@@ -66,7 +388,7 @@ class Renderer:
         return out
 
     def _render_docx_to_pdf(self, tpl_path: str, context: Dict[str, Any]) -> bytes:
-        with tempfile.TemporaryDirectory() as td:
+        with scratch_tempdir() as td:
             out_docx = os.path.join(td, "out.docx")
             out_pdf = os.path.join(td, "out.pdf")
             doc = DocxTemplate(tpl_path)
@@ -77,7 +399,7 @@ class Renderer:
                 return f.read()
 
     def _render_xlsx_to_pdf(self, tpl_path: str, context: Dict[str, Any]) -> bytes:
-        with tempfile.TemporaryDirectory() as td:
+        with scratch_tempdir() as td:
             out_xlsx = os.path.join(td, "out.xlsx")
             out_pdf = os.path.join(td, "out.pdf")
             wb = load_workbook(tpl_path)
@@ -96,25 +418,44 @@ class Renderer:
             with open(out_pdf, "rb") as f:
                 return f.read()
 
-    def _render_pdf_acroform(self, tpl_path: str, context: Dict[str, Any]) -> bytes:
-        with tempfile.TemporaryDirectory() as td:
-            reader = PdfReader(tpl_path)
-            writer = PdfWriter()
-            for page in reader.pages:
-                writer.add_page(page)
-            fields = {}
-            for key, val in context.items():
-                if key.startswith("_"):
-                    continue
-                fields[key] = "" if val is None else str(val)
-            writer.update_page_form_field_values(writer.pages[0], fields)
-            out_path = os.path.join(td, "out.pdf")
-            with open(out_path, "wb") as f:
-                writer.write(f)
-            with open(out_path, "rb") as f:
-                return f.read()
+    def _render_pdf_acroform(self, tpl_path: str, context: Dict[str, Any], revision_id: Optional[bytes] = None) -> bytes:
+        """
+        Rellena los campos AcroForm de la plantilla. Con 'revision_id' el segundo
+        elemento del /ID del trailer (el de esta revisión) es ese valor; el primero
+        (identificador permanente) se conserva.
+        """
+        fields = {}
+        for key, val in context.items():
+            if key.startswith("_"):
+                continue
+            fields[key] = "" if val is None else str(val)
+        with open(tpl_path, "rb") as f:
+            original = f.read()
+        if ACROFORM_MODE == "incremental":
+            try:
+                return fill_acroform_incremental(original, fields, revision_id=revision_id)
+            except Exception as e:
+                print(f"⚠️  Actualización incremental no aplicable ({e}), reescribiendo PDF completo")
+        reader = PdfReader(io.BytesIO(original))
+        # clone_from conserva /AcroForm (con add_page los campos no se pueden rellenar)
+        writer = PdfWriter(clone_from=reader)
+        writer.update_page_form_field_values(writer.pages[0], fields)
+        if revision_id is not None and writer._ID:
+            # clone_from copia el /ID original; se sustituye el de la revisión
+            writer._ID = ArrayObject([writer._ID[0], ByteStringObject(revision_id)])
+        out = io.BytesIO()
+        writer.write(out)
+        return out.getvalue()
+
+    def _render_pdf_overlay(self, tpl_path: str, context: Dict[str, Any], original_data: Dict[str, Any], mapping: Dict[str, Any], template_version: Optional[str] = None, raster_scale: Optional[float] = None, stream_id: Optional[bytes] = None) -> Any:
+        """
+        Dibuja los datos sobre la plantilla PDF en las posiciones del mapping.
 
-    def _render_pdf_overlay(self, tpl_path: str, context: Dict[str, Any], original_data: Dict[str, Any], mapping: Dict[str, Any]) -> bytes:
+        Con 'raster_scale' no se genera PDF: se dibuja solo la primera página con
+        Pillow sobre el bitmap de la página base y se devuelve la imagen PIL.
+        Con 'stream_id' se devuelve un iterador de trozos del PDF (con ese /ID),
+        escrito por lotes de páginas según se dibujan (ver pdf_stream).
+        """
         positions = mapping.get("_positions", {})
         repeat_rows_cfg = mapping.get("_repeat_rows", {})
         header_positions = mapping.get("_header_positions", {})
@@ -145,13 +486,6 @@ class Renderer:
             apply_style_for_key(key)
             c.drawString(float(x) + offset_x, float(y) + offset_y, "" if value is None else str(value))
 
-        def draw_cross(x: float, y: float, size: float = 4.0):
-            cx = float(x) + offset_x
-            cy = float(y) + offset_y
-            c.setLineWidth(0.5)
-            c.line(cx - size, cy, cx + size, cy)
-            c.line(cx, cy - size, cx, cy + size)
-
         def get_path(d: Dict[str, Any], path: str):
             cur: Any = d
             for part in path.split('.'):
@@ -163,311 +497,289 @@ class Renderer:
                     break
             return cur
 
-        with tempfile.TemporaryDirectory() as td:
-            overlay_path = os.path.join(td, "overlay.pdf")
-            base_reader = PdfReader(tpl_path)
-            first_page = base_reader.pages[0]
-            width = float(first_page.mediabox.width)
-            height = float(first_page.mediabox.height)
-
-            def to_pdf_coords(xy: tuple[float, float]) -> tuple[float, float]:
-                # positions are stored in image pixels; preview_scale expresses pixels per PDF point
-                px, py = float(xy[0]), float(xy[1])
-                return (px / preview_scale, py / preview_scale)
-
-            def norm_positions_dict(d: Dict[str, Any]) -> Dict[str, tuple[float, float]]:
-                out = {}
-                for k, v in d.items():
-                    try:
-                        out[k] = to_pdf_coords(v)
-                    except Exception:
-                        out[k] = v
-                return out
-
-            positions_pdf = norm_positions_dict(positions)
-            header_pdf = norm_positions_dict(header_positions)
-            footer_pdf = norm_positions_dict(footer_positions)
-
-            images_cfg = mapping.get("_images", {}) or {}
-            image_previews = mapping.get("_image_previews", {}) or {}
-            signatures_cfg = mapping.get("_signatures", {}) or {}
-
-            arr_path = None
-            arr_def = None
-            if repeat_rows_cfg:
-                arr_path, arr_def = next(iter(repeat_rows_cfg.items()))
-            items: List[Any] = get_path(original_data, arr_path) if arr_path else []
-            if items is None or not isinstance(items, list):
-                items = []
-
-            rows_per_page = int(arr_def.get("rowsPerPage", 0)) if arr_def else 0
-            start_y = float(arr_def.get("startY", 700)) if arr_def else 700.0
-            delta_y = float(arr_def.get("deltaY", 24)) if arr_def else 24.0
-            end_y = arr_def.get("endY") if arr_def else None
-            if not rows_per_page and end_y is not None:
+        overlay_buf = io.BytesIO()
+        base_source: Any = tpl_path
+        width, height = _template_page_size(tpl_path, template_version)
+
+        def to_pdf_coords(xy: tuple[float, float]) -> tuple[float, float]:
+            # positions are stored in image pixels; preview_scale expresses pixels per PDF point
+            px, py = float(xy[0]), float(xy[1])
+            return (px / preview_scale, py / preview_scale)
+
+        def norm_positions_dict(d: Dict[str, Any]) -> Dict[str, tuple[float, float]]:
+            out = {}
+            for k, v in d.items():
                 try:
-                    end_y = float(end_y)
-                    if delta_y > 0:
-                        rows_per_page = max(1, int((start_y - end_y) / delta_y) + 1)
+                    out[k] = to_pdf_coords(v)
                 except Exception:
-                    rows_per_page = 0
-            if not rows_per_page:
-                rows_per_page = max(1, int((start_y) / max(delta_y, 1)))
-
-            total_pages = max(1, math.ceil(len(items) / rows_per_page))
-
-            c = canvas.Canvas(overlay_path, pagesize=(width, height))
-
-            def draw_header_footer(page_index: int):
-                for key, (x, y) in header_pdf.items():
-                    val = context.get(key)
-                    if key == "_page_number":
-                        val = str(page_index + 1)
-                    if key == "_page_count":
-                        val = str(total_pages)
-                    draw_text(key, x, y, val)
-                for key, (x, y) in footer_pdf.items():
-                    val = context.get(key)
-                    if key == "_page_number":
-                        val = str(page_index + 1)
-                    if key == "_page_count":
-                        val = str(total_pages)
-                    draw_text(key, x, y, val)
-
-            def draw_fixed_positions():
-                for key, value in context.items():
-                    if key.startswith("_"):
-                        continue
-                    if arr_path and key.startswith(arr_path + "."):
-                        continue
-                    pos = positions_pdf.get(key)
-                    if pos:
-                        x, y = pos
-                        draw_text(key, x, y, value)
-
-            def decode_data_url(data_url_or_b64: str | bytes | None) -> bytes | None:
-                if not data_url_or_b64:
-                    return None
-                if isinstance(data_url_or_b64, bytes):
-                    return data_url_or_b64
-                s = str(data_url_or_b64)
+                    out[k] = v
+            return out
+
+        positions_pdf = norm_positions_dict(positions)
+        header_pdf = norm_positions_dict(header_positions)
+        footer_pdf = norm_positions_dict(footer_positions)
+
+        images_cfg = mapping.get("_images", {}) or {}
+        image_previews = mapping.get("_image_previews", {}) or {}
+        signatures_cfg = mapping.get("_signatures", {}) or {}
+
+        arr_path = None
+        arr_def = None
+        if repeat_rows_cfg:
+            arr_path, arr_def = next(iter(repeat_rows_cfg.items()))
+        # Lista del payload JSON o RowStream (entrada NDJSON: items leídos bajo demanda)
+        items: Union[List[Any], RowStream] = get_path(original_data, arr_path) if arr_path else []
+        if not isinstance(items, (list, RowStream)):
+            items = []
+
+        row_layout = RepeatRowLayout(arr_path, arr_def or {}, positions_pdf, styles, default_style) if arr_path else None
+        total_pages = row_layout.page_count(len(items)) if row_layout else 1
+
+        # Capa estática: lo que no depende del request (recuadros de firma, imágenes
+        # de la plantilla no sustituidas por el payload y textos constantes de
+        # cabecera/pie) se dibuja una vez por versión de plantilla y se cachea ya
+        # fusionado con la página base. Cada render solo dibuja lo dinámico, que
+        # queda por encima de toda la capa: las imágenes estáticas y las firmas
+        # pasan debajo de los textos y de las imágenes del payload.
+        static_text_keys: set = set()
+        static_image_keys: set = set()
+        if template_version is not None:
+            for key in list(header_pdf) + list(footer_pdf):
+                if key in ("_page_number", "_page_count") or key in original_data:
+                    continue
+                if isinstance(mapping.get(key), str):
+                    continue
+                static_text_keys.add(key)
+            static_image_keys = {k for k in images_cfg if context.get(k) is None}
+        # Se decide tras resolver las imágenes (una imagen estática sin vista previa no cuenta)
+        use_static_layer = False
+
+        def draw_header_footer(page_index: int):
+            for key, (x, y) in header_pdf.items():
+                if use_static_layer and key in static_text_keys:
+                    continue
+                val = context.get(key)
+                if key == "_page_number":
+                    val = str(page_index + 1)
+                if key == "_page_count":
+                    val = str(total_pages)
+                draw_text(key, x, y, val)
+            for key, (x, y) in footer_pdf.items():
+                if use_static_layer and key in static_text_keys:
+                    continue
+                val = context.get(key)
+                if key == "_page_number":
+                    val = str(page_index + 1)
+                if key == "_page_count":
+                    val = str(total_pages)
+                draw_text(key, x, y, val)
+
+        def draw_fixed_positions():
+            for key, value in context.items():
+                if key.startswith("_"):
+                    continue
+                if arr_path and key.startswith(arr_path + "."):
+                    continue
+                pos = positions_pdf.get(key)
+                if pos:
+                    x, y = pos
+                    draw_text(key, x, y, value)
+
+        # Cada imagen se incrusta una sola vez por documento como Form XObject
+        # y se referencia desde todas las páginas (doForm)
+        image_forms: set = set()
+
+        def resolve_image(key: str):
+            # choose data: prefer context value, else preview
+            ctx_val = context.get(key)
+            source = None
+            if ctx_val is not None:
+                if is_remote_url(ctx_val):
+                    # Descargada una sola vez por render (ver prefetch_images)
+                    source = remote_images.get(ctx_val)
+                    if not source:
+                        print(f"❌ Imagen remota no disponible para {key}: {ctx_val}")
+                        return None
+                else:
+                    source = ctx_val
+            try:
+                resolved = get_image_reader(source) if source is not None else None
+                if resolved is None:
+                    resolved = get_image_reader(image_previews.get(key))
+                return resolved
+            except Exception as e:
+                print(f"❌ Error cargando imagen para {key}: {e}")
+                return None
+
+        def draw_images(keys):
+            for key in keys:
+                meta, resolved = resolved_images[key]
+                content_hash, img_reader = resolved
+                # convert px to pt and apply offset
+                x_pt = float(meta.get("x", 0.0)) / preview_scale + offset_x
+                y_pt = float(meta.get("y", 0.0)) / preview_scale + offset_y
+                w_pt = float(meta.get("width", 100.0)) / preview_scale
+                h_pt = float(meta.get("height", 100.0)) / preview_scale
+                # y_pt is the top-left anchor in our coordinate? We defined (x,y) as bottom-left of text; for images, assume (x,y) is bottom-left
+                # drawImage expects lower-left
+                form_name = f"gdimg_{content_hash}_{w_pt:.2f}x{h_pt:.2f}"
                 try:
-                    if s.startswith("data:") and ";base64," in s:
-                        b64 = s.split(",",1)[1]
-                        import base64
-                        return base64.b64decode(b64)
-                    # raw base64
-                    import base64
-                    return base64.b64decode(s)
-                except Exception:
-                    return None
-
-            def draw_images():
-                for key, meta in images_cfg.items():
-                    # choose data: prefer context value, else preview
-                    data_bytes = None
-                    ctx_val = context.get(key)
-                    
-                    if ctx_val is not None:
-                        # Check if it's a URL
-                        if isinstance(ctx_val, str) and (ctx_val.startswith('http://') or ctx_val.startswith('https://')):
-                            try:
-                                import requests
-                                print(f"📥 Descargando imagen desde: {ctx_val}")
-                                response = requests.get(ctx_val, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
-                                print(f"📊 Status: {response.status_code}, Content-Type: {response.headers.get('content-type', 'N/A')}")
-                                
-                                if response.status_code == 200:
-                                    content_type = response.headers.get('content-type', '').lower()
-                                    
-                                    # Handle SVG files - convert to PNG or skip
-                                    if 'svg' in content_type:
-                                        # For SVG, try to convert or use a fallback
-                                        try:
-                                            # Try to convert SVG to PNG using cairosvg if available
-                                            import cairosvg
-                                            png_data = cairosvg.svg2png(bytestring=response.content)
-                                            data_bytes = png_data
-                                            print(f"✅ SVG convertido a PNG para {key}: {len(png_data)} bytes")
-                                        except ImportError:
-                                            # If cairosvg not available, skip SVG files
-                                            print(f"⚠️ SVG no soportado para {key}, saltando")
-                                            continue
-                                    else:
-                                        # For other image types, use as-is
-                                        data_bytes = response.content
-                                        print(f"✅ Imagen descargada para {key}: {len(data_bytes)} bytes")
-                                else:
-                                    print(f"❌ Error HTTP: {response.status_code}")
-                                    continue
-                            except Exception as e:
-                                print(f"❌ Error descargando imagen para {key}: {e}")
-                                continue
-                        else:
-                            # Try as data URL
-                            data_bytes = decode_data_url(ctx_val)
-                    
-                    if not data_bytes:
-                        data_bytes = decode_data_url(image_previews.get(key))
-                    
-                    if not data_bytes:
-                        continue
-                    
-                    try:
-                        img_reader = ImageReader(io.BytesIO(data_bytes))
-                        print(f"✅ Imagen cargada para {key}: {img_reader.getSize()}")
-                    except Exception as e:
-                        print(f"❌ Error cargando imagen para {key}: {e}")
-                        continue
-                    
-                    # convert px to pt and apply offset
-                    x_pt = float(meta.get("x", 0.0)) / preview_scale + offset_x
-                    y_pt = float(meta.get("y", 0.0)) / preview_scale + offset_y
-                    w_pt = float(meta.get("width", 100.0)) / preview_scale
-                    h_pt = float(meta.get("height", 100.0)) / preview_scale
-                    # y_pt is the top-left anchor in our coordinate? We defined (x,y) as bottom-left of text; for images, assume (x,y) is bottom-left
-                    # drawImage expects lower-left
-                    try:
-                        c.drawImage(img_reader, x_pt, y_pt - h_pt + h_pt, width=w_pt, height=h_pt, preserveAspectRatio=True, mask='auto')
-                        print(f"✅ Imagen dibujada para {key} en ({x_pt:.1f}, {y_pt:.1f}) tamaño {w_pt:.1f}x{h_pt:.1f}")
-                    except Exception as e:
-                        print(f"❌ Error dibujando imagen para {key}: {e}")
-                        continue
-
-            def draw_signatures():
-                for key, meta in signatures_cfg.items():
-                    # convert px to pt and apply offset
-                    x_pt = float(meta.get("x", 0.0)) / preview_scale + offset_x
-                    y_pt = float(meta.get("y", 0.0)) / preview_scale + offset_y
-                    w_pt = float(meta.get("width", 200.0)) / preview_scale
-                    h_pt = float(meta.get("height", 300.0)) / preview_scale
-                    
-                    try:
-                        # Draw signature rectangle
-                        c.setLineWidth(1.0)
-                        c.setStrokeColor(HexColor("#000000"))
-                        c.rect(x_pt, y_pt - h_pt, w_pt, h_pt)
-                        print(f"✅ Firma dibujada para {key} en ({x_pt:.1f}, {y_pt:.1f}) tamaño {w_pt:.1f}x{h_pt:.1f}")
-                    except Exception as e:
-                        print(f"❌ Error dibujando firma para {key}: {e}")
-                        continue
-
-            for page_idx in range(total_pages):
-                draw_header_footer(page_idx)
-                draw_fixed_positions()
-                draw_images()
+                    if form_name not in image_forms:
+                        c.beginForm(form_name, 0, 0, w_pt, h_pt)
+                        c.drawImage(img_reader, 0, 0, width=w_pt, height=h_pt, preserveAspectRatio=True, mask='auto')
+                        c.endForm()
+                        image_forms.add(form_name)
+                    c.saveState()
+                    c.translate(x_pt, y_pt)
+                    c.doForm(form_name)
+                    c.restoreState()
+                except Exception as e:
+                    print(f"❌ Error dibujando imagen para {key}: {e}")
+                    continue
+
+        def draw_signatures():
+            for key, meta in signatures_cfg.items():
+                # convert px to pt and apply offset
+                x_pt = float(meta.get("x", 0.0)) / preview_scale + offset_x
+                y_pt = float(meta.get("y", 0.0)) / preview_scale + offset_y
+                w_pt = float(meta.get("width", 200.0)) / preview_scale
+                h_pt = float(meta.get("height", 300.0)) / preview_scale
+                
+                try:
+                    # Draw signature rectangle
+                    c.setLineWidth(1.0)
+                    c.setStrokeColor(HexColor("#000000"))
+                    c.rect(x_pt, y_pt - h_pt, w_pt, h_pt)
+                    print(f"✅ Firma dibujada para {key} en ({x_pt:.1f}, {y_pt:.1f}) tamaño {w_pt:.1f}x{h_pt:.1f}")
+                except Exception as e:
+                    print(f"❌ Error dibujando firma para {key}: {e}")
+                    continue
+
+        # Todas las URLs de imágenes del payload se descargan en paralelo antes de dibujar
+        remote_images = prefetch_images(
+            context.get(key) for key in images_cfg if is_remote_url(context.get(key))
+        )
+        resolved_images = {}
+        for key, meta in images_cfg.items():
+            resolved = resolve_image(key)
+            if resolved is not None:
+                resolved_images[key] = (meta, resolved)
+
+        static_image_keys &= set(resolved_images)
+        use_static_layer = bool(signatures_cfg or static_image_keys or static_text_keys) and template_version is not None
+        dynamic_image_keys = [k for k in resolved_images if not (use_static_layer and k in static_image_keys)]
+
+        layer_key = None
+        if use_static_layer:
+            layer_key = (tpl_path, template_version, tuple(sorted(static_image_keys)), tuple(sorted(static_text_keys)))
+            composed = _static_layers.get(layer_key)
+            if composed is None:
+                # Los helpers dibujan sobre el canvas actual 'c': primero la capa estática
+                static_buf = io.BytesIO()
+                c = canvas.Canvas(static_buf, pagesize=(width, height), invariant=DETERMINISTIC_PDF)
+                for key, (x, y) in list(header_pdf.items()) + list(footer_pdf.items()):
+                    if key in static_text_keys:
+                        draw_text(key, x, y, context.get(key))
+                draw_images([k for k in resolved_images if k in static_image_keys])
                 draw_signatures()
-                debug_lines = []
-                debug_lines.append(f"scale={preview_scale}, offset=({offset_x:.1f},{offset_y:.1f}), page= {page_idx+1}/{total_pages}, size=({width:.1f},{height:.1f})")
-                # Fixed fields debug
-                for key, (x_pt, y_pt) in positions_pdf.items():
-                    if arr_path and key.startswith(arr_path + "."):
-                        continue
-                    final_x = x_pt + offset_x
-                    final_y = y_pt + offset_y
-                    x_px, y_px = positions.get(key, (None, None))
-                    if x_px is None:
-                        continue
-                    debug_lines.append(f"{key}: px=({x_px:.1f},{y_px:.1f}) -> pt=({x_pt:.1f},{y_pt:.1f}) final=({final_x:.1f},{final_y:.1f})")
-                    # draw crosshair at final position for visual check
-                    # draw_cross(x_pt, y_pt)  # Comentado: no pintar cruces en el render final
-                # Repeat rows debug (only if array defined)
-                if arr_path:
-                    start_idx = page_idx * rows_per_page
-                    end_idx = min(len(items), start_idx + rows_per_page)
-                    for idx in range(start_idx, end_idx):
-                        y_item = start_y - (idx - start_idx) * delta_y
-                        prefix = arr_path + "."
-                        for key, (x_pt, y_pt_base) in positions_pdf.items():
-                            if key.startswith(prefix):
-                                final_x = x_pt + offset_x
-                                final_y = y_item + offset_y
-                                x_px, y_px = positions.get(key, (None, None))
-                                if x_px is None:
-                                    continue
-                                debug_lines.append(f"{key}[{idx}]: px=({x_px:.1f},{y_px:.1f}) -> base_pt=({x_pt:.1f},{y_pt_base if isinstance(y_pt_base,(int,float)) else 0:.1f}) y_item={y_item:.1f} final=({final_x:.1f},{final_y:.1f})")
-                                # draw_cross(x_pt, y_item)  # Comentado: no pintar cruces en el render final
-                # Draw debug lines in gray at top-left
-                # Comentado: no mostrar coordenadas de debug en el render final
-                # try:
-                #     c.setFont("Helvetica", 6)
-                # except Exception:
-                #     pass
-                # try:
-                #     c.setFillColor(HexColor("#666666"))
-                # except Exception:
-                #     pass
-                # y_cursor = height - 10
-                # for line in debug_lines[:100]:
-                #     c.drawString(10, y_cursor, line)
-                #     y_cursor -= 8
-                # Draw repeated rows content
-                if arr_path:
-                    start_idx = page_idx * rows_per_page
-                    end_idx = min(len(items), start_idx + rows_per_page)
-                    for idx in range(start_idx, end_idx):
-                        item = items[idx]
-                        y_item = start_y - (idx - start_idx) * delta_y
-                        prefix = arr_path + "."
-                        for key, (x, _) in positions_pdf.items():
-                            if key.startswith(prefix):
-                                sub_key = key[len(prefix):]
-                                val = get_path(item, sub_key)
-                                draw_text(key, x, y_item, val)
-                if page_idx < total_pages - 1:
-                    c.showPage()
-            c.save()
-
-            overlay_reader = PdfReader(overlay_path)
-            writer = PdfWriter()
-            base_page_count = len(base_reader.pages)
-            for i in range(total_pages):
-                base_page = base_reader.pages[min(i, base_page_count - 1)]
-                merged = base_page
-                if i < len(overlay_reader.pages):
-                    merged.merge_page(overlay_reader.pages[i])
-                writer.add_page(merged)
-
-            out_path = os.path.join(td, "out.pdf")
-            with open(out_path, "wb") as f:
-                writer.write(f)
-            with open(out_path, "rb") as f:
-                return f.read()
+                c.save()
+                image_forms.clear()
+                composed = _compose_static_layer(tpl_path, static_buf.getvalue())
+                _static_layers.put(layer_key, composed, len(composed))
+            base_source = composed
 
-    def _optimize_image(self, pil_image, target_size_kb: int) -> bytes:
+        pages = row_layout.paginate(items) if row_layout else iter([[]])
+
+        if raster_scale is not None:
+            raster_key = (tpl_path, template_version, layer_key, raster_scale)
+            base_image = _raster_bases.get(raster_key) if template_version is not None else None
+            if base_image is None:
+                base_image = get_raster_pool().run(rasterize_page, base_source, 0, raster_scale)
+                if template_version is not None:
+                    _raster_bases.put(raster_key, base_image, base_image.width * base_image.height * 3)
+            c = RasterCanvas(base_image, height, raster_scale)
+            draw_header_footer(0)
+            draw_fixed_positions()
+            draw_images(dynamic_image_keys)
+            if not use_static_layer:
+                draw_signatures()
+            if row_layout:
+                row_layout.draw_page(c, next(pages), offset_x, offset_y)
+            return c.image
+
+        def draw_page(page_idx: int, page_items: List[Any]):
+            draw_header_footer(page_idx)
+            draw_fixed_positions()
+            draw_images(dynamic_image_keys)
+            if not use_static_layer:
+                draw_signatures()
+            if row_layout:
+                row_layout.draw_page(c, page_items, offset_x, offset_y)
+
+        if stream_id is not None:
+            def overlay_batches() -> Iterator[bytes]:
+                # Un canvas por lote: solo las páginas del lote (y sus items) en memoria
+                nonlocal c
+                numbered = enumerate(pages)
+                while True:
+                    batch = list(islice(numbered, STREAM_BATCH_PAGES))
+                    if not batch:
+                        return
+                    batch_buf = io.BytesIO()
+                    c = canvas.Canvas(batch_buf, pagesize=(width, height), invariant=DETERMINISTIC_PDF)
+                    image_forms.clear()
+                    for n, (page_idx, page_items) in enumerate(batch):
+                        if n:
+                            c.showPage()
+                        draw_page(page_idx, page_items)
+                    c.save()
+                    yield batch_buf.getvalue()
+            return stream_overlay(base_source, overlay_batches(), stream_id)
+
+        c = canvas.Canvas(overlay_buf, pagesize=(width, height), invariant=DETERMINISTIC_PDF)
+        for page_idx, page_items in enumerate(pages):
+            if page_idx:
+                c.showPage()
+            draw_page(page_idx, page_items)
+        c.save()
+
+        return merge_overlay(base_source, overlay_buf.getvalue(), total_pages)
+
+    def _optimize_image(self, pil_image, target_size_kb: int, max_width: Optional[int] = RASTER_MAX_SIDE, max_height: Optional[int] = RASTER_MAX_SIDE, quality_key: Any = None, image_format: Optional[str] = None, profile: Optional[str] = None) -> tuple[bytes, int, int]:
         """
         Optimiza una imagen PIL usando el módulo avanzado de optimización.
         
         Args:
             pil_image: La imagen PIL a optimizar.
             target_size_kb: El tamaño objetivo en KB.
+            max_width: Ancho máximo (None = sin límite).
+            max_height: Alto máximo (None = sin límite).
+            quality_key: Clave del memo de calidad (p. ej. plantilla + versión).
+            image_format: Formato de salida (por defecto WebP).
+            profile: Perfil de esfuerzo del codificador.
             
         Returns:
-            Bytes de la imagen optimizada.
+            Tuple con (bytes de la imagen optimizada, ancho, alto).
         """
         print(f"🔄 Optimizando imagen usando algoritmo avanzado (objetivo: {target_size_kb}KB)...")
         
         try:
-            import io
-            from ..utils.image_optimizer import optimize_image_bytes
+            from ..utils.image_optimizer import optimize_image
             
-            # Convertir PIL Image a bytes
-            img_buffer = io.BytesIO()
-            pil_image.save(img_buffer, format='PNG')
-            img_bytes = img_buffer.getvalue()
-            
-            # Usar el módulo de optimización avanzada
-            optimized_bytes = optimize_image_bytes(
-                data=img_bytes,
+            # La imagen va directa al codificador (sin PNG intermedio)
+            optimized_bytes, width, height = optimize_image(
+                pil_image,
                 target_kb=int(target_size_kb * 1.2),  # Aumentar 20% el tamaño objetivo
-                format_hint="webp",  # WebP para mejor compresión
-                max_width=1600,      # Máximo ancho recomendado
-                max_height=1600,     # Máximo alto recomendado
-                doc_mode=False       # Mantener color (no escala de grises)
+                format_hint=image_format or "webp",  # WebP por defecto: mejor compresión
+                max_width=max_width,
+                max_height=max_height,
+                doc_mode=False,      # Mantener color (no escala de grises)
+                quality_key=quality_key,
+                profile=profile,
             )
             
             print(f"✅ Imagen optimizada: {len(optimized_bytes)} bytes")
-            return optimized_bytes
+            return optimized_bytes, width, height
             
         except ImportError as e:
             print(f"❌ Módulo de optimización no disponible: {e}")
@@ -480,7 +792,7 @@ class Renderer:
             # Fallback al método anterior
             return self._optimize_image_fallback(pil_image, target_size_kb)
 
-    def _optimize_image_fallback(self, pil_image, target_size_kb: int) -> bytes:
+    def _optimize_image_fallback(self, pil_image, target_size_kb: int) -> tuple[bytes, int, int]:
         """
         Método de fallback para optimización de imagen.
         """
@@ -516,7 +828,7 @@ class Renderer:
                 
                 if current_size_kb <= target_size_kb:
                     print(f"✅ Optimización JPEG exitosa: {current_size_kb:.1f}KB (calidad {quality})")
-                    return result
+                    return result, original_width, original_height
             
             # Estrategia 2: Reducir dimensiones gradualmente
             scale_factor = 1.0
@@ -542,26 +854,39 @@ class Renderer:
                 
                 if current_size_kb <= target_size_kb:
                     print(f"✅ Optimización exitosa: {current_size_kb:.1f}KB")
-                    return result
+                    return result, new_width, new_height
                 
                 scale_factor *= 0.85
             
             print(f"⚠️  No se pudo alcanzar el objetivo de {target_size_kb}KB, usando mejor versión disponible")
-            return result
+            return result, new_width, new_height
             
         except Exception as e:
             print(f"❌ Error en fallback: {e}")
             # Último recurso: devolver la imagen original
             img_io = io.BytesIO()
             pil_image.save(img_io, format='PNG')
-            return img_io.getvalue()
+            return (img_io.getvalue(), *pil_image.size)
+
+    def _encode_page_image(self, pil_image, max_width: Optional[int] = RASTER_MAX_SIDE, max_height: Optional[int] = RASTER_MAX_SIDE, quality_key: Any = None, image_format: Optional[str] = None, profile: Optional[str] = None) -> tuple[bytes, float, float]:
+        """
+        Optimiza una página rasterizada y devuelve (bytes, ancho_imagen, alto_imagen).
+        """
+        print(f"🖼️  Tamaño de imagen: {pil_image.size}, Modo: {pil_image.mode}")
+        # Optimizar la imagen para reducir tamaño (aumentar 20% calidad); el
+        # optimizador devuelve ya las dimensiones finales
+        optimized_image_bytes, final_image_width, final_image_height = self._optimize_image(pil_image, 216, max_width, max_height, quality_key, image_format, profile)
+        print(f"✅ Imagen optimizada: {len(optimized_image_bytes)} bytes")
+        print(f"📏 Dimensiones imagen final: {final_image_width}x{final_image_height}")
+        return optimized_image_bytes, final_image_width, final_image_height
 
-    def _convert_pdf_to_image_pil(self, pdf_bytes: bytes) -> tuple[bytes, float, float]:
+    def _convert_pdf_to_image_pil(self, pdf_bytes: bytes, dpi: Optional[float] = None, max_width: Optional[int] = None, max_height: Optional[int] = None, quality_key: Any = None, image_format: Optional[str] = None, profile: Optional[str] = None) -> tuple[bytes, float, float]:
         """
         Convierte PDF a imagen usando pypdfium2 (sin dependencias externas).
         
         Args:
             pdf_bytes: Bytes del PDF a convertir
+            dpi, max_width, max_height: Tamaño pedido (ver raster_scale)
             
         Returns:
             Tuple con (bytes de imagen optimizada, ancho_pdf_puntos, alto_pdf_puntos)
@@ -569,51 +894,16 @@ class Renderer:
         print("🔄 Intentando conversión con pypdfium2...")
         
         try:
-            import pypdfium2 as pdfium
-            from PIL import Image
-            import io
-            
             print(f"📄 Convirtiendo PDF de {len(pdf_bytes)} bytes...")
             
-            # Cargar PDF con pypdfium2
-            pdf = pdfium.PdfDocument(pdf_bytes)
-            print(f"✅ PDF cargado con {len(pdf)} páginas")
-            
-            if len(pdf) > 0:
-                # Renderizar primera página con mejor calidad
-                page = pdf[0]
-                
-                # Obtener dimensiones originales del PDF en puntos
-                original_pdf_width_points = page.get_width()
-                original_pdf_height_points = page.get_height()
-                
-                bitmap = page.render(
-                    scale=2.0,  # Mejor calidad inicial
-                    rotation=0,
-                    crop=(0, 0, 0, 0)
-                )
-                
-                # Convertir a PIL Image
-                pil_image = bitmap.to_pil()
-                print(f"🖼️  Tamaño de imagen: {pil_image.size}, Modo: {pil_image.mode}")
-                
-                # Optimizar la imagen para reducir tamaño (aumentar 20% calidad)
-                optimized_image_bytes = self._optimize_image(pil_image, target_size_kb=216)
-                print(f"✅ Imagen optimizada: {len(optimized_image_bytes)} bytes")
-                
-                # Obtener las dimensiones reales de la imagen optimizada
-                from PIL import Image
-                import io
-                optimized_pil_image = Image.open(io.BytesIO(optimized_image_bytes))
-                final_image_width, final_image_height = optimized_pil_image.size
-                
-                print(f"📏 Dimensiones imagen final: {final_image_width}x{final_image_height}")
-                print(f"📏 Dimensiones PDF original: {original_pdf_width_points}x{original_pdf_height_points}")
-                
-                return optimized_image_bytes, final_image_width, final_image_height
-            else:
-                print("❌ PDF no tiene páginas")
-                raise RuntimeError("PDF no tiene páginas")
+            # Renderizar la primera página directamente al tamaño final y codificarla
+            # en el pool de procesos de pdfium: el bitmap no sale del worker
+            image = _raster_outputs(
+                pdf_bytes, partial(raster_scale, dpi=dpi, max_width=max_width, max_height=max_height),
+                _page_encode_kwargs(raster_box(dpi, max_width, max_height), quality_key, image_format, profile),
+            )["image"]
+            print(f"✅ Imagen optimizada: {len(image[0])} bytes, {image[1]}x{image[2]}")
+            return image
                 
         except ImportError as e:
             print(f"❌ pypdfium2 no está disponible: {e}")
@@ -698,8 +988,7 @@ class Renderer:
             draw.text((50, 970), "GenDoc Service - Conversión PDF a Imagen", fill='gray', font=font_small)
             
             # Optimizar la imagen
-            optimized_image_bytes = self._optimize_image(img, target_size_kb=50)
-            return optimized_image_bytes, 595.0, 842.0  # A4 en puntos
+            return self._optimize_image(img, target_size_kb=50)
             
         except Exception as e:
             # Último recurso: imagen de error optimizada
@@ -710,15 +999,20 @@ class Renderer:
             draw = ImageDraw.Draw(img)
             draw.text((50, 80), "Error: No se pudo convertir PDF", fill='red')
             
-            optimized_image_bytes = self._optimize_image(img, target_size_kb=20)
-            return optimized_image_bytes, 595.0, 842.0  # A4 en puntos
+            return self._optimize_image(img, target_size_kb=20)
 
-    def convert_pdf_to_image(self, pdf_bytes: bytes) -> tuple[bytes, float, float]:
+    def convert_pdf_to_image(self, pdf_bytes: bytes, dpi: Optional[float] = None, max_width: Optional[int] = None, max_height: Optional[int] = None, quality_key: Any = None, image_format: Optional[str] = None, profile: Optional[str] = None) -> tuple[bytes, float, float]:
         """
         Convierte un PDF a imagen optimizada.
         
         Args:
             pdf_bytes: Bytes del PDF a convertir
+            dpi: Resolución de rasterizado (por defecto escala 2.0)
+            max_width: Ancho máximo de la imagen en px
+            max_height: Alto máximo de la imagen en px
+            quality_key: Clave del memo de calidad del codificador (opcional)
+            image_format: "webp" (por defecto) | "jpeg" | "png"
+            profile: "fast" | "balanced" | "smallest"
             
         Returns:
             Tuple con (bytes de imagen optimizada, ancho_pdf_puntos, alto_pdf_puntos)
@@ -727,7 +1021,7 @@ class Renderer:
         
         try:
             print("🔄 Intentando conversión con pypdfium2...")
-            result = self._convert_pdf_to_image_pil(pdf_bytes)
+            result = self._convert_pdf_to_image_pil(pdf_bytes, dpi, max_width, max_height, quality_key, image_format, profile)
             print(f"✅ Conversión exitosa (tamaño imagen: {len(result[0])} bytes)")
             return result
         except Exception as e:
@@ -0,0 +1,127 @@
+import math
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from reportlab.lib.colors import HexColor
+from reportlab.pdfbase import pdfmetrics
+
+_FALLBACK_FONT = "Helvetica"
+_FALLBACK_COLOR = "#111111"
+
+
+class _Column:
+    __slots__ = ("key", "parts", "x", "font", "size", "color")
+
+    def __init__(self, key: str, parts: Tuple[str, ...], x: float, font: str, size: float, color: Any):
+        self.key = key
+        self.parts = parts
+        self.x = x
+        self.font = font
+        self.size = size
+        self.color = color
+
+
+def _lookup(item: Any, parts: Tuple[str, ...]) -> Any:
+    cur = item
+    for part in parts:
+        if not isinstance(cur, dict):
+            return None
+        cur = cur.get(part)
+        if cur is None:
+            return None
+    return cur
+
+
+class RepeatRowLayout:
+    """
+    Motor de filas repetidas (_repeat_rows) para plantillas overlay.
+
+    Todo lo que no depende de los datos se calcula una sola vez al construir el
+    layout: columnas (clave, ruta dentro del item, x, fuente, color), filas por
+    página y la coordenada Y de cada fila. Después los items se consumen página
+    a página desde cualquier iterable, sin indexar ni copiar la lista completa.
+    """
+
+    def __init__(
+        self,
+        arr_path: str,
+        arr_def: Dict[str, Any],
+        positions_pdf: Dict[str, Any],
+        styles: Dict[str, Any],
+        default_style: Dict[str, Any],
+    ):
+        self.arr_path = arr_path
+        prefix = arr_path + "."
+
+        rows_per_page = int(arr_def.get("rowsPerPage", 0) or 0)
+        start_y = float(arr_def.get("startY", 700))
+        delta_y = float(arr_def.get("deltaY", 24))
+        end_y = arr_def.get("endY")
+        if not rows_per_page and end_y is not None:
+            try:
+                end_y = float(end_y)
+                if delta_y > 0:
+                    rows_per_page = max(1, int((start_y - end_y) / delta_y) + 1)
+            except Exception:
+                rows_per_page = 0
+        if not rows_per_page:
+            rows_per_page = max(1, int((start_y) / max(delta_y, 1)))
+        self.rows_per_page = rows_per_page
+        self.start_y = start_y
+        self.delta_y = delta_y
+        # Coordenadas Y de todas las filas de una página (idénticas en cada página)
+        self.row_y: List[float] = [start_y - i * delta_y for i in range(rows_per_page)]
+
+        self.columns: List[_Column] = []
+        for key, pos in positions_pdf.items():
+            if not key.startswith(prefix):
+                continue
+            try:
+                x = float(pos[0])
+            except Exception:
+                continue
+            style = styles.get(key, default_style)
+            font = style.get("font", default_style.get("font", _FALLBACK_FONT))
+            size = float(style.get("size", default_style.get("size", 10)))
+            try:
+                pdfmetrics.getFont(font)
+            except Exception:
+                font = _FALLBACK_FONT
+            try:
+                color = HexColor(style.get("color", default_style.get("color", _FALLBACK_COLOR)))
+            except Exception:
+                color = HexColor(_FALLBACK_COLOR)
+            self.columns.append(_Column(key, tuple(key[len(prefix):].split(".")), x, font, size, color))
+
+    def page_count(self, item_count: int) -> int:
+        return max(1, math.ceil(item_count / self.rows_per_page))
+
+    def paginate(self, items: Optional[Iterable[Any]]) -> Iterator[List[Any]]:
+        """Agrupa los items en páginas; siempre produce al menos una página (vacía)."""
+        # 'items' puede ser un RowStream: bool() contaría todas sus líneas
+        it = iter(items if items is not None else ())
+        first = True
+        while True:
+            page = list(islice(it, self.rows_per_page))
+            if not page and not first:
+                return
+            first = False
+            yield page
+            if len(page) < self.rows_per_page:
+                return
+
+    def draw_page(self, c, page_items: List[Any], offset_x: float = 0.0, offset_y: float = 0.0):
+        """Dibuja las filas de una página con un único objeto de texto, columna a columna."""
+        if not page_items or not self.columns:
+            return
+        rows_y = [y + offset_y for y in self.row_y[:len(page_items)]]
+        text = c.beginText()
+        for col in self.columns:
+            text.setFont(col.font, col.size)
+            text.setFillColor(col.color)
+            x = col.x + offset_x
+            parts = col.parts
+            for item, y in zip(page_items, rows_y):
+                value = _lookup(item, parts)
+                text.setTextOrigin(x, y)
+                text.textOut("" if value is None else str(value))
+        c.drawText(text)
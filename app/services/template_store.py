@@ -2,11 +2,85 @@ import os
 import shutil
 import uuid
 import json
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from fastapi import UploadFile
+from pypdf import PdfReader
+from ..utils.pdf_preview import get_preview_scale
 
 SUPPORTED_EXTENSIONS = {".docx": "docx", ".xlsx": "xlsx", ".pdf": "pdf"}
 
+# Tamaño de página cuando no se puede leer de la plantilla (docx/xlsx): A4
+DEFAULT_PAGE_SIZE = (595.32, 841.92)
+# Tamaño por defecto (puntos) de las firmas deducidas de _positions
+_POSITION_SIGNATURE_SIZE = (200.0, 100.0)
+
+
+def _is_signature_key(key: str) -> bool:
+    low = key.lower()
+    return "firma" in low or "signature" in low
+
+
+def compile_signature_geometry(mapping: Dict[str, Any], page_size: Tuple[float, float]) -> Dict[str, Any]:
+    """
+    Geometría de los campos de firma de una plantilla, resuelta una sola vez al
+    guardar el mapping.
+
+    Fuentes: los recuadros de '_signatures' (los que dibuja el renderizador) y,
+    por compatibilidad, las claves de '_positions' que contienen "firma" o
+    "signature" (un punto; recuadro de 200x100 pt). Ambas están en píxeles de la
+    vista previa del editor, así que se pasan a puntos con '_preview_scale' y
+    '_offset', igual que hace _render_pdf_overlay.
+
+    Returns:
+        {"page_size": [ancho, alto], "signatures": {clave: {...}}} donde cada firma
+        lleva x, y (esquina superior izquierda, origen abajo-izquierda), width y
+        height en puntos PDF, y nx, ny, nw, nh normalizados a la página con origen
+        arriba-izquierda (para escalar a cualquier imagen multiplicando), y
+        "source" ("positions" o "signatures").
+    """
+    page_w, page_h = page_size
+    preview_scale = float(mapping.get("_preview_scale", get_preview_scale()) or get_preview_scale())
+    offset = mapping.get("_offset", {}) or {}
+    offset_x = float(offset.get("x", 0) or 0)
+    offset_y = float(offset.get("y", 0) or 0)
+
+    boxes: Dict[str, Tuple[str, float, float, float, float]] = {}
+    for key, coords in (mapping.get("_positions", {}) or {}).items():
+        if not _is_signature_key(key) or not isinstance(coords, (list, tuple)) or len(coords) < 2:
+            continue
+        try:
+            x, y = float(coords[0]) / preview_scale + offset_x, float(coords[1]) / preview_scale + offset_y
+        except (TypeError, ValueError):
+            continue
+        boxes[key] = ("positions", x, y, *_POSITION_SIGNATURE_SIZE)
+    for key, box in (mapping.get("_signatures", {}) or {}).items():
+        try:
+            # mismos valores por defecto que draw_signatures
+            boxes[key] = (
+                "signatures",
+                float(box.get("x", 0.0)) / preview_scale + offset_x,
+                float(box.get("y", 0.0)) / preview_scale + offset_y,
+                float(box.get("width", 200.0)) / preview_scale,
+                float(box.get("height", 300.0)) / preview_scale,
+            )
+        except (AttributeError, TypeError, ValueError):
+            continue
+
+    signatures = {}
+    for key, (source, x, y, width, height) in boxes.items():
+        signatures[key] = {
+            "source": source,
+            "x": round(x, 2),
+            "y": round(y, 2),
+            "width": round(width, 2),
+            "height": round(height, 2),
+            "nx": x / page_w,
+            "ny": (page_h - y) / page_h,
+            "nw": width / page_w,
+            "nh": height / page_h,
+        }
+    return {"page_size": [page_w, page_h], "signatures": signatures}
+
 
 class TemplateStore:
     def __init__(self, base_path: str):
@@ -81,6 +155,80 @@ class TemplateStore:
             raise FileNotFoundError("Archivo de plantilla no encontrado")
         return path
 
+    def get_template_version(self, template_id: str) -> str:
+        """
+        Identificador de versión de la plantilla: cambia cada vez que se modifica
+        el archivo original o su meta.json (mapping, posiciones, imágenes...).
+        Se usa como clave de las cachés del renderizador: solo hace stat de los
+        archivos (sin leer meta.json, que puede incluir las vistas previas).
+        """
+        try:
+            meta_stat = os.stat(self._meta_path(template_id))
+        except FileNotFoundError:
+            raise FileNotFoundError("Plantilla no encontrada")
+        file_stat = None
+        for ext in SUPPORTED_EXTENSIONS:
+            try:
+                file_stat = os.stat(self._original_path(template_id, ext))
+                break
+            except FileNotFoundError:
+                continue
+        if file_stat is None:
+            raise FileNotFoundError("Archivo de plantilla no encontrado")
+        return f"{meta_stat.st_mtime_ns:x}-{meta_stat.st_size:x}-{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"
+
+    def _page_size(self, template_id: str, meta: Dict[str, Any]) -> Tuple[float, float]:
+        if meta.get("kind") == "pdf":
+            try:
+                first_page = PdfReader(self._original_path(template_id, meta["ext"])).pages[0]
+                return float(first_page.mediabox.width), float(first_page.mediabox.height)
+            except Exception:
+                pass
+        return DEFAULT_PAGE_SIZE
+
+    def _compile(self, template_id: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+        """Metadatos derivados del mapping que no hace falta recalcular en cada petición."""
+        mapping = meta.get("mapping", {}) or {}
+        compiled = compile_signature_geometry(mapping, self._page_size(template_id, meta))
+        # Rutas en 'data' de los campos imagen (_images), directas o a través del mapping
+        image_paths = set()
+        for key in mapping.get("_images", {}) or {}:
+            image_paths.add(key)
+            if isinstance(mapping.get(key), str):
+                image_paths.add(mapping[key])
+        compiled["image_paths"] = sorted(image_paths)
+        return compiled
+
+    def get_compiled(self, template_id: str, meta: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Metadatos compilados de la plantilla (geometría de firmas, tamaño de
+        página y rutas de los campos imagen). Las plantillas guardadas antes de
+        existir '_compiled' (o sus campos) se compilan la primera vez que se
+        piden y el resultado se guarda en su meta.json.
+        """
+        meta = meta if meta is not None else self.get_template_meta(template_id)
+        compiled = meta.get("_compiled")
+        if compiled is None or "image_paths" not in compiled:
+            compiled = meta["_compiled"] = self._compile(template_id, meta)
+            try:
+                self._write_meta(template_id, meta)
+            except OSError as ex:
+                print(f"⚠️  No se pudo guardar _compiled de {template_id}: {ex}")
+        return compiled
+
+    def _write_meta(self, template_id: str, meta: Dict[str, Any]):
+        """Escribe meta.json de forma atómica: un lector concurrente ve el anterior o el nuevo."""
+        meta_path = self._meta_path(template_id)
+        tmp_path = f"{meta_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, meta_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
     def save_mapping(self, template_id: str, mapping: Dict[str, Any], repeat_sections: Optional[Dict[str, Any]] = None, schema: Optional[Dict[str, Any]] = None, images: Optional[Dict[str, Any]] = None, image_previews: Optional[Dict[str, Any]] = None):
         meta = self.get_template_meta(template_id)
         meta["mapping"] = mapping or {}
@@ -92,8 +240,8 @@ class TemplateStore:
             meta["_images"] = images
         if image_previews is not None:
             meta["_image_previews"] = image_previews
-        with open(self._meta_path(template_id), "w", encoding="utf-8") as f:
-            json.dump(meta, f, ensure_ascii=False, indent=2)
+        meta["_compiled"] = self._compile(template_id, meta)
+        self._write_meta(template_id, meta)
 
     def delete_template(self, template_id: str) -> bool:
         tdir = self._template_dir(template_id)
@@ -0,0 +1,69 @@
+"""
+fast_json.py — (de)serialización JSON de los endpoints de render
+----------------------------------------------------------------
+Los payloads de /api/render (1–5 MB con arrays de items grandes) y sus
+respuestas (imágenes en base64, mapas de firmas) pasan por aquí en vez de por
+json de la stdlib + jsonable_encoder de FastAPI:
+
+  - con orjson instalado (opcional, ver requirements.txt) se usa orjson, que
+    parsea y serializa a bytes directamente;
+  - sin él, json de la stdlib con separadores compactos (mismo resultado);
+  - al parsear cuerpos grandes se pausa el GC cíclico: un payload de 5 MB son
+    decenas de miles de dicts y cada uno cuenta para disparar una colección,
+    aunque un árbol recién parseado nunca tiene ciclos.
+
+Ver bench_json.py para la comparación.
+"""
+
+import gc
+import json
+from typing import Any
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Tamaño (bytes) a partir del cual se pausa el GC durante el parseo
+_GC_PAUSE_MIN_BYTES = 64 * 1024
+
+
+def _loads(raw: bytes) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass  # NaN/Infinity o enteros de más de 64 bits: los admite la stdlib
+    return json.loads(raw)
+
+
+def loads(raw: bytes) -> Any:
+    """Parsea JSON (bytes o str). Lanza ValueError si no es JSON válido."""
+    if len(raw) < _GC_PAUSE_MIN_BYTES or not gc.isenabled():
+        return _loads(raw)
+    gc.disable()
+    try:
+        return _loads(raw)
+    finally:
+        gc.enable()
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """
+    Serializa a bytes UTF-8 compactos (claves no str y tipos no JSON: como str).
+    Con 'sort_keys' la salida es canónica (claves de caché, hashes).
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=str, option=option)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=sort_keys, default=str).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSONResponse que serializa con dumps(): sin jsonable_encoder ni copias intermedias."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,189 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple, Union
+
+
+class ByteBoundedLRU:
+    """
+    Caché LRU compartida por todo el proceso y limitada por bytes (no por número
+    de entradas). Cada entrada declara su tamaño aproximado al insertarse.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes: Tamaño máximo acumulado de las entradas en bytes
+        """
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[Hashable, tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any, size: int):
+        if size > self.max_bytes:
+            # Una entrada mayor que toda la caché solo desalojaría al resto
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._items:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# -------- Imágenes decodificadas (ImageReader) compartidas entre requests --------
+
+DECODED_MAX_BYTES = int(float(os.getenv("GENDOC_DECODED_IMAGE_CACHE_MB", "128")) * 1024 * 1024)
+
+_decoded_images = ByteBoundedLRU(DECODED_MAX_BYTES)
+
+
+def content_key(source: Union[str, bytes]) -> str:
+    """Hash de contenido usado como clave de caché y como nombre de XObject."""
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    return hashlib.sha1(source).hexdigest()
+
+
+def decode_data_url(data_url_or_b64: Union[str, bytes, None]) -> Optional[bytes]:
+    if not data_url_or_b64:
+        return None
+    if isinstance(data_url_or_b64, bytes):
+        return data_url_or_b64
+    s = str(data_url_or_b64)
+    try:
+        if s.startswith("data:") and ";base64," in s:
+            return base64.b64decode(s.split(",", 1)[1])
+        # raw base64
+        return base64.b64decode(s)
+    except Exception:
+        return None
+
+
+# -------- Imágenes por referencia ("asset:<id>") --------
+
+ASSET_PREFIX = "asset:"
+
+# id -> bytes de las imágenes guardadas (POST /api/assets); lo fija la API
+_asset_loader: Optional[Callable[[str], Optional[bytes]]] = None
+# Imágenes subidas con la petición (multipart): id -> [bytes, ImageReader o None, nº de peticiones que la usan]
+_pinned: Dict[str, list] = {}
+_pinned_lock = threading.Lock()
+
+
+def set_asset_loader(loader: Optional[Callable[[str], Optional[bytes]]]):
+    """Función que devuelve los bytes de un asset guardado por id (None si no existe)."""
+    global _asset_loader
+    _asset_loader = loader
+
+
+def asset_id(value: Any) -> Optional[str]:
+    """Id de una referencia "asset:<id>" o None si 'value' no lo es."""
+    if isinstance(value, str) and value.startswith(ASSET_PREFIX):
+        return value[len(ASSET_PREFIX):]
+    return None
+
+
+def _decode(key: str, data: bytes) -> Any:
+    from reportlab.lib.utils import ImageReader
+    reader = ImageReader(io.BytesIO(data))
+    # Forzar la decodificación ahora para que los siguientes usos la reutilicen
+    reader.getRGBData()
+    w, h = reader.getSize()
+    _decoded_images.put(key, reader, w * h * 4 + len(data))
+    return reader
+
+
+@contextmanager
+def pinned_images(images: Dict[str, bytes]) -> Iterator[None]:
+    """
+    Retiene las imágenes subidas con una petición (id -> bytes) mientras dura el
+    bloque: "asset:<id>" las encuentra aunque la caché de imágenes decodificadas
+    las haya desalojado o no quepan en ella. Se decodifican al primer uso.
+    """
+    with _pinned_lock:
+        for key, data in images.items():
+            _pinned.setdefault(key, [data, None, 0])[2] += 1
+    try:
+        yield
+    finally:
+        with _pinned_lock:
+            for key in images:
+                entry = _pinned[key]
+                entry[2] -= 1
+                if not entry[2]:
+                    del _pinned[key]
+
+
+def get_image_reader(source: Union[str, bytes, None]) -> Optional[Tuple[str, Any]]:
+    """
+    Devuelve (clave_de_contenido, ImageReader) para una data URL, base64, bytes
+    de imagen o referencia "asset:<id>". El resultado decodificado se cachea por
+    hash de contenido, de modo que las imágenes de la plantilla (logos, sellos)
+    se decodifican una sola vez por proceso y no en cada página de cada render.
+    """
+    if not source:
+        return None
+    ref = asset_id(source)
+    key = ref if ref is not None else content_key(source)
+    with _pinned_lock:
+        pinned = _pinned.get(key)
+    if pinned is not None:
+        if pinned[1] is None:
+            pinned[1] = _decode(key, pinned[0])
+        return key, pinned[1]
+    reader = _decoded_images.get(key)
+    if reader is not None:
+        return key, reader
+    if ref is not None:
+        data = _asset_loader(ref) if _asset_loader is not None else None
+    else:
+        data = decode_data_url(source)
+    if not data:
+        return None
+    return key, _decode(key, data)
+
+
+def get_decoded_cache_stats() -> Dict[str, int]:
+    return _decoded_images.stats()
@@ -0,0 +1,183 @@
+"""
+image_fetcher.py — descarga de imágenes remotas para las plantillas overlay
+--------------------------------------------------------------------------
+  - Un único requests.Session con pool de conexiones (keep-alive) por proceso.
+  - Descargas concurrentes de todas las URLs de un render (una vez por render,
+    no una vez por página).
+  - Caché compartida limitada por bytes que respeta Cache-Control / Expires y
+    revalida con ETag / Last-Modified (304 Not Modified).
+  - Los SVG se convierten a PNG con cairosvg y se cachea el PNG resultante.
+"""
+
+import os
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, Optional
+from .image_cache import ByteBoundedLRU
+
+logger = logging.getLogger(__name__)
+
+FETCH_TIMEOUT = float(os.getenv("GENDOC_IMAGE_FETCH_TIMEOUT", "10"))
+FETCH_WORKERS = int(os.getenv("GENDOC_IMAGE_FETCH_WORKERS", "8"))
+CACHE_MAX_BYTES = int(float(os.getenv("GENDOC_IMAGE_CACHE_MB", "64")) * 1024 * 1024)
+# Frescura por defecto cuando el servidor no envía Cache-Control ni Expires
+DEFAULT_TTL = float(os.getenv("GENDOC_IMAGE_CACHE_TTL", "300"))
+
+_cache = ByteBoundedLRU(CACHE_MAX_BYTES)
+_session = None
+_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+
+
+class _CachedImage:
+    __slots__ = ("data", "etag", "last_modified", "expires", "must_revalidate")
+
+    def __init__(self, data: bytes, etag: Optional[str], last_modified: Optional[str], expires: float, must_revalidate: bool):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+        self.must_revalidate = must_revalidate
+
+
+def _get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=FETCH_WORKERS, pool_maxsize=FETCH_WORKERS * 2)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = "Mozilla/5.0"
+            _session = session
+        return _session
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="img-fetch")
+        return _executor
+
+
+def _freshness(headers) -> tuple[bool, bool, float]:
+    """
+    Interpreta Cache-Control/Expires.
+
+    Returns:
+        (cacheable, must_revalidate, ttl_segundos)
+    """
+    cache_control = headers.get("cache-control", "")
+    directives = {}
+    for part in cache_control.split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+        name, _, value = part.partition("=")
+        directives[name.strip()] = value.strip().strip('"')
+
+    if "no-store" in directives:
+        return False, False, 0.0
+    must_revalidate = "no-cache" in directives
+    for name in ("s-maxage", "max-age"):
+        if name in directives:
+            try:
+                return True, must_revalidate, max(0.0, float(directives[name]))
+            except ValueError:
+                break
+    expires = headers.get("expires")
+    if expires:
+        try:
+            return True, must_revalidate, max(0.0, parsedate_to_datetime(expires).timestamp() - time.time())
+        except Exception:
+            # Expires inválido equivale a "ya caducado"
+            return True, True, 0.0
+    return True, must_revalidate, DEFAULT_TTL
+
+
+def _svg_to_png(data: bytes) -> Optional[bytes]:
+    try:
+        import cairosvg
+    except ImportError:
+        logger.warning("SVG no soportado: cairosvg no está instalado")
+        return None
+    return cairosvg.svg2png(bytestring=data)
+
+
+def fetch_image(url: str) -> Optional[bytes]:
+    """
+    Devuelve los bytes (raster) de la imagen en 'url' usando la caché compartida.
+    Devuelve None si la descarga falla o el formato no está soportado.
+    """
+    now = time.time()
+    entry: Optional[_CachedImage] = _cache.get(url)
+    if entry is not None and not entry.must_revalidate and entry.expires > now:
+        return entry.data
+
+    headers = {}
+    if entry is not None:
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+    try:
+        response = _get_session().get(url, timeout=FETCH_TIMEOUT, headers=headers)
+    except Exception as e:
+        logger.warning(f"Error descargando imagen {url}: {e}")
+        return entry.data if entry is not None else None
+
+    cacheable, must_revalidate, ttl = _freshness(response.headers)
+    if response.status_code == 304 and entry is not None:
+        entry.expires = now + ttl
+        entry.must_revalidate = must_revalidate
+        return entry.data
+    if response.status_code != 200:
+        logger.warning(f"Error HTTP {response.status_code} descargando imagen {url}")
+        return None
+
+    data = response.content
+    if "svg" in response.headers.get("content-type", "").lower():
+        data = _svg_to_png(data)
+        if data is None:
+            return None
+
+    if cacheable:
+        _cache.put(
+            url,
+            _CachedImage(data, response.headers.get("etag"), response.headers.get("last-modified"), now + ttl, must_revalidate),
+            len(data),
+        )
+    else:
+        _cache.pop(url)
+    return data
+
+
+def prefetch_images(urls: Iterable[str]) -> Dict[str, Optional[bytes]]:
+    """
+    Descarga en paralelo (una sola vez cada una) las URLs indicadas.
+
+    Returns:
+        Diccionario url -> bytes (o None si falló)
+    """
+    unique = list(dict.fromkeys(u for u in urls if u))
+    if not unique:
+        return {}
+    if len(unique) == 1:
+        return {unique[0]: fetch_image(unique[0])}
+    results = _get_executor().map(fetch_image, unique)
+    return dict(zip(unique, results))
+
+
+def is_remote_url(value) -> bool:
+    return isinstance(value, str) and (value.startswith("http://") or value.startswith("https://"))
+
+
+def get_cache_stats() -> Dict[str, int]:
+    return _cache.stats()
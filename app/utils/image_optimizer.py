@@ -16,7 +16,8 @@ Uso rápido:
       format_hint="webp",      # "jpeg" | "webp" | None (elige en base a transparencia)
       max_width=1600,          # redimensionado máximo (mantiene proporción). None = sin cambio
       max_height=1600,
-      doc_mode=True            # optimizaciones para documentos/escaneos (grises + nitidez)
+      doc_mode=True,           # optimizaciones para documentos/escaneos (grises + nitidez)
+      profile="balanced"       # "fast" | "balanced" | "smallest": esfuerzo del codificador
   )
 
   with open("out.webp","wb") as f:
@@ -24,25 +25,92 @@ Uso rápido:
 
 Funciones principales:
   - optimize_image_bytes(...): API única de alto nivel
-  - save_with_target_filesize(...): compresión con búsqueda binaria a tamaño objetivo
+  - optimize_image(...): igual pero a partir de una imagen PIL ya decodificada
+    (p. ej. la página rasterizada); devuelve (bytes, ancho, alto)
+  - save_with_target_filesize(...): compresión con búsqueda binaria a tamaño objetivo;
+    con 'quality_key' recuerda la calidad elegida y la próxima vez busca solo en
+    un intervalo estrecho alrededor (GENDOC_QUALITY_BRACKET); con varios núcleos
+    prueba varias calidades a la vez en un pool de hilos (GENDOC_ENCODE_THREADS)
 
 Notas:
   - Para imágenes con transparencia, WebP suele rendir mejor que PNG/JPEG.
   - Para documentos con texto, activar doc_mode mejora legibilidad y peso.
   - progressive=True en JPEG y lossless para WebP cuando convenga.
+  - PNG es sin pérdida: se ignora target_kb y solo cuenta el perfil (compresión).
 """
 
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import Optional, Tuple
+from typing import Hashable, Optional, Tuple
 from PIL import Image, ImageOps, ImageFilter
+from . import metrics
+
+# Semiancho del intervalo de calidad alrededor de la calidad memorizada
+QUALITY_BRACKET = int(os.getenv("GENDOC_QUALITY_BRACKET", "4"))
+_QUALITY_MEMO_MAX = 1024
+
+# Calidades que se codifican a la vez por petición (los codificadores de Pillow
+# sueltan el GIL). 1 = búsqueda binaria secuencial.
+ENCODE_THREADS = max(1, int(os.getenv("GENDOC_ENCODE_THREADS", str(min(4, os.cpu_count() or 1)))))
+
+_encode_pool: Optional[ThreadPoolExecutor] = None
+_encode_pool_lock = threading.Lock()
+
+IMAGE_MIME_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+
+# Perfiles velocidad/tamaño -> parámetros del codificador por formato
+ENCODE_PROFILES = {
+    "fast": {
+        "webp": {"method": 0},
+        "jpeg": {"optimize": False, "progressive": False},
+        "png": {"compress_level": 1},
+    },
+    "balanced": {
+        "webp": {"method": 4},
+        "jpeg": {"optimize": True, "progressive": True},
+        "png": {"compress_level": 6},
+    },
+    "smallest": {
+        "webp": {"method": 6},
+        "jpeg": {"optimize": True, "progressive": True},
+        "png": {"optimize": True},
+    },
+}
+DEFAULT_PROFILE = os.getenv("GENDOC_IMAGE_PROFILE", "smallest").lower()
+
+# Clasificador de páginas de documento (texto sobre fondo liso): 1-bit o paleta
+# pequeña sin pérdida en PNG/WebP, sin búsqueda de calidad
+DOC_CLASSIFIER = os.getenv("GENDOC_DOC_CLASSIFIER", "1").lower() not in ("0", "false", "no")
+DOC_PALETTE_COLORS = max(2, min(256, int(os.getenv("GENDOC_DOC_PALETTE_COLORS", "16"))))
+# Fracción mínima de píxeles que deben cubrir los colores de la paleta
+_DOC_COVERAGE = 0.97
+# ... y los píxeles exactamente iguales a un color de la paleta
+_DOC_FLAT_COVERAGE = 0.9
+# Fracción máxima de grises intermedios (antialiasing) para usar 1-bit
+_BILEVEL_MAX_MIDTONES = 0.01
+# Colores a esta distancia (por canal) de uno de la paleta se consideran el mismo
+_DOC_MERGE_DISTANCE = 8
+# 1-bit solo si todos los colores de la paleta están a esta distancia (por canal)
+# del negro o del blanco: un relleno gris claro u oscuro desaparecería al umbralizar
+_BILEVEL_TOLERANCE = 24
+
+# (quality_key, formato, target_kb, tamaño) -> calidad elegida en el último encode
+_quality_memo: "OrderedDict[Hashable, int]" = OrderedDict()
+_quality_memo_lock = threading.Lock()
 
 # -------- Helpers --------
 
 def _strip_metadata(img: Image.Image) -> Image.Image:
-    # crea una copia sin EXIF/ICC para reducir peso
-    data = list(img.getdata())
-    new = Image.new(img.mode, img.size)
-    new.putdata(data)
+    # EXIF/ICC viven en img.info, no en los píxeles: sin metadatos no hay nada que
+    # copiar, y si los hay basta una copia (en C) con 'info' vacío
+    if not img.info:
+        return img
+    new = img.copy()
+    new.info = {}
     return new
 
 def _maybe_downscale(img: Image.Image, max_w: Optional[int], max_h: Optional[int]) -> Image.Image:
@@ -71,6 +139,16 @@ def _to_grayscale_if_doc(img: Image.Image, doc_mode: bool) -> Image.Image:
     g = g.filter(ImageFilter.UnsharpMask(radius=1.2, percent=120, threshold=8))
     return g
 
+def sniff_image_format(data: bytes) -> Optional[str]:
+    """Formato real ("png" | "jpeg" | "webp") a partir de la cabecera de los bytes."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
 def _has_transparency(img: Image.Image) -> bool:
     if img.mode in ("RGBA", "LA"):
         return True
@@ -79,50 +157,218 @@ def _has_transparency(img: Image.Image) -> bool:
         return transparency is not None
     return False
 
+# -------- Clasificador de documentos --------
+
+def classify_document(img: Image.Image) -> Optional[Tuple[str, list]]:
+    """
+    Decide si 'img' es una página de documento (pocos colores planos) con un
+    histograma sobre una muestra NEAREST a 1/4 de resolución (~1-2 ms por página).
+
+    Returns:
+        ("1", []) si todos sus colores son casi negro o casi blanco, ("P", colores RGB) si bastan
+        DOC_PALETTE_COLORS colores, o None si parece una foto / degradado.
+    """
+    if img.mode not in ("RGB", "L"):
+        return None
+    w, h = img.size
+    sample = img.resize((max(1, w // 4), max(1, h // 4)), Image.NEAREST) if w >= 64 and h >= 64 else img
+    colors = sample.getcolors(4096)
+    if colors is None:
+        return None
+    total = sample.size[0] * sample.size[1]
+    colors.sort(key=lambda c: c[0], reverse=True)
+    rgb_colors = [(count, (c, c, c) if img.mode == "L" else c) for count, c in colors]
+
+    # Paleta con los colores más frecuentes que no sean casi iguales a uno ya
+    # elegido (los 250-254 del antialiasing del fondo cuentan como blanco); el
+    # conversor a paleta de Pillow agrupa colores cercanos y podría cambiar el fondo
+    palette = []
+    exact = covered = 0
+    for count, c in rgb_colors:
+        if any(max(abs(a - b) for a, b in zip(c, p)) <= _DOC_MERGE_DISTANCE for p in palette):
+            covered += count
+        elif len(palette) < DOC_PALETTE_COLORS:
+            palette.append(c)
+            exact += count
+            covered += count
+    # Colores planos: casi todo el área son exactamente los colores de la paleta
+    if exact < total * _DOC_FLAT_COVERAGE or covered < total * _DOC_COVERAGE:
+        return None
+
+    if all(max(c) <= _BILEVEL_TOLERANCE or min(c) >= 255 - _BILEVEL_TOLERANCE for c in palette):
+        midtones = sum(count for count, c in rgb_colors if 64 <= c[1] <= 192)
+        if midtones <= total * _BILEVEL_MAX_MIDTONES:
+            return "1", []
+    return "P", palette
+
+
+def _encode_document(img: Image.Image, kind: str, palette: list, fmt: str, extra: dict) -> bytes:
+    if kind == "1":
+        doc = img.convert("L").point(lambda v: 255 if v >= 128 else 0, mode="1")
+    else:
+        pal = Image.new("P", (1, 1))
+        flat = [v for color in palette for v in color]
+        pal.putpalette(flat + flat[:3] * (256 - len(palette)))
+        # Sin tramado: los colores planos (blanco del fondo) se conservan exactos
+        doc = img.convert("RGB").quantize(palette=pal, dither=Image.Dither.NONE)
+    buf = BytesIO()
+    if fmt == "png":
+        doc.save(buf, "PNG", **extra)
+    else:
+        doc.save(buf, "WEBP", lossless=True, **extra)
+    return buf.getvalue()
+
 # -------- Core save with target size --------
 
+def _encode(img: Image.Image, fmt: str, quality: int, params: dict) -> bytes:
+    buf = BytesIO()
+    if fmt == "jpeg":
+        params_q = {"subsampling": 2, "progressive": True, **params, "quality": quality}
+        img.convert("RGB").save(buf, "JPEG", **params_q)
+    elif fmt == "webp":
+        # WebP con q ajustable, sin lossless aquí
+        params_q = {"method": 6, **params, "quality": quality}
+        img.save(buf, "WEBP", **params_q)
+    else:
+        raise ValueError("Formato no soportado para binsearch: " + fmt)
+    return buf.getvalue()
+
+
+def _binsearch_quality(img: Image.Image, target_kb: int, fmt: str, params: dict, lo: int, hi: int):
+    """
+    Búsqueda binaria de 'quality' en [lo, hi]. Devuelve (bytes más cercanos al
+    objetivo, su calidad, mayor calidad que cumple el objetivo o None, nº de encodes).
+    """
+    best_bytes = None
+    best_q = None
+    fit_q = None
+    probes = 0
+    while lo <= hi:
+        q = (lo + hi) // 2
+        data = _encode(img, fmt, q, params)
+        probes += 1
+        size_kb = len(data) / 1024
+        if best_bytes is None or abs(size_kb - target_kb) < abs(len(best_bytes) / 1024 - target_kb):
+            best_bytes, best_q = data, q
+
+        if size_kb > target_kb:
+            hi = q - 1
+        else:
+            fit_q = q
+            lo = q + 1
+    return best_bytes, best_q, fit_q, probes
+
+
+def _get_encode_pool() -> ThreadPoolExecutor:
+    global _encode_pool
+    with _encode_pool_lock:
+        if _encode_pool is None:
+            _encode_pool = ThreadPoolExecutor(max_workers=max(ENCODE_THREADS, os.cpu_count() or 1), thread_name_prefix="img-encode")
+        return _encode_pool
+
+
+def _parallel_search_quality(img: Image.Image, target_kb: int, fmt: str, params: dict, lo: int, hi: int, threads: int):
+    """
+    Como _binsearch_quality pero en rondas: cada ronda codifica en paralelo hasta
+    'threads' calidades repartidas en [lo, hi] y estrecha el intervalo entre la
+    mayor que cumple el objetivo y la menor que lo supera. Con 3 hilos el rango
+    35-95 se resuelve en ~3 rondas en lugar de 6 encodes seguidos.
+    """
+    # Image.save guarda los parámetros en la propia imagen (encoderinfo), así que
+    # cada hilo codifica su propia copia
+    copies = [img] + [img.copy() for _ in range(threads - 1)]
+    pool = _get_encode_pool()
+    best_bytes = None
+    best_q = None
+    fit_q = None
+    probes = 0
+    while lo <= hi:
+        n = min(threads, hi - lo + 1)
+        qualities = sorted({lo + (hi - lo) * (i + 1) // (n + 1) for i in range(n)})
+        results = list(pool.map(lambda job: _encode(job[0], fmt, job[1], params), zip(copies, qualities)))
+        probes += len(qualities)
+        new_lo, new_hi = lo, hi
+        for q, data in zip(qualities, results):
+            size_kb = len(data) / 1024
+            if best_bytes is None or abs(size_kb - target_kb) < abs(len(best_bytes) / 1024 - target_kb):
+                best_bytes, best_q = data, q
+            if size_kb > target_kb:
+                new_hi = min(new_hi, q - 1)
+            else:
+                fit_q = q if fit_q is None else max(fit_q, q)
+                new_lo = max(new_lo, q + 1)
+        lo, hi = new_lo, new_hi
+    return best_bytes, best_q, fit_q, probes
+
+
 def save_with_target_filesize(
     img: Image.Image,
     target_kb: int,
     fmt: str = "jpeg",
     min_quality: int = 35,
     max_quality: int = 95,
-    extra_kwargs: dict = None
+    extra_kwargs: dict = None,
+    quality_key: Optional[Hashable] = None,
+    threads: Optional[int] = None
 ) -> bytes:
     """
     Guarda 'img' en 'fmt' aproximando el tamaño 'target_kb' mediante
     búsqueda binaria de 'quality'. Devuelve bytes del archivo.
+
+    Con 'quality_key' (p. ej. plantilla + versión) se memoriza la calidad elegida:
+    los renders de una misma plantilla comprimen de forma muy parecida, así que la
+    siguiente búsqueda empieza en esa calidad con un intervalo de ±QUALITY_BRACKET
+    y solo repite la búsqueda completa si el objetivo cae fuera del intervalo.
+
+    'threads' (por defecto ENCODE_THREADS) limita las calidades codificadas a la
+    vez para esta petición.
     """
     fmt = fmt.lower()
     params = dict(optimize=True)
     if extra_kwargs:
         params.update(extra_kwargs)
 
-    lo, hi = min_quality, max_quality
-    best_bytes = None
-    # Intento rápido: calidad media
-    while lo <= hi:
-        q = (lo + hi) // 2
-        buf = BytesIO()
-        if fmt == "jpeg":
-            params_q = dict(params, quality=q, subsampling=2, progressive=True)
-            img.convert("RGB").save(buf, "JPEG", **params_q)
-        elif fmt == "webp":
-            # WebP con q ajustable, sin lossless aquí
-            params_q = dict(params, quality=q, method=6)
-            img.save(buf, "WEBP", **params_q)
-        else:
-            raise ValueError("Formato no soportado para binsearch: " + fmt)
+    threads = ENCODE_THREADS if threads is None else max(1, threads)
+    if threads > 1:
+        def search(lo, hi):
+            return _parallel_search_quality(img, target_kb, fmt, params, lo, hi, threads)
+    else:
+        def search(lo, hi):
+            return _binsearch_quality(img, target_kb, fmt, params, lo, hi)
 
-        data = buf.getvalue()
-        size_kb = len(data) / 1024
-        best_bytes = data if best_bytes is None or abs(size_kb - target_kb) < abs(len(best_bytes)/1024 - target_kb) else best_bytes
+    t0 = time.perf_counter()
+    memo_key = (quality_key, fmt, tuple(sorted(params.items())), target_kb, img.size) if quality_key is not None else None
+    hint = None
+    if memo_key is not None:
+        with _quality_memo_lock:
+            hint = _quality_memo.get(memo_key)
 
-        if size_kb > target_kb:
-            hi = q - 1
-        else:
-            lo = q + 1
+    result = None
+    probes = 0
+    if hint is not None:
+        lo = max(min_quality, hint - QUALITY_BRACKET)
+        hi = min(max_quality, hint + QUALITY_BRACKET)
+        result = search(lo, hi)
+        probes = result[3]
+        # Fallo: ni la calidad más baja del intervalo cabe, o cabe la más alta y aún se podría subir
+        missed = (result[2] is None and lo > min_quality) or (result[2] == hi and hi < max_quality)
+        metrics.incr("image_encode.memo_misses" if missed else "image_encode.memo_hits")
+        if missed:
+            result = None
+    if result is None:
+        result = search(min_quality, max_quality)
+        probes += result[3]
 
+    best_bytes, best_q = result[0], result[1]
+    if memo_key is not None:
+        with _quality_memo_lock:
+            _quality_memo[memo_key] = best_q
+            _quality_memo.move_to_end(memo_key)
+            while len(_quality_memo) > _QUALITY_MEMO_MAX:
+                _quality_memo.popitem(last=False)
+
+    metrics.observe("image_encode.probes", probes)
+    metrics.observe("image_encode.seconds", time.perf_counter() - t0)
     return best_bytes
 
 # -------- High level API --------
@@ -134,7 +380,8 @@ def optimize_image_bytes(
     max_width: Optional[int] = 1800,
     max_height: Optional[int] = 1800,
     doc_mode: bool = False,
-    prefer_lossless_for_alpha: bool = True
+    prefer_lossless_for_alpha: bool = True,
+    profile: Optional[str] = None
 ) -> bytes:
     """
     Optimiza 'data' (bytes de imagen). Pasos:
@@ -143,47 +390,112 @@ def optimize_image_bytes(
       3) modo documento (grises + unsharp)
       4) selecciona formato (webp si hay alfa, o hint)
       5) si target_kb -> binsearch calidad; si no -> guarda con calidad fija
+    'profile' elige el esfuerzo del codificador (ver ENCODE_PROFILES).
     """
     with Image.open(BytesIO(data)) as im:
         # auto-orientación por EXIF
         im = ImageOps.exif_transpose(im)
-        # elimina metadatos
-        im = _strip_metadata(im)
-        # downscale
-        im = _maybe_downscale(im, max_width, max_height)
-        # doc mode
-        im = _to_grayscale_if_doc(im, doc_mode)
-
-        # selección de formato
-        has_alpha = _has_transparency(im)
-        fmt = (format_hint or "").lower()
-        if not fmt:
-            if has_alpha:
-                fmt = "webp"  # mejor que PNG para web
-            else:
-                fmt = "jpeg"
+        out, _, _ = optimize_image(
+            im,
+            target_kb=target_kb,
+            format_hint=format_hint,
+            max_width=max_width,
+            max_height=max_height,
+            doc_mode=doc_mode,
+            prefer_lossless_for_alpha=prefer_lossless_for_alpha,
+            profile=profile,
+        )
+        return out
+
+
+def optimize_image(
+    im: Image.Image,
+    target_kb: Optional[int] = 180,
+    format_hint: Optional[str] = None,  # "jpeg" | "webp" | "png" | None
+    max_width: Optional[int] = 1800,
+    max_height: Optional[int] = 1800,
+    doc_mode: bool = False,
+    prefer_lossless_for_alpha: bool = True,
+    quality_key: Optional[Hashable] = None,
+    profile: Optional[str] = None,
+    classify_documents: Optional[bool] = None
+) -> Tuple[bytes, int, int]:
+    """
+    Igual que optimize_image_bytes (pasos 2-5) pero a partir de una imagen PIL ya
+    decodificada: la imagen va directa al codificador, sin PNG intermedio.
+    Devuelve (bytes, ancho, alto) con las dimensiones finales tras el downscale,
+    para que nadie tenga que volver a abrir el resultado solo para medirlo.
+    'quality_key' se pasa a save_with_target_filesize (memo de calidad).
 
-        # Guardado
-        if target_kb:
-            # parámetros extra base
-            extra = {}
-            if fmt == "jpeg":
-                extra = {"progressive": True, "subsampling": 2}
-            elif fmt == "webp":
-                extra = {"method": 6}
+    Con 'classify_documents' (por defecto GENDOC_DOC_CLASSIFIER) y salida PNG o
+    WebP, las páginas de texto sobre fondo liso (ver classify_document) se guardan
+    en 1-bit o con paleta pequeña sin pérdida, sin filtros de doc_mode ni búsqueda
+    de calidad; si el resultado supera target_kb se sigue por el camino normal.
+    """
+    profile = (profile or DEFAULT_PROFILE).lower()
+    if profile not in ENCODE_PROFILES:
+        raise ValueError("Perfil de codificación no soportado: " + profile)
+    if classify_documents is None:
+        classify_documents = DOC_CLASSIFIER
+    # elimina metadatos
+    im = _strip_metadata(im)
+    # downscale
+    im = _maybe_downscale(im, max_width, max_height)
+    width, height = im.size
+
+    # selección de formato
+    has_alpha = _has_transparency(im)
+    fmt = (format_hint or "").lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if not fmt:
+        # doc_mode pasa a grises y descarta el alfa
+        if has_alpha and not doc_mode:
+            fmt = "webp"  # mejor que PNG para web
+        else:
+            fmt = "jpeg"
+
+    # parámetros del codificador según el perfil
+    extra = dict(ENCODE_PROFILES[profile].get(fmt, {}))
+
+    # páginas de documento: 1-bit / paleta sin pérdida, sin búsqueda de calidad
+    if classify_documents and fmt in ("png", "webp") and not has_alpha:
+        t0 = time.perf_counter()
+        doc_class = classify_document(im)
+        if doc_class is not None:
+            data = _encode_document(im, doc_class[0], doc_class[1], fmt, extra)
+            if not target_kb or fmt == "png" or len(data) <= target_kb * 1024:
+                metrics.incr("image_encode.document_pages")
+                metrics.observe("image_encode.seconds", time.perf_counter() - t0)
+                return data, width, height
 
-            return save_with_target_filesize(im, target_kb=target_kb, fmt=fmt, extra_kwargs=extra)
+    # doc mode
+    im = _to_grayscale_if_doc(im, doc_mode)
+    has_alpha = _has_transparency(im)
 
-        # si no hay target_kb, guardamos con calidades razonables
+    # PNG es sin pérdida: no hay calidad que buscar
+    if fmt == "png":
         buf = BytesIO()
+        im.save(buf, "PNG", **extra)
+        return buf.getvalue(), width, height
+
+    # Guardado
+    if target_kb:
         if fmt == "jpeg":
-            im.convert("RGB").save(buf, "JPEG", optimize=True, quality=75, subsampling=2, progressive=True)
-        elif fmt == "webp":
-            if has_alpha and prefer_lossless_for_alpha and not doc_mode:
-                im.save(buf, "WEBP", lossless=True, method=6)
-            else:
-                im.save(buf, "WEBP", quality=78, method=6)
+            extra = {"progressive": True, "subsampling": 2, **extra}
+
+        return save_with_target_filesize(im, target_kb=target_kb, fmt=fmt, extra_kwargs=extra, quality_key=quality_key), width, height
+
+    # si no hay target_kb, guardamos con calidades razonables
+    buf = BytesIO()
+    if fmt == "jpeg":
+        im.convert("RGB").save(buf, "JPEG", **{"optimize": True, "progressive": True, **extra, "quality": 75, "subsampling": 2})
+    elif fmt == "webp":
+        if has_alpha and prefer_lossless_for_alpha and not doc_mode:
+            im.save(buf, "WEBP", lossless=True, **extra)
         else:
-            # fallback a PNG optimizado (puede ser pesado)
-            im.save(buf, "PNG", optimize=True)
-        return buf.getvalue()
+            im.save(buf, "WEBP", quality=78, **extra)
+    else:
+        # fallback a PNG optimizado (puede ser pesado)
+        im.save(buf, "PNG", optimize=True)
+    return buf.getvalue(), width, height
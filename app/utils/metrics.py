@@ -0,0 +1,62 @@
+"""
+metrics.py — métricas en memoria del proceso
+--------------------------------------------
+Contadores (incr) y distribuciones simples (observe: count/sum/min/max) que se
+exponen tal cual en GET /api/metrics. Cada worker de uvicorn tiene las suyas; las
+de los procesos de rasterizado se suman a las del worker con merge().
+"""
+
+import threading
+from typing import Any, Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_series: Dict[str, list] = {}
+
+
+def incr(name: str, value: float = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, value: float):
+    with _lock:
+        s = _series.get(name)
+        if s is None:
+            _series[name] = [1, value, value, value]
+        else:
+            s[0] += 1
+            s[1] += value
+            s[2] = min(s[2], value)
+            s[3] = max(s[3], value)
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        out: Dict[str, Any] = dict(_counters)
+        for name, (count, total, lo, hi) in _series.items():
+            out[name] = {"count": count, "sum": total, "min": lo, "max": hi, "avg": total / count}
+        return out
+
+
+def merge(other: Dict[str, Any]):
+    """Suma un snapshot() de otro proceso (p. ej. un worker de raster_pool)."""
+    with _lock:
+        for name, value in other.items():
+            if not isinstance(value, dict):
+                _counters[name] = _counters.get(name, 0) + value
+                continue
+            s = _series.get(name)
+            if s is None:
+                _series[name] = [value["count"], value["sum"], value["min"], value["max"]]
+            else:
+                s[0] += value["count"]
+                s[1] += value["sum"]
+                s[2] = min(s[2], value["min"])
+                s[3] = max(s[3], value["max"])
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _series.clear()
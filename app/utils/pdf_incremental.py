@@ -0,0 +1,306 @@
+"""
+pdf_incremental.py — relleno de formularios AcroForm mediante actualización incremental
+-------------------------------------------------------------------------------------
+En lugar de reescribir el PDF completo con PdfWriter, se añaden al final de los
+bytes originales únicamente los objetos modificados (campos, widgets y sus
+streams de apariencia), una nueva sección xref y un trailer con /Prev apuntando
+a la xref original (PDF 1.7, §7.5.6). Si el original usa streams de referencias
+cruzadas (PDF 1.5+, /Type /XRef), la nueva sección también es un stream /XRef.
+
+Ventajas:
+  - El prefijo del documento es idéntico byte a byte al original.
+  - El coste es proporcional al número de campos, no al tamaño del PDF.
+  - Todo ocurre en memoria (sin ficheros temporales).
+"""
+
+import io
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject,
+    BooleanObject,
+    ByteStringObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    TextStringObject,
+)
+
+_DA_FONT_RE = re.compile(r"/([^\s/]+)\s+([\d.]+)\s+Tf")
+_DEFAULT_DA = "/Helv 0 Tf 0 g"
+_AUTO_FONT_SIZE = 12.0
+# /Ff de los campos /Ch: bit 18 = lista desplegable (combo); si no, cuadro de lista
+_COMBO_FLAG = 1 << 17
+
+
+def _inherited(field: DictionaryObject, key: str) -> Any:
+    cur: Optional[DictionaryObject] = field
+    while cur is not None:
+        if key in cur:
+            return cur[key]
+        parent = cur.get("/Parent")
+        cur = parent.get_object() if parent is not None else None
+    return None
+
+
+def _escape_pdf_string(value: str) -> str:
+    # Las fuentes estándar de los formularios usan WinAnsi; lo que no cabe se sustituye
+    raw = value.encode("cp1252", errors="replace").decode("latin-1")
+    return raw.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").replace("\r", "").replace("\n", " ")
+
+
+def _collect_terminal_fields(fields: ArrayObject, parent_name: str = "") -> List[Tuple[str, IndirectObject]]:
+    """Recorre el árbol de campos y devuelve (nombre_completo, referencia) de cada campo terminal."""
+    out: List[Tuple[str, IndirectObject]] = []
+    for ref in fields:
+        if not isinstance(ref, IndirectObject):
+            continue
+        field = ref.get_object()
+        partial = field.get("/T")
+        name = parent_name
+        if partial is not None:
+            name = f"{parent_name}.{partial}" if parent_name else str(partial)
+        kids = field.get("/Kids")
+        # Un campo con hijos que tienen /T es un nodo intermedio; si no, los hijos son widgets
+        if kids and any("/T" in k.get_object() for k in kids):
+            out.extend(_collect_terminal_fields(kids, name))
+        elif name:
+            out.append((name, ref))
+    return out
+
+
+def _widgets_of(field_ref: IndirectObject) -> List[IndirectObject]:
+    field = field_ref.get_object()
+    kids = field.get("/Kids")
+    if kids:
+        return [k for k in kids if isinstance(k, IndirectObject)]
+    return [field_ref]
+
+
+def _build_text_appearance(widget: DictionaryObject, value: str, da: str, dr: Optional[DictionaryObject]) -> DecodedStreamObject:
+    rect = [float(v) for v in widget.get("/Rect", [0, 0, 0, 0])]
+    width = abs(rect[2] - rect[0])
+    height = abs(rect[3] - rect[1])
+
+    match = _DA_FONT_RE.search(da)
+    font_size = float(match.group(2)) if match else 0.0
+    if font_size == 0:
+        # Tamaño automático: ajustar a la altura del campo
+        font_size = min(_AUTO_FONT_SIZE, max(height * 0.7, 1.0))
+    if match:
+        da = da[:match.start()] + f"/{match.group(1)} {font_size:g} Tf" + da[match.end():]
+    else:
+        da = f"/Helv {font_size:g} Tf 0 g"
+
+    y = max((height - font_size) / 2 + font_size * 0.2, 0)
+    content = f"/Tx BMC q BT {da} 2 {y:.2f} Td ({_escape_pdf_string(value)}) Tj ET Q EMC"
+
+    stream = DecodedStreamObject()
+    stream.set_data(content.encode("latin-1"))
+    stream.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Form"),
+        NameObject("/BBox"): ArrayObject([FloatObject(0), FloatObject(0), FloatObject(width), FloatObject(height)]),
+    })
+    if dr is not None and "/Font" in dr:
+        stream[NameObject("/Resources")] = DictionaryObject({NameObject("/Font"): dr["/Font"]})
+    return stream
+
+
+def _choice_display(field: DictionaryObject, value: str) -> str:
+    """Texto visible de la opción 'value' de un campo /Ch (/Opt admite pares [exportación, texto])."""
+    for opt in _inherited(field, "/Opt") or []:
+        opt = opt.get_object()
+        if isinstance(opt, ArrayObject) and len(opt) == 2 and str(opt[0]) == value:
+            return str(opt[1])
+    return value
+
+
+def _on_state(widget: DictionaryObject) -> Optional[str]:
+    ap = widget.get("/AP")
+    if ap is None:
+        return None
+    normal = ap.get_object().get("/N")
+    if normal is None:
+        return None
+    for state in normal.get_object().keys():
+        if state != "/Off":
+            return state
+    return None
+
+
+def _find_startxref(pdf_bytes: bytes) -> int:
+    pos = pdf_bytes.rfind(b"startxref")
+    if pos < 0:
+        raise ValueError("PDF sin 'startxref'")
+    tail = pdf_bytes[pos + len(b"startxref"):].split()
+    return int(tail[0])
+
+
+def _is_xref_stream(pdf_bytes: bytes, xref_pos: int) -> bool:
+    """La sección xref en 'xref_pos' es un stream /XRef ("N G obj") y no una tabla clásica ("xref")."""
+    return re.match(rb"\s*\d+\s+\d+\s+obj", pdf_bytes[xref_pos:xref_pos + 32]) is not None
+
+
+def _subsections(nums: List[int]) -> List[Tuple[int, int]]:
+    """(primer número, cantidad) de cada tramo de números de objeto consecutivos."""
+    out: List[Tuple[int, int]] = []
+    for num in nums:
+        if out and num == out[-1][0] + out[-1][1]:
+            out[-1] = (out[-1][0], out[-1][1] + 1)
+        else:
+            out.append((num, 1))
+    return out
+
+
+def _serialize(obj: Any) -> bytes:
+    buf = io.BytesIO()
+    obj.write_to_stream(buf)
+    return buf.getvalue()
+
+
+def fill_acroform_incremental(pdf_bytes: bytes, values: Dict[str, str], revision_id: Optional[bytes] = None) -> bytes:
+    """
+    Rellena los campos AcroForm de 'pdf_bytes' con 'values' añadiendo una
+    actualización incremental. Devuelve los bytes originales seguidos de la
+    actualización. Lanza ValueError si el documento no tiene formulario.
+
+    Con 'revision_id' el segundo elemento del /ID del nuevo trailer pasa a ser
+    ese valor (el identificador de esta revisión, PDF 32000-1 §14.4).
+    """
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    if reader.is_encrypted:
+        raise ValueError("PDF cifrado: no se admite actualización incremental")
+
+    root_ref = reader.trailer.raw_get("/Root")
+    root = root_ref.get_object()
+    if "/AcroForm" not in root:
+        raise ValueError("El PDF no contiene /AcroForm")
+    acroform = root["/AcroForm"].get_object()
+    dr = acroform.get("/DR")
+    dr = dr.get_object() if dr is not None else None
+    default_da = str(acroform.get("/DA", _DEFAULT_DA))
+
+    modified: Dict[int, Tuple[int, Any]] = {}
+    need_appearances = False
+    next_num = int(reader.trailer.get("/Size", 0))
+    # Evitar colisiones si /Size no refleja el número real de objetos
+    for gen_table in reader.xref.values():
+        for num in gen_table:
+            next_num = max(next_num, num + 1)
+    # ... incluidos los objetos comprimidos en object streams (PDF 1.5+)
+    for num in reader.xref_objStm:
+        next_num = max(next_num, num + 1)
+
+    for name, field_ref in _collect_terminal_fields(acroform.get("/Fields", ArrayObject()).get_object()):
+        if name not in values:
+            continue
+        value = values[name]
+        field = field_ref.get_object()
+        field_type = _inherited(field, "/FT")
+
+        if field_type == "/Btn":
+            widgets = _widgets_of(field_ref)
+            on = next((s for s in (_on_state(w.get_object()) for w in widgets) if s), None)
+            checked = bool(value) and str(value).lower() not in ("off", "false", "0", "no")
+            state = NameObject(on if (checked and on) else "/Off")
+            field[NameObject("/V")] = state
+            modified[field_ref.idnum] = (field_ref.generation, field)
+            for w in widgets:
+                widget = w.get_object()
+                widget[NameObject("/AS")] = state
+                modified[w.idnum] = (w.generation, widget)
+            continue
+
+        field[NameObject("/V")] = TextStringObject(value)
+        modified[field_ref.idnum] = (field_ref.generation, field)
+        text = value
+        if field_type == "/Ch":
+            if not int(_inherited(field, "/Ff") or 0) & _COMBO_FLAG:
+                # Cuadro de lista: varias filas con la selección resaltada; que lo dibuje el visor
+                need_appearances = True
+                continue
+            text = _choice_display(field, value)
+        elif field_type != "/Tx":
+            continue
+        da = str(_inherited(field, "/DA") or default_da)
+        for w in _widgets_of(field_ref):
+            widget = w.get_object()
+            stream = _build_text_appearance(widget, text, da, dr)
+            ap_ref = IndirectObject(next_num, 0, reader)
+            modified[next_num] = (0, stream)
+            next_num += 1
+            widget[NameObject("/AP")] = DictionaryObject({NameObject("/N"): ap_ref})
+            modified[w.idnum] = (w.generation, widget)
+
+    if not modified:
+        return pdf_bytes
+    if need_appearances:
+        # /NeedAppearances va en el /AcroForm: se reescribe ese objeto (o el catálogo si es directo)
+        acroform[NameObject("/NeedAppearances")] = BooleanObject(True)
+        holder = root.raw_get("/AcroForm")
+        if not isinstance(holder, IndirectObject):
+            holder = root_ref
+        modified[holder.idnum] = (holder.generation, holder.get_object())
+
+    out = bytearray(pdf_bytes)
+    if not out.endswith(b"\n"):
+        out += b"\n"
+    offsets: Dict[int, Tuple[int, int]] = {}
+    for num in sorted(modified):
+        gen, obj = modified[num]
+        offsets[num] = (len(out), gen)
+        out += f"{num} {gen} obj\n".encode("ascii")
+        out += _serialize(obj)
+        out += b"\nendobj\n"
+
+    prev_xref = _find_startxref(pdf_bytes)
+    size = max(next_num, int(reader.trailer.get("/Size", 0)))
+    trailer = DictionaryObject({
+        NameObject("/Size"): NumberObject(size),
+        NameObject("/Root"): root_ref,
+        NameObject("/Prev"): NumberObject(prev_xref),
+    })
+    if "/Info" in reader.trailer:
+        trailer[NameObject("/Info")] = reader.trailer.raw_get("/Info")
+    if "/ID" in reader.trailer:
+        # Conservar los identificadores originales byte a byte
+        ids = [
+            ByteStringObject(part.original_bytes if isinstance(part, TextStringObject) else bytes(part))
+            for part in reader.trailer["/ID"]
+        ]
+        if revision_id is not None and len(ids) == 2:
+            ids[1] = ByteStringObject(revision_id)
+        trailer[NameObject("/ID")] = ArrayObject(ids)
+
+    xref_pos = len(out)
+    if _is_xref_stream(pdf_bytes, prev_xref):
+        # Stream /XRef (el propio stream es el objeto 'size'): filas de tipo 1 con
+        # desplazamiento (4 bytes) y generación (2 bytes)
+        offsets[size] = (xref_pos, 0)
+        nums = sorted(offsets)
+        xref = DecodedStreamObject()
+        xref.set_data(b"".join(b"\x01" + offsets[num][0].to_bytes(4, "big") + offsets[num][1].to_bytes(2, "big") for num in nums))
+        xref.update(trailer)
+        xref.update({
+            NameObject("/Type"): NameObject("/XRef"),
+            NameObject("/Size"): NumberObject(size + 1),
+            NameObject("/W"): ArrayObject([NumberObject(1), NumberObject(4), NumberObject(2)]),
+            NameObject("/Index"): ArrayObject([NumberObject(v) for sub in _subsections(nums) for v in sub]),
+        })
+        xref = xref.flate_encode()
+        out += f"{size} 0 obj\n".encode("ascii") + _serialize(xref) + b"\nendobj\n"
+    else:
+        out += b"xref\n"
+        for first, count in _subsections(sorted(offsets)):
+            out += f"{first} {count}\n".encode("ascii")
+            for num in range(first, first + count):
+                offset, gen = offsets[num]
+                out += f"{offset:010d} {gen:05d} n\r\n".encode("ascii")
+        out += b"trailer\n" + _serialize(trailer) + b"\n"
+    out += f"startxref\n{xref_pos}\n%%EOF\n".encode("ascii")
+    return bytes(out)
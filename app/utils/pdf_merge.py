@@ -0,0 +1,171 @@
+"""
+pdf_merge.py — fusión de la capa overlay con las páginas base de la plantilla
+---------------------------------------------------------------------------
+Backends (GENDOC_MERGE_BACKEND):
+  - "pypdf"   : merge_page de pypdf página a página (comportamiento histórico).
+  - "xobject" : cada página base distinta se convierte una sola vez en un Form
+                XObject compartido y cada página de salida es la página overlay
+                con un "Do" de ese XObject por debajo. No re-parsea ni copia el
+                contenido base por página. Las anotaciones de la base no se copian.
+  - "pdfium"  : igual que "xobject" pero usando pypdfium2 (page_as_xobject),
+                en el pool de procesos de pdfium (ver raster_pool).
+
+Ver bench_merge_backends.py para la comparación de tiempos y tamaños.
+"""
+
+import io
+import os
+from typing import Union
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, FloatObject, NameObject
+from .raster_canvas import pdfium_lock
+from .raster_pool import get_raster_pool
+
+MERGE_BACKEND = os.getenv("GENDOC_MERGE_BACKEND", "pypdf").lower()
+MERGE_BACKENDS = ("pypdf", "xobject", "pdfium")
+
+_BASE_XOBJECT_NAME = "/GDBase"
+
+
+def _inherited_resources(page) -> DictionaryObject:
+    cur = page
+    while cur is not None:
+        if "/Resources" in cur:
+            return cur["/Resources"].get_object()
+        parent = cur.get("/Parent")
+        cur = parent.get_object() if parent is not None else None
+    return DictionaryObject()
+
+
+def _merge_pypdf(base_reader: PdfReader, overlay_reader: PdfReader, total_pages: int) -> bytes:
+    writer = PdfWriter()
+    base_count = len(base_reader.pages)
+    repeats_last = total_pages > base_count
+    for i in range(total_pages):
+        base_index = min(i, base_count - 1)
+        page = writer.add_page(base_reader.pages[base_index])
+        if repeats_last and base_index == base_count - 1 and "/Contents" in page:
+            # Las copias de la última página base comparten el stream de contenido
+            # y merge_page lo modifica: cada una recibe uno propio (también la
+            # primera, o su overlay aparecería en las repeticiones siguientes).
+            page[NameObject("/Contents")] = writer._add_object(page.get_contents())
+        if i < len(overlay_reader.pages):
+            page.merge_page(overlay_reader.pages[i])
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def _merge_xobject(base_reader: PdfReader, overlay_reader: PdfReader, total_pages: int) -> bytes:
+    writer = PdfWriter()
+    base_count = len(base_reader.pages)
+    # índice de página base -> (ref Form XObject, ref stream "q /GDBase Do Q", página base)
+    base_forms = {}
+    for i in range(total_pages):
+        base_index = min(i, base_count - 1)
+        if base_index not in base_forms:
+            base_page = base_reader.pages[base_index]
+            form = DecodedStreamObject()
+            contents = base_page.get_contents()
+            form.set_data(contents.get_data() if contents is not None else b"")
+            box = base_page.mediabox
+            form.update({
+                NameObject("/Type"): NameObject("/XObject"),
+                NameObject("/Subtype"): NameObject("/Form"),
+                NameObject("/BBox"): ArrayObject([FloatObject(box.left), FloatObject(box.bottom), FloatObject(box.right), FloatObject(box.top)]),
+                NameObject("/Resources"): _inherited_resources(base_page).clone(writer),
+            })
+            prefix = DecodedStreamObject()
+            prefix.set_data(f"q {_BASE_XOBJECT_NAME} Do Q\n".encode("ascii"))
+            base_forms[base_index] = (writer._add_object(form), writer._add_object(prefix), base_page)
+        form_ref, prefix_ref, base_page = base_forms[base_index]
+
+        if i < len(overlay_reader.pages):
+            page = writer.add_page(overlay_reader.pages[i])
+        else:
+            page = writer.add_blank_page(float(base_page.mediabox.width), float(base_page.mediabox.height))
+
+        resources = page.get("/Resources")
+        resources = DictionaryObject(resources.get_object()) if resources is not None else DictionaryObject()
+        xobjects = resources.get("/XObject")
+        xobjects = DictionaryObject(xobjects.get_object()) if xobjects is not None else DictionaryObject()
+        xobjects[NameObject(_BASE_XOBJECT_NAME)] = form_ref
+        resources[NameObject("/XObject")] = xobjects
+        page[NameObject("/Resources")] = resources
+
+        existing = page.raw_get("/Contents") if "/Contents" in page else None
+        if existing is None:
+            parts = []
+        elif isinstance(existing.get_object(), ArrayObject):
+            parts = list(existing.get_object())
+        else:
+            parts = [existing]
+        page[NameObject("/Contents")] = ArrayObject([prefix_ref] + parts)
+
+        for key in ("/MediaBox", "/CropBox", "/Rotate"):
+            if key in base_page:
+                page[NameObject(key)] = base_page[key].clone(writer)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def _merge_pdfium(base_source: Union[str, bytes], overlay_pdf: bytes, total_pages: int) -> bytes:
+    import pypdfium2 as pdfium
+
+    with pdfium_lock:
+        base = pdfium.PdfDocument(base_source)
+        overlay = pdfium.PdfDocument(overlay_pdf)
+        dest = pdfium.PdfDocument.new()
+        xobjects = []
+        try:
+            base_count = len(base)
+            base_xobjects = {}
+            for i in range(total_pages):
+                base_index = min(i, base_count - 1)
+                if base_index not in base_xobjects:
+                    xobject = base.page_as_xobject(base_index, dest)
+                    xobjects.append(xobject)
+                    base_xobjects[base_index] = (xobject, base.get_page_size(base_index))
+                xobject, (width, height) = base_xobjects[base_index]
+                page = dest.new_page(width, height)
+                page.insert_obj(xobject.as_pageobject())
+                if i < len(overlay):
+                    overlay_xobject = overlay.page_as_xobject(i, dest)
+                    page.insert_obj(overlay_xobject.as_pageobject())
+                    overlay_xobject.close()
+                page.gen_content()
+                page.close()
+            out = io.BytesIO()
+            dest.save(out)
+            return out.getvalue()
+        finally:
+            # Cerrar en orden: XObjects antes que el documento destino y las fuentes
+            for xobject in xobjects:
+                xobject.close()
+            dest.close()
+            overlay.close()
+            base.close()
+
+
+def merge_overlay(base_source: Union[str, bytes], overlay_pdf: bytes, total_pages: int, backend: str = None) -> bytes:
+    """
+    Fusiona 'overlay_pdf' sobre la plantilla base y devuelve el PDF resultante.
+
+    Args:
+        base_source: Ruta o bytes del PDF base
+        overlay_pdf: Bytes del PDF overlay (una página por página de salida)
+        total_pages: Número de páginas de salida; si supera las páginas base,
+                     se repite la última página base
+        backend: "pypdf" | "xobject" | "pdfium" (por defecto GENDOC_MERGE_BACKEND)
+    """
+    backend = (backend or MERGE_BACKEND).lower()
+    if backend not in MERGE_BACKENDS:
+        raise ValueError(f"Backend de fusión no soportado: {backend}")
+    if backend == "pdfium":
+        return get_raster_pool().run(_merge_pdfium, base_source, overlay_pdf, total_pages)
+    base_reader = PdfReader(io.BytesIO(base_source) if isinstance(base_source, bytes) else base_source)
+    overlay_reader = PdfReader(io.BytesIO(overlay_pdf))
+    if backend == "xobject":
+        return _merge_xobject(base_reader, overlay_reader, total_pages)
+    return _merge_pypdf(base_reader, overlay_reader, total_pages)
@@ -0,0 +1,97 @@
+"""
+pdf_normalize.py — PDFs reproducibles byte a byte
+-------------------------------------------------
+LibreOffice y pdfium escriben en cada PDF la fecha actual (/CreationDate,
+/ModDate, fechas XMP) e identificadores aleatorios (/ID del trailer, uuid XMP),
+así que dos renders del mismo documento nunca dan los mismos bytes. Aquí se
+sustituyen por valores derivados de una semilla (versión de plantilla + hash
+del payload) y de una fecha fija (la de la versión de la plantilla).
+
+Las sustituciones conservan la longitud exacta de cada valor, de modo que los
+offsets de la tabla xref siguen siendo válidos y no hace falta reescribir el PDF.
+"""
+
+import hashlib
+import re
+import time
+from typing import Callable, Optional
+
+_INFO_DATE_RE = re.compile(rb"(/(?:CreationDate|ModDate)\s*\()([^)]*)(\))")
+_ID_RE = re.compile(rb"(/ID\s*\[\s*<)([0-9A-Fa-f]+)(>\s*<)([0-9A-Fa-f]+)(>)")
+_XMP_RE = re.compile(rb"<x:xmpmeta.*?</x:xmpmeta>", re.S)
+_XMP_DATE_RE = re.compile(rb"(<xmp:(?:CreateDate|ModifyDate|MetadataDate)>)([^<]*)(</xmp:)")
+_XMP_UUID_RE = re.compile(rb"(uuid:)([0-9a-fA-F-]{36})")
+
+
+def _hex(seed: bytes, label: bytes, length: int) -> bytes:
+    """'length' dígitos hexadecimales deterministas para 'label'."""
+    digest = b""
+    counter = 0
+    while len(digest) * 2 < length:
+        digest += hashlib.sha256(seed + label + bytes([counter])).digest()
+        counter += 1
+    return digest.hex()[:length].upper().encode("ascii")
+
+
+def _pdf_date(timestamp: float, length: int) -> Optional[bytes]:
+    """Fecha PDF (D:...) en UTC con la misma longitud que la original, si existe esa forma."""
+    base = time.strftime("D:%Y%m%d%H%M%S", time.gmtime(timestamp))
+    for candidate in (base + "+00'00'", base + "+00'00", base + "Z", base, base[:-2]):
+        if len(candidate) == length:
+            return candidate.encode("ascii")
+    return None
+
+
+def _xmp_date(timestamp: float, length: int) -> Optional[bytes]:
+    base = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(timestamp))
+    for candidate in (base + ".00+00:00", base + ".0+00:00", base + "+00:00", base + "Z", base):
+        if len(candidate) == length:
+            return candidate.encode("ascii")
+    return None
+
+
+def _same_length(fn: Callable[[int], Optional[bytes]]) -> Callable[[re.Match], bytes]:
+    def repl(match: re.Match) -> bytes:
+        value = fn(len(match.group(2)))
+        return match.group(1) + (value if value is not None else match.group(2)) + match.group(3)
+    return repl
+
+
+def normalize_pdf(pdf_bytes: bytes, seed: bytes, timestamp: float) -> bytes:
+    """
+    Sustituye fechas e identificadores variables del PDF por valores deterministas.
+
+    Args:
+        pdf_bytes: PDF generado (LibreOffice, pdfium...)
+        seed: Semilla del documento (p. ej. hash de versión de plantilla + payload)
+        timestamp: Fecha (epoch) que se escribe en /CreationDate, /ModDate y XMP
+
+    Returns:
+        El PDF con la misma longitud y estructura, sin valores dependientes del momento
+    """
+    out = _INFO_DATE_RE.sub(_same_length(lambda n: _pdf_date(timestamp, n)), pdf_bytes)
+
+    def id_repl(match: re.Match) -> bytes:
+        # Primer elemento: identificador permanente; segundo: el de esta revisión
+        return (match.group(1) + _hex(seed, b"id0", len(match.group(2))) + match.group(3)
+                + _hex(seed, b"id1", len(match.group(4))) + match.group(5))
+    out = _ID_RE.sub(id_repl, out)
+
+    def xmp_repl(block: re.Match) -> bytes:
+        xmp = _XMP_DATE_RE.sub(_same_length(lambda n: _xmp_date(timestamp, n)), block.group(0))
+        uuids = {}
+
+        def uuid_repl(match: re.Match) -> bytes:
+            # Mismo uuid de entrada -> mismo uuid de salida (DocumentID/InstanceID)
+            original = match.group(2)
+            if original not in uuids:
+                digits = _hex(seed, b"uuid" + bytes([len(uuids)]), 32).lower()
+                uuids[original] = b"-".join((digits[:8], digits[8:12], digits[12:16], digits[16:20], digits[20:]))
+            return match.group(1) + uuids[original]
+        return _XMP_UUID_RE.sub(uuid_repl, xmp)
+    return _XMP_RE.sub(xmp_repl, out)
+
+
+def document_id(seed: bytes, label: bytes = b"id1", length: int = 16) -> bytes:
+    """Identificador binario determinista (p. ej. segundo elemento de /ID)."""
+    return bytes.fromhex(_hex(seed, label, length * 2).decode("ascii"))
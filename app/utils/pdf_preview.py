@@ -1,21 +1,37 @@
-from typing import Optional
-import pypdfium2 as pdfium
+from .raster_canvas import pdfium_lock
+from .raster_pool import get_raster_pool
 import io
 
 PREVIEW_SCALE: float = 1.5
 
 
-def render_pdf_page_png(file_path: str, page_index_zero_based: int, scale: float = PREVIEW_SCALE) -> bytes:
-    pdf = pdfium.PdfDocument(file_path)
-    page_count = len(pdf)
-    if page_index_zero_based < 0 or page_index_zero_based >= page_count:
-        page_index_zero_based = 0
-    page = pdf.get_page(page_index_zero_based)
-    pil_image = page.render(scale=scale).to_pil()
-    bio = io.BytesIO()
-    pil_image.save(bio, format="PNG")
+def _render_page_png(file_path: str, page_index_zero_based: int, scale: float) -> bytes:
+    import pypdfium2 as pdfium
+
+    with pdfium_lock:
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            page_count = len(pdf)
+            if page_index_zero_based < 0 or page_index_zero_based >= page_count:
+                page_index_zero_based = 0
+            page = pdf[page_index_zero_based]
+            try:
+                bitmap = page.render(scale=scale)
+                pil_image = bitmap.to_pil()
+                bio = io.BytesIO()
+                pil_image.save(bio, format="PNG")
+                bitmap.close()
+            finally:
+                page.close()
+        finally:
+            pdf.close()
     return bio.getvalue()
 
 
+def render_pdf_page_png(file_path: str, page_index_zero_based: int, scale: float = PREVIEW_SCALE) -> bytes:
+    # Se rasteriza en el pool de procesos de pdfium (ver raster_pool)
+    return get_raster_pool().run(_render_page_png, file_path, page_index_zero_based, scale)
+
+
 def get_preview_scale() -> float:
     return PREVIEW_SCALE
\ No newline at end of file
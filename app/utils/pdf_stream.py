@@ -0,0 +1,288 @@
+"""
+pdf_stream.py — PDF overlay escrito por partes según se terminan las páginas
+---------------------------------------------------------------------------
+merge_overlay necesita el overlay completo y devuelve el documento entero en
+memoria: con decenas de miles de filas (_repeat_rows) el primer byte sale
+cuando ya se ha construido todo el PDF. Aquí el documento se escribe de forma
+incremental:
+
+  - cada página base distinta se escribe una sola vez como Form XObject
+    (como el backend "xobject" de pdf_merge; las anotaciones de la base no se copian);
+  - el overlay llega por lotes de páginas (un PDF de reportlab por lote): sus
+    páginas se copian con una referencia al XObject base por debajo y se
+    emiten en cuanto el lote está escrito;
+  - al final van el árbol de páginas, el catálogo, la tabla xref y el trailer.
+    De cada objeto solo se guarda su offset, así que la memoria depende del
+    tamaño del lote y no del número de páginas.
+"""
+
+import hashlib
+import io
+import os
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+from pypdf import PdfReader
+from pypdf.generic import (
+    ArrayObject, ByteStringObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject,
+    FloatObject, IndirectObject, NameObject, NumberObject, PdfObject, StreamObject, TextStringObject,
+)
+from .pdf_merge import _BASE_XOBJECT_NAME, _inherited_resources
+
+# Páginas overlay por lote: se dibujan, se escriben y se liberan juntas
+STREAM_BATCH_PAGES = max(1, int(os.getenv("GENDOC_STREAM_BATCH_PAGES", "25")))
+
+
+class PdfStreamWriter:
+    """Escritor PDF incremental: cada objeto se serializa en cuanto se añade."""
+
+    def __init__(self, write: Callable[[bytes], None]):
+        self._write = write
+        self._offset = 0
+        self._offsets: Dict[int, int] = {}
+        self._next_id = 1
+        self._emit(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def _emit(self, data: bytes):
+        self._write(data)
+        self._offset += len(data)
+
+    def reserve(self) -> IndirectObject:
+        """Número de objeto para escribirlo más tarde (p. ej. el árbol de páginas)."""
+        ref = IndirectObject(self._next_id, 0, None)
+        self._next_id += 1
+        return ref
+
+    def write_object(self, ref: IndirectObject, obj: PdfObject):
+        buf = io.BytesIO()
+        buf.write(f"{ref.idnum} 0 obj\n".encode("ascii"))
+        obj.write_to_stream(buf)
+        buf.write(b"\nendobj\n")
+        self._offsets[ref.idnum] = self._offset
+        self._emit(buf.getvalue())
+
+    def add(self, obj: PdfObject) -> IndirectObject:
+        ref = self.reserve()
+        self.write_object(ref, obj)
+        return ref
+
+    def close(self, root: IndirectObject, info: Optional[IndirectObject], file_id: bytes):
+        """Tabla xref y trailer (todos los objetos reservados deben estar escritos)."""
+        xref_offset = self._offset
+        lines = [f"xref\n0 {self._next_id}\n0000000000 65535 f \n"]
+        lines.extend(f"{self._offsets[num]:010d} 00000 n \n" for num in range(1, self._next_id))
+        trailer = DictionaryObject({
+            NameObject("/Size"): NumberObject(self._next_id),
+            NameObject("/Root"): root,
+            NameObject("/ID"): ArrayObject([ByteStringObject(file_id), ByteStringObject(file_id)]),
+        })
+        if info is not None:
+            trailer[NameObject("/Info")] = info
+        buf = io.BytesIO()
+        buf.write("".join(lines).encode("ascii"))
+        buf.write(b"trailer\n")
+        trailer.write_to_stream(buf)
+        buf.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+        self._emit(buf.getvalue())
+
+
+def _is_shared_resource(obj: Any) -> bool:
+    """Fuentes e imágenes: lo que cada lote de overlay repite con el mismo contenido."""
+    return isinstance(obj, DictionaryObject) and (obj.get("/Type") == "/Font" or obj.get("/Subtype") == "/Image")
+
+
+def _fingerprint(obj: Any, seen: Optional[set] = None) -> Optional[bytes]:
+    """
+    Huella del contenido de 'obj' incluyendo los objetos a los que referencia
+    (None si hay un ciclo). Dos recursos con la misma huella son intercambiables.
+    """
+    seen = set() if seen is None else seen
+    digest = hashlib.sha1()
+
+    def feed(value: Any) -> bool:
+        if isinstance(value, IndirectObject):
+            if value.idnum in seen:
+                return False
+            seen.add(value.idnum)
+            ok = feed(value.get_object())
+            seen.discard(value.idnum)
+            return ok
+        if isinstance(value, DictionaryObject):
+            digest.update(b"<<")
+            for key in sorted(value.keys()):
+                digest.update(key.encode("utf-8"))
+                if not feed(value.raw_get(key)):
+                    return False
+            if isinstance(value, StreamObject):
+                digest.update(b"stream")
+                digest.update(value._data)
+            digest.update(b">>")
+            return True
+        if isinstance(value, ArrayObject):
+            digest.update(b"[")
+            if not all(feed(item) for item in value):
+                return False
+            digest.update(b"]")
+            return True
+        buf = io.BytesIO()
+        value.write_to_stream(buf)
+        digest.update(buf.getvalue() + b" ")
+        return True
+
+    return digest.digest() if feed(obj) else None
+
+
+class _Importer:
+    """
+    Copia objetos de un PdfReader al escritor, renumerando sus referencias.
+    Con 'shared' (huella -> referencia ya escrita, común a varios importadores)
+    las fuentes e imágenes con el mismo contenido se escriben una sola vez.
+    """
+
+    def __init__(self, writer: PdfStreamWriter, shared: Optional[Dict[bytes, IndirectObject]] = None):
+        self.writer = writer
+        self._refs: Dict[int, IndirectObject] = {}
+        self._pending: List[IndirectObject] = []
+        self._shared = shared
+
+    def bind(self, source: IndirectObject, target: IndirectObject):
+        """Las referencias a 'source' apuntarán a 'target' (p. ej. /P de anotaciones -> página nueva)."""
+        self._refs[source.idnum] = target
+
+    def ref(self, source: IndirectObject) -> IndirectObject:
+        target = self._refs.get(source.idnum)
+        if target is not None:
+            return target
+        key = None
+        if self._shared is not None and _is_shared_resource(source.get_object()):
+            key = _fingerprint(source)
+            if key is not None and key in self._shared:
+                target = self._refs[source.idnum] = self._shared[key]
+                return target
+        target = self._refs[source.idnum] = self.writer.reserve()
+        self._pending.append(source)
+        if key is not None:
+            self._shared[key] = target
+        return target
+
+    def copy(self, obj: Any) -> Any:
+        if isinstance(obj, IndirectObject):
+            return self.ref(obj)
+        if isinstance(obj, StreamObject):
+            out = EncodedStreamObject() if isinstance(obj, EncodedStreamObject) else DecodedStreamObject()
+            out._data = obj._data
+            for key, value in obj.items():
+                out[key] = self.copy(value)
+            return out
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({key: self.copy(value) for key, value in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.copy(value) for value in obj)
+        return obj
+
+    def flush(self):
+        """Escribe los objetos referenciados por lo copiado hasta ahora."""
+        while self._pending:
+            source = self._pending.pop()
+            self.writer.write_object(self._refs[source.idnum], self.copy(source.get_object()))
+
+
+def stream_overlay(base_source: Union[str, bytes], overlay_batches: Iterable[bytes], file_id: bytes) -> Iterator[bytes]:
+    """
+    PDF de salida por partes: páginas base por debajo y, encima, las páginas
+    de cada lote de overlay. Si hay más páginas que páginas base, se repite la
+    última página base (como merge_overlay).
+
+    Args:
+        base_source: Ruta o bytes del PDF base
+        overlay_batches: PDFs overlay (bytes) con páginas consecutivas, lote a lote
+        file_id: Identificador (/ID) del documento, 16 bytes
+
+    Returns:
+        Iterador de trozos del PDF: cada lote al terminarlo (el primero con la cabecera) y al final el trailer
+    """
+    chunks: List[bytes] = []
+    writer = PdfStreamWriter(chunks.append)
+    base_reader = PdfReader(io.BytesIO(base_source) if isinstance(base_source, bytes) else base_source)
+    # Fuentes e imágenes ya escritas (huella -> referencia), comunes a la base y a todos los lotes
+    shared: Dict[bytes, IndirectObject] = {}
+    base_importer = _Importer(writer, shared)
+    base_count = len(base_reader.pages)
+    # índice de página base -> (ref Form XObject, ref stream "q /GDBase Do Q", página base)
+    base_forms: Dict[int, tuple] = {}
+    pages_ref = writer.reserve()
+    kids = ArrayObject()
+
+    def base_form(base_index: int) -> tuple:
+        if base_index not in base_forms:
+            base_page = base_reader.pages[base_index]
+            form = DecodedStreamObject()
+            contents = base_page.get_contents()
+            form.set_data(contents.get_data() if contents is not None else b"")
+            box = base_page.mediabox
+            form.update({
+                NameObject("/Type"): NameObject("/XObject"),
+                NameObject("/Subtype"): NameObject("/Form"),
+                NameObject("/BBox"): ArrayObject([FloatObject(box.left), FloatObject(box.bottom), FloatObject(box.right), FloatObject(box.top)]),
+                NameObject("/Resources"): base_importer.copy(_inherited_resources(base_page)),
+            })
+            prefix = DecodedStreamObject()
+            prefix.set_data(f"q {_BASE_XOBJECT_NAME} Do Q\n".encode("ascii"))
+            base_forms[base_index] = (writer.add(form), writer.add(prefix), base_page)
+            base_importer.flush()
+        return base_forms[base_index]
+
+    # La cabecera sale con el primer lote: un error al dibujarlo (datos no
+    # válidos) todavía puede responderse como error antes de enviar nada
+    for overlay_pdf in overlay_batches:
+        overlay_reader = PdfReader(io.BytesIO(overlay_pdf))
+        importer = _Importer(writer, shared)
+        for overlay_page in overlay_reader.pages:
+            form_ref, prefix_ref, base_page = base_form(min(len(kids), base_count - 1))
+            page_ref = writer.reserve()
+            importer.bind(overlay_page.indirect_reference, page_ref)
+
+            page = DictionaryObject({
+                key: importer.copy(overlay_page.raw_get(key))
+                for key in overlay_page.keys() if key not in ("/Parent", "/Resources", "/Contents")
+            })
+            page[NameObject("/Parent")] = pages_ref
+            source = overlay_page["/Resources"] if "/Resources" in overlay_page else DictionaryObject()
+            resources = DictionaryObject({key: importer.copy(value) for key, value in source.items() if key != "/XObject"})
+            xobjects = source["/XObject"] if "/XObject" in source else DictionaryObject()
+            xobjects = DictionaryObject({key: importer.copy(value) for key, value in xobjects.items()})
+            xobjects[NameObject(_BASE_XOBJECT_NAME)] = form_ref
+            resources[NameObject("/XObject")] = xobjects
+            page[NameObject("/Resources")] = resources
+
+            existing = overlay_page.raw_get("/Contents") if "/Contents" in overlay_page else None
+            if existing is None:
+                parts = []
+            elif isinstance(existing.get_object(), ArrayObject):
+                parts = [importer.copy(part) for part in existing.get_object()]
+            else:
+                parts = [importer.copy(existing)]
+            page[NameObject("/Contents")] = ArrayObject([prefix_ref] + parts)
+
+            for key in ("/MediaBox", "/CropBox", "/Rotate"):
+                if key in base_page:
+                    page[NameObject(key)] = base_importer.copy(base_page[key])
+            base_importer.flush()
+            writer.write_object(page_ref, page)
+            kids.append(page_ref)
+        importer.flush()
+        yield b"".join(chunks)
+        chunks.clear()
+
+    if not kids:
+        raise ValueError("El overlay no tiene páginas")
+    writer.write_object(pages_ref, DictionaryObject({
+        NameObject("/Type"): NameObject("/Pages"),
+        NameObject("/Kids"): kids,
+        NameObject("/Count"): NumberObject(len(kids)),
+    }))
+    root = writer.add(DictionaryObject({
+        NameObject("/Type"): NameObject("/Catalog"),
+        NameObject("/Pages"): pages_ref,
+    }))
+    info = writer.add(DictionaryObject({NameObject("/Producer"): TextStringObject("GenDoc")}))
+    writer.close(root, info, file_id)
+    yield b"".join(chunks)
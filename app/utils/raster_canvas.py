@@ -0,0 +1,236 @@
+"""
+raster_canvas.py — dibujo de la capa overlay directamente sobre un bitmap
+-----------------------------------------------------------------------
+RasterCanvas implementa el subconjunto del API de reportlab Canvas que usan los
+helpers de _render_pdf_overlay (setFont, drawString, rect, beginForm/doForm,
+drawImage, beginText/drawText...) pero dibuja con Pillow sobre una copia del
+bitmap de la página base. Así la salida "image" de una plantilla overlay no
+necesita generar, fusionar ni volver a parsear un PDF.
+
+Las coordenadas de entrada son puntos PDF (origen abajo-izquierda); se pasan a
+píxeles con x * scale, (alto - y) * scale. Las fuentes se resuelven con el mismo
+fichero que usa reportlab (Type1 .pfb de las 14 estándar o el TTF registrado) y
+cada glifo se coloca con los anchos de reportlab, así que el texto ocupa lo
+mismo que en el PDF (test_raster_overlay.py compara ambas rutas).
+"""
+
+import math
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Optional, Tuple, Union
+from PIL import Image, ImageDraw, ImageFont
+from reportlab.pdfbase import pdfmetrics
+
+# pdfium no es thread-safe dentro de un proceso
+pdfium_lock = threading.Lock()
+
+
+def rasterize_page(pdf_source: Union[str, bytes], page_index: int, scale: Union[float, Callable[[float, float], float]]) -> Image.Image:
+    """
+    Rasteriza una página de un PDF (ruta o bytes) con pypdfium2 y devuelve una imagen RGB.
+    'scale' puede ser una función (ancho_pt, alto_pt) -> escala, para rasterizar
+    directamente al tamaño final sin abrir el PDF dos veces.
+
+    pdfium escribe directamente en orden RGB (rev_byteorder), así que el paso a PIL
+    es una única copia sin reordenar canales; el bitmap nativo se libera enseguida.
+    En el servidor se llama a través de raster_pool (get_raster_pool().run).
+    """
+    import pypdfium2 as pdfium
+
+    with pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_source)
+        try:
+            page = pdf[page_index]
+            try:
+                if callable(scale):
+                    scale = scale(*page.get_size())
+                bitmap = page.render(scale=scale, rev_byteorder=True)
+                image = bitmap.to_pil()
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
+                bitmap.close()
+            finally:
+                page.close()
+        finally:
+            pdf.close()
+    return image
+
+
+@lru_cache(maxsize=256)
+def _pil_font(font_name: str, size_px: float) -> ImageFont.FreeTypeFont:
+    face = pdfmetrics.getFont(font_name).face
+    path = face.findT1File() if hasattr(face, "findT1File") else getattr(face, "filename", None)
+    if not path:
+        raise ValueError(f"Fuente sin fichero para rasterizar: {font_name}")
+    return ImageFont.truetype(path, size_px, layout_engine=ImageFont.Layout.BASIC)
+
+
+# Posiciones de glifo distintas dentro de un píxel (la caché guarda una máscara por cada una)
+_SUBPIXELS = 4
+
+
+@lru_cache(maxsize=8192)
+def _glyph(font_name: str, size_px: float, char: str, sub_x: int, sub_y: int) -> Tuple[Optional[Image.Image], int, int]:
+    """
+    Máscara (L) de un glifo con su origen de línea base desplazado
+    (sub_x, sub_y)/_SUBPIXELS píxeles, y su posición respecto a ese píxel.
+    Renderizar con FreeType cuesta lo mismo para un glifo que para un texto
+    corto, y los textos de una página repiten casi siempre los mismos glifos.
+    """
+    font = _pil_font(font_name, size_px)
+    ox, oy = sub_x / _SUBPIXELS, sub_y / _SUBPIXELS
+    left, top, right, bottom = font.getbbox(char, anchor="ls")
+    left, top = math.floor(left + ox), math.floor(top + oy)
+    width, height = math.ceil(right + ox) - left + 1, math.ceil(bottom + oy) - top + 1
+    if width <= 1 or height <= 1:
+        return None, 0, 0
+    mask = Image.new("L", (width, height))
+    ImageDraw.Draw(mask).text((ox - left, oy - top), char, font=font, fill=255, anchor="ls")
+    return mask, left, top
+
+
+def _size_px(size: float, scale: float) -> float:
+    """Tamaño de fuente en píxeles, fraccionario (redondeado para la caché de fuentes)."""
+    return max(1.0, round(size * scale, 2))
+
+
+def _rgb(color: Any) -> Tuple[int, int, int]:
+    r, g, b = color.rgb()
+    return int(round(r * 255)), int(round(g * 255)), int(round(b * 255))
+
+
+class _RasterText:
+    """Equivalente mínimo de reportlab PDFTextObject (ver RepeatRowLayout.draw_page)."""
+
+    def __init__(self):
+        self.runs = []
+        self._font = None
+        self._fill = None
+        self._origin = (0.0, 0.0)
+
+    def setFont(self, font_name: str, size: float):
+        self._font = (font_name, size)
+
+    def setFillColor(self, color: Any):
+        self._fill = color
+
+    def setTextOrigin(self, x: float, y: float):
+        self._origin = (x, y)
+
+    def textOut(self, text: str):
+        self.runs.append((self._font, self._fill, self._origin, text))
+
+
+class RasterCanvas:
+    def __init__(self, base_image: Image.Image, page_height: float, scale: float):
+        """
+        Args:
+            base_image: Bitmap de la página base (no se modifica; se dibuja sobre una copia)
+            page_height: Alto de la página en puntos PDF
+            scale: Píxeles por punto PDF del bitmap base
+        """
+        self.image = base_image.copy()
+        self._draw = ImageDraw.Draw(self.image)
+        self._page_height = page_height
+        self._scale = scale
+        self._font = ("Helvetica", 10.0)
+        self._fill = (0, 0, 0)
+        self._stroke = (0, 0, 0)
+        self._line_width = 1.0
+        self._origin = (0.0, 0.0)
+        self._states = []
+        self._forms = {}
+        self._recording = None
+
+    def _px(self, x: float, y: float) -> Tuple[float, float]:
+        return (x + self._origin[0]) * self._scale, (self._page_height - (y + self._origin[1])) * self._scale
+
+    def _text(self, font: Tuple[str, float], fill: Tuple[int, int, int], x: float, y: float, text: str):
+        if not text:
+            return
+        name, size = font
+        size_px = _size_px(size, self._scale)
+        # Glifo a glifo con los avances de reportlab (los mismos que en el PDF): el
+        # avance de FreeType, redondeado a píxeles, ensancharía cada texto
+        for char in text:
+            px, py = self._px(x, y)
+            left, top = math.floor(px), math.floor(py)
+            glyph, dx, dy = _glyph(name, size_px, char, round((px - left) * _SUBPIXELS), round((py - top) * _SUBPIXELS))
+            if glyph is not None:
+                self.image.paste(fill, (left + dx, top + dy), glyph)
+            x += pdfmetrics.stringWidth(char, name, size)
+
+    # -------- estado --------
+
+    def setFont(self, font_name: str, size: float):
+        # Igual que reportlab: una fuente desconocida lanza excepción y el llamador usa Helvetica
+        _pil_font(font_name, _size_px(float(size), self._scale))
+        self._font = (font_name, float(size))
+
+    def setFillColor(self, color: Any):
+        self._fill = _rgb(color)
+
+    def setStrokeColor(self, color: Any):
+        self._stroke = _rgb(color)
+
+    def setLineWidth(self, width: float):
+        self._line_width = float(width)
+
+    def saveState(self):
+        self._states.append((self._font, self._fill, self._stroke, self._line_width, self._origin))
+
+    def restoreState(self):
+        self._font, self._fill, self._stroke, self._line_width, self._origin = self._states.pop()
+
+    def translate(self, dx: float, dy: float):
+        self._origin = (self._origin[0] + dx, self._origin[1] + dy)
+
+    # -------- dibujo --------
+
+    def drawString(self, x: float, y: float, text: str):
+        self._text(self._font, self._fill, x, y, text)
+
+    def rect(self, x: float, y: float, width: float, height: float):
+        x0, y1 = self._px(x, y)
+        x1, y0 = self._px(x + width, y + height)
+        self._draw.rectangle([x0, y0, x1, y1], outline=self._stroke, width=max(1, int(round(self._line_width * self._scale))))
+
+    def beginText(self) -> _RasterText:
+        return _RasterText()
+
+    def drawText(self, text: _RasterText):
+        for font, fill, (x, y), value in text.runs:
+            self._text(font, _rgb(fill), x, y, value)
+
+    def drawImage(self, image: Any, x: float, y: float, width: float, height: float, preserveAspectRatio: bool = False, mask: Optional[str] = None):
+        if self._recording is not None:
+            self._recording.append((image, x, y, width, height, preserveAspectRatio))
+            return
+        self._paste(image, x, y, width, height, preserveAspectRatio)
+
+    def _paste(self, image: Any, x: float, y: float, width: float, height: float, preserve: bool):
+        src = getattr(image, "_image", image)
+        src_w, src_h = src.size
+        if preserve and src_w and src_h:
+            # reportlab centra la imagen dentro del recuadro (anchor 'c')
+            ratio = min(width / src_w, height / src_h)
+            x += (width - src_w * ratio) / 2
+            y += (height - src_h * ratio) / 2
+            width, height = src_w * ratio, src_h * ratio
+        left, top = self._px(x, y + height)
+        size = (max(1, int(round(width * self._scale))), max(1, int(round(height * self._scale))))
+        resized = src.convert("RGBA").resize(size, Image.Resampling.LANCZOS)
+        self.image.paste(resized, (int(round(left)), int(round(top))), resized)
+
+    # -------- Form XObjects (una imagen dibujada en varias posiciones) --------
+
+    def beginForm(self, name: str, *args, **kwargs):
+        self._recording = []
+        self._forms[name] = self._recording
+
+    def endForm(self):
+        self._recording = None
+
+    def doForm(self, name: str):
+        for image, x, y, width, height, preserve in self._forms.get(name, ()):
+            self._paste(image, x, y, width, height, preserve)
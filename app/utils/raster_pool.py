@@ -0,0 +1,268 @@
+"""
+raster_pool.py — pool de procesos para todo el trabajo con pdfium
+----------------------------------------------------------------
+pdfium no es thread-safe dentro de un proceso y sus documentos viven en memoria
+nativa que el GC de Python no ve, así que el rasterizado (vista previa del
+editor, salida "image" de una o varias páginas, bitmap base de las plantillas
+overlay) y la fusión con backend "pdfium" se ejecutan en procesos dedicados:
+
+  - cada tarea abre y cierra explícitamente sus documentos, páginas y bitmaps;
+  - después de cada tarea el worker informa de su RSS actual y, si supera
+    GENDOC_RASTER_RECYCLE_MB, el pool se sustituye por uno nuevo: las tareas en
+    curso terminan en los procesos viejos, que salen al quedar libres (sin
+    forma de medir el RSS actual no se recicla);
+  - las métricas registradas en el worker (image_encode.*) se suman a las del
+    proceso principal (metrics.merge), así que /api/metrics sigue viéndolas.
+
+Los procesos se crean con "spawn": un fork del servidor podría heredar
+pdfium_lock tomado por otro hilo y bloquearse para siempre.
+GENDOC_RASTER_WORKERS=0 ejecuta todo en el propio proceso (serializado con pdfium_lock).
+"""
+
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from . import metrics
+from .raster_canvas import pdfium_lock, rasterize_page
+
+logger = logging.getLogger(__name__)
+
+RASTER_WORKERS = max(0, int(os.getenv("GENDOC_RASTER_WORKERS", str(min(4, os.cpu_count() or 1)))))
+# RSS a partir del cual se reciclan los procesos de rasterizado
+RASTER_RECYCLE_MB = float(os.getenv("GENDOC_RASTER_RECYCLE_MB", "512"))
+# Páginas máximas por tarea: bloques pequeños para que las primeras páginas
+# lleguen pronto a la respuesta en streaming
+_MAX_PAGES_PER_TASK = 8
+
+PageImage = Tuple[bytes, int, int]
+
+
+def current_rss() -> Optional[int]:
+    """
+    RSS actual del proceso en bytes (no el pico, que nunca baja): /proc en
+    Linux y psutil en el resto. None si no hay forma de medirlo; entonces el
+    pool no se recicla por RSS.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return None
+
+
+def _run_task(fn: Callable, args: tuple) -> Tuple[Any, Dict[str, Any], Optional[int]]:
+    """Envoltorio en el worker: resultado + métricas de la tarea + RSS al terminar."""
+    metrics.reset()
+    result = fn(*args)
+    return result, metrics.snapshot(), current_rss()
+
+
+def _render_chunk(pdf_source: Union[str, bytes], page_indices: Sequence[int], scale: Callable[[float, float], float], encode_kwargs: Dict[str, Any]) -> List[PageImage]:
+    """Tarea del worker: rasteriza y codifica un bloque de páginas de un mismo PDF."""
+    import pypdfium2 as pdfium
+    from .image_optimizer import optimize_image
+
+    results = []
+    pdf = None
+    try:
+        for index in page_indices:
+            # Solo pdfium va bajo el lock; la codificación no lo necesita
+            with pdfium_lock:
+                if pdf is None:
+                    pdf = pdfium.PdfDocument(pdf_source)
+                page = pdf[index]
+                try:
+                    bitmap = page.render(scale=scale(*page.get_size()), rev_byteorder=True)
+                    # En RGB to_pil ya copia los píxeles; en otros modos la copia es el convert
+                    image = bitmap.to_pil()
+                    if image.mode != "RGB":
+                        image = image.convert("RGB")
+                    bitmap.close()
+                finally:
+                    page.close()
+            results.append(optimize_image(image, **encode_kwargs))
+    finally:
+        if pdf is not None:
+            with pdfium_lock:
+                pdf.close()
+    return results
+
+
+def encode_outputs(image, encode_kwargs: Optional[Dict[str, Any]], thumbnail_sizes: Sequence[int], thumbnail_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Salidas de un mismo bitmap: "image" (con encode_kwargs, si no es None) y
+    "thumbnails" [(lado máximo, bytes, ancho, alto)] de mayor a menor; cada
+    miniatura parte de la anterior (más grande), no del bitmap completo.
+    """
+    from PIL import Image
+    from .image_optimizer import optimize_image
+
+    result: Dict[str, Any] = {}
+    if encode_kwargs is not None:
+        result["image"] = optimize_image(image, **encode_kwargs)
+    thumbnails = []
+    source = image
+    for size in thumbnail_sizes:
+        thumb = source.copy()
+        thumb.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        data_bytes, width, height = optimize_image(thumb, **thumbnail_kwargs)
+        thumbnails.append((size, data_bytes, width, height))
+        source = thumb
+    if thumbnail_sizes:
+        result["thumbnails"] = thumbnails
+    return result
+
+
+def _render_outputs(pdf_source: Union[str, bytes], scale: Callable[[float, float], float], encode_kwargs: Optional[Dict[str, Any]], thumbnail_sizes: Sequence[int], thumbnail_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Tarea del worker: rasteriza la primera página y codifica sus salidas (el bitmap no sale del worker)."""
+    return encode_outputs(rasterize_page(pdf_source, 0, scale), encode_kwargs, thumbnail_sizes, thumbnail_kwargs)
+
+
+class RasterPool:
+    """
+    Pool de procesos de rasterizado. Limita los procesos pdfium simultáneos
+    igual que SofficePool limita los de LibreOffice, y los recicla por RSS.
+    """
+
+    def __init__(self, max_workers: int = RASTER_WORKERS, recycle_mb: float = RASTER_RECYCLE_MB):
+        """
+        Inicializa el pool de rasterizado.
+
+        Args:
+            max_workers: Número máximo de procesos de rasterizado simultáneos
+                         (0 = en el propio proceso)
+            recycle_mb: RSS (MB) de un worker a partir del cual se recicla el pool
+        """
+        self.max_workers = max_workers
+        self.recycle_bytes = int(recycle_mb * 1024 * 1024)
+        self.recycles = 0
+        self._lock = threading.Lock()
+        self.executor = self._new_executor() if max_workers else None
+        logger.info(f"RasterPool inicializado con {max_workers} workers")
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _submit(self, fn: Callable, *args) -> Tuple[Future, ProcessPoolExecutor]:
+        with self._lock:
+            executor = self.executor
+            return executor.submit(_run_task, fn, args), executor
+
+    def _finish(self, future: Future, executor: ProcessPoolExecutor) -> Any:
+        result, worker_metrics, rss = future.result()
+        metrics.merge(worker_metrics)
+        if rss is None:
+            return result
+        metrics.observe("raster_pool.worker_rss_mb", rss / (1024 * 1024))
+        if rss > self.recycle_bytes:
+            self._recycle(executor, rss)
+        return result
+
+    def _recycle(self, executor: ProcessPoolExecutor, rss: int):
+        with self._lock:
+            if self.executor is not executor:
+                return  # otra petición ya lo ha reciclado
+            self.executor = self._new_executor()
+            self.recycles += 1
+        # Sin esperar: las tareas ya enviadas terminan y los procesos viejos salen
+        executor.shutdown(wait=False)
+        metrics.incr("raster_pool.recycles")
+        logger.info(f"RasterPool reciclado (RSS de un worker: {rss / (1024 * 1024):.0f}MB)")
+
+    def run(self, fn: Callable, *args) -> Any:
+        """
+        Ejecuta fn(*args) en un worker y devuelve su resultado. 'fn' debe ser una
+        función de nivel de módulo (picklable) que abra y cierre sus documentos.
+        """
+        if not self.max_workers:
+            return fn(*args)
+        return self._finish(*self._submit(fn, *args))
+
+    def render_outputs(self, pdf_source: Union[str, bytes], scale: Callable[[float, float], float], encode_kwargs: Optional[Dict[str, Any]], thumbnail_sizes: Sequence[int] = (), thumbnail_kwargs: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Rasteriza la primera página y la codifica en el worker: al proceso
+        principal solo vuelven los bytes codificados (ver encode_outputs).
+
+        Args:
+            pdf_source: Ruta del PDF (preferible: no se copian los bytes a la tarea) o bytes
+            scale: Función picklable (ancho_pt, alto_pt) -> escala de pdfium
+            encode_kwargs: Argumentos de optimize_image para "image" (None = sin imagen)
+            thumbnail_sizes: Lados máximos de las miniaturas, de mayor a menor
+            thumbnail_kwargs: Argumentos de optimize_image para las miniaturas
+        """
+        return self.run(_render_outputs, pdf_source, scale, encode_kwargs, list(thumbnail_sizes), thumbnail_kwargs or {})
+
+    def render_pages(self, pdf_source: Union[str, bytes], page_indices: Sequence[int], scale: Callable[[float, float], float], encode_kwargs: Dict[str, Any]) -> Iterator[PageImage]:
+        """
+        Rasteriza y codifica 'page_indices' (base 0) en paralelo.
+
+        Todas las tareas se envían antes de devolver el iterador; los resultados
+        salen en el orden de 'page_indices' a medida que terminan los bloques.
+
+        Args:
+            pdf_source: Ruta del PDF (preferible: no se copian los bytes a cada tarea) o bytes
+            page_indices: Páginas a rasterizar, base 0
+            scale: Función picklable (ancho_pt, alto_pt) -> escala de pdfium
+            encode_kwargs: Argumentos de image_optimizer.optimize_image
+
+        Returns:
+            Iterador de (bytes de imagen, ancho, alto)
+        """
+        pages = list(page_indices)
+        if not self.max_workers:
+            return (image for image in _render_chunk(pdf_source, pages, scale, encode_kwargs))
+
+        chunk = max(1, min(_MAX_PAGES_PER_TASK, math.ceil(len(pages) / self.max_workers)))
+        tasks = [
+            self._submit(_render_chunk, pdf_source, pages[i:i + chunk], scale, encode_kwargs)
+            for i in range(0, len(pages), chunk)
+        ]
+
+        def results() -> Iterator[PageImage]:
+            try:
+                for future, executor in tasks:
+                    yield from self._finish(future, executor)
+            finally:
+                # Cliente desconectado o error: no seguir rasterizando lo pendiente
+                for future, _ in tasks:
+                    future.cancel()
+
+        return results()
+
+    def shutdown(self):
+        """Cierra el pool de procesos."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        logger.info("RasterPool cerrado")
+
+
+# Instancia global del pool
+_raster_pool: Optional[RasterPool] = None
+_raster_pool_lock = threading.Lock()
+
+
+def get_raster_pool() -> RasterPool:
+    """Obtiene la instancia global del pool de rasterizado (se crea al primer uso)."""
+    global _raster_pool
+    with _raster_pool_lock:
+        if _raster_pool is None:
+            _raster_pool = RasterPool()
+        return _raster_pool
+
+
+def shutdown_raster_pool():
+    """Cierra la instancia global del pool."""
+    global _raster_pool
+    with _raster_pool_lock:
+        if _raster_pool:
+            _raster_pool.shutdown()
+            _raster_pool = None
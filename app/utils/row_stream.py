@@ -0,0 +1,120 @@
+"""
+row_stream.py — entrada NDJSON para _repeat_rows muy grandes
+------------------------------------------------------------
+Con Content-Type: application/x-ndjson, /api/render recibe:
+
+    {"template_id": "...", "data": {...}, ...}    <- 1ª línea: la petición sin el array
+    {"desc": "Item 1", "qty": 1}                  <- una línea por item de _repeat_rows
+    {"desc": "Item 2", "qty": 2}
+    ...
+
+El cuerpo se vuelca según llega a un SpooledTemporaryFile (en memoria hasta
+GENDOC_STREAM_SPOOL_MB, después en disco) y los items se parsean uno a uno
+cuando el motor de filas (RepeatRowLayout.paginate) los pide, página a página.
+La memoria de la petición no depende del número de items.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+from jsonschema import Draft202012Validator
+from . import fast_json
+from .soffice import SCRATCH_DIR
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+# Tamaño a partir del cual el cuerpo NDJSON pasa de memoria a disco
+STREAM_SPOOL_BYTES = int(float(os.getenv("GENDOC_STREAM_SPOOL_MB", "8")) * 1024 * 1024)
+
+_READ_SIZE = 64 * 1024
+
+
+class RowStream:
+    """
+    Items de un array leídos bajo demanda de un fichero NDJSON (una línea por item).
+
+    Se comporta como una secuencia de solo lectura: len() cuenta las líneas (sin
+    parsearlas) y cada iteración vuelve a leer el fichero desde el primer item,
+    con su propia posición (se pueden recorrer varias a la vez).
+    """
+
+    def __init__(self, spool, offset: int, digest: str):
+        self._spool = spool
+        self._spool_lock = threading.Lock()
+        self._offset = offset
+        self._count: Optional[int] = None
+        self._validator: Optional[Draft202012Validator] = None
+        self.digest = digest
+        self.path = ""
+
+    def set_item_schema(self, schema: Optional[Dict[str, Any]]):
+        """Esquema JSON que debe cumplir cada item (se comprueba al leerlo)."""
+        self._validator = Draft202012Validator(schema) if schema else None
+
+    def _lines(self) -> Iterator[Tuple[int, bytes]]:
+        offset = self._offset
+        index = 0
+        pending = b""
+        while True:
+            # La posición del fichero es compartida: cada lectura fija la suya
+            with self._spool_lock:
+                self._spool.seek(offset)
+                chunk = self._spool.read(_READ_SIZE)
+            offset += len(chunk)
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop() if chunk else b""
+            for line in lines:
+                line = line.strip()
+                if line:
+                    index += 1
+                    yield index, line
+            if not chunk:
+                return
+
+    def __len__(self) -> int:
+        if self._count is None:
+            self._count = sum(1 for _ in self._lines())
+        return self._count
+
+    def __iter__(self) -> Iterator[Any]:
+        for index, line in self._lines():
+            try:
+                item = fast_json.loads(line)
+            except ValueError as ex:
+                raise ValueError(f"Item {index} de '{self.path}': JSON no válido ({ex})")
+            if self._validator is not None:
+                error = next(self._validator.iter_errors(item), None)
+                if error is not None:
+                    raise ValueError(f"Item {index} de '{self.path}': {error.message}")
+            yield item
+
+    def __str__(self) -> str:
+        # Para claves canónicas (single-flight, semilla del PDF determinista)
+        return f"<ndjson sha256:{self.digest}>"
+
+    def close(self):
+        self._spool.close()
+
+
+async def spool_ndjson(chunks: AsyncIterator[bytes]) -> Tuple[bytes, RowStream]:
+    """
+    Vuelca el cuerpo NDJSON a un fichero temporal.
+
+    Returns:
+        (primera línea: la petición en JSON, RowStream con el resto de líneas)
+    """
+    if SCRATCH_DIR:
+        os.makedirs(SCRATCH_DIR, exist_ok=True)
+    spool = tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_BYTES, prefix="gendoc-ndjson-", dir=SCRATCH_DIR)
+    digest = hashlib.sha256()
+    try:
+        async for chunk in chunks:
+            spool.write(chunk)
+            digest.update(chunk)
+        spool.seek(0)
+        header = spool.readline()
+        return header, RowStream(spool, spool.tell(), digest.hexdigest())
+    except BaseException:
+        spool.close()
+        raise
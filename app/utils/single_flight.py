@@ -0,0 +1,332 @@
+"""
+single_flight.py — deduplicación de renders idénticos en curso
+--------------------------------------------------------------
+Reintentos de sistemas batch y dobles envíos del front llegan como ráfagas de
+peticiones /api/render idénticas. Con SingleFlight solo la primera (el "líder")
+renderiza; las demás esperan su resultado:
+
+  - dentro de un worker: las peticiones con la misma clave esperan el Future del
+    líder (el render va al threadpool, así que el bucle de eventos sigue
+    aceptando peticiones mientras tanto);
+  - entre workers de uvicorn: el líder toma un flock sobre "<clave>.lock" en
+    GENDOC_SINGLEFLIGHT_DIR. Quien encuentra el lock ocupado deja una marca
+    "<clave>.waiting" y espera (sin ocupar turno de render); al terminar, el
+    líder ve la marca y deja el resultado para que lo lean los que esperaban:
+    los bytes (PDF, imágenes) en "<clave>.result" y su estructura en
+    "<clave>.result.json". No se usa pickle: el directorio es privado (0700,
+    del usuario del proceso) y, si no lo es, solo se deduplica en proceso.
+
+La clave incluye la versión de la plantilla y el payload completo, así que un
+resultado coalescido es el mismo que se habría renderizado. Los ficheros de
+más de _RESULT_TTL segundos se borran periódicamente.
+
+GENDOC_SINGLEFLIGHT=0 lo desactiva; GENDOC_SINGLEFLIGHT_DIR="" deja solo la
+deduplicación dentro del proceso (también en plataformas sin fcntl).
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import stat
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from starlette.concurrency import run_in_threadpool
+from . import fast_json, metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin coalescencia entre workers
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_ENABLED = os.getenv("GENDOC_SINGLEFLIGHT", "1").lower() not in ("0", "false", "no")
+SINGLEFLIGHT_DIR = os.getenv("GENDOC_SINGLEFLIGHT_DIR", os.path.join(tempfile.gettempdir(), "gendoc-singleflight"))
+# Espera máxima (s) al render de otro worker antes de renderizar por cuenta propia
+SINGLEFLIGHT_WAIT = float(os.getenv("GENDOC_SINGLEFLIGHT_WAIT", "60"))
+# Renders simultáneos por worker (1 = como antes, uno a uno; ahora fuera del bucle de eventos)
+RENDER_CONCURRENCY = max(1, int(os.getenv("GENDOC_RENDER_CONCURRENCY", "1")))
+
+_POLL_INTERVAL = 0.02
+# Antigüedad (s) a partir de la cual se borran resultados y marcas huérfanos
+_RESULT_TTL = 60.0
+
+
+def canonical_key(*parts: Any) -> str:
+    """Clave estable (sha256) de una operación: JSON con claves ordenadas."""
+    return hashlib.sha256(fast_json.dumps(parts, sort_keys=True)).hexdigest()
+
+
+class SingleFlight:
+    """
+    Ejecuta fn una sola vez por clave entre las peticiones concurrentes del
+    proceso y, con 'lock_dir', entre los workers de la máquina.
+    """
+
+    def __init__(self, lock_dir: Optional[str] = SINGLEFLIGHT_DIR, wait_timeout: float = SINGLEFLIGHT_WAIT, concurrency: int = RENDER_CONCURRENCY):
+        """
+        Args:
+            lock_dir: Directorio local compartido por los workers ("" o None = solo en proceso)
+            wait_timeout: Segundos máximos esperando el render de otro worker
+            concurrency: Renders simultáneos en este proceso
+        """
+        self.lock_dir = _private_dir(lock_dir) if lock_dir and fcntl is not None else None
+        self.wait_timeout = wait_timeout
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._slots = threading.Semaphore(concurrency)
+        self._last_sweep = 0.0
+
+    async def run(self, key: str, fn: Callable[[], Any], on_done: Optional[Callable[[], None]] = None) -> Any:
+        """
+        Devuelve fn() o, si ya hay un render en curso con la misma clave, su
+        resultado (o su excepción). fn se ejecuta en el threadpool.
+
+        on_done se llama cuando termina el render compartido, también si quien
+        esperaba se ha ido antes (liberar lo que fn pueda estar usando).
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            metrics.incr("single_flight.coalesced")
+        else:
+            metrics.incr("single_flight.leaders")
+            task = asyncio.ensure_future(run_in_threadpool(self._run_shared, key, fn))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        try:
+            # shield: si un cliente se va (también el líder), el render sigue para los demás
+            return await asyncio.shield(task)
+        finally:
+            if on_done is not None:
+                if task.done():
+                    on_done()
+                else:
+                    task.add_done_callback(lambda _: on_done())
+
+    def slot(self) -> threading.Semaphore:
+        """Turno de render del proceso (GENDOC_RENDER_CONCURRENCY) para renders fuera de run()."""
+        return self._slots
+
+    def _done(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        # Recuperar la excepción para que asyncio no avise si ya nadie esperaba
+        if not task.cancelled():
+            task.exception()
+
+    def _run_shared(self, key: str, fn: Callable[[], Any]) -> Any:
+        if not self.lock_dir:
+            with self._slots:
+                return fn()
+        return self._run_locked(key, fn)
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.lock_dir, key + suffix)
+
+    def _run_locked(self, key: str, fn: Callable[[], Any]) -> Any:
+        waiting_path = self._path(key, ".waiting")
+        lock_fd = os.open(self._path(key, ".lock"), os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            # La espera al render de otro worker no ocupa turno de render
+            waited_since = self._acquire(lock_fd, waiting_path)
+            try:
+                if waited_since is not None:
+                    result = self._read_result(key, waited_since)
+                    if result is not _MISSING:
+                        metrics.incr("single_flight.coalesced_workers")
+                        return result
+                with self._slots:
+                    result = fn()
+                # Solo se comparte el resultado si otro worker lo está esperando
+                if os.path.exists(waiting_path):
+                    self._write_result(key, result)
+                    _remove(waiting_path)
+                return result
+            finally:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+                self._sweep()
+        finally:
+            os.close(lock_fd)
+
+    def _acquire(self, lock_fd: int, waiting_path: str) -> Optional[float]:
+        """
+        Toma el flock. Devuelve None si estaba libre o el instante en que empezó
+        a esperar si lo tenía otro worker (hasta wait_timeout: luego se sigue sin él).
+        """
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.utime(lock_fd)  # que el barrido no lo borre mientras dura el render
+            return None
+        except BlockingIOError:
+            pass
+        started = time.time()
+        os.close(os.open(waiting_path, os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW, 0o600))
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            time.sleep(_POLL_INTERVAL)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return started
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    metrics.incr("single_flight.wait_timeouts")
+                    logger.warning("SingleFlight: el render de otro worker supera %.0fs; se renderiza aparte", self.wait_timeout)
+                    # Se sigue sin el lock (el LOCK_UN final no tiene efecto)
+                    return started
+
+    def _read_result(self, key: str, since: float) -> Any:
+        try:
+            with open(os.open(self._path(key, ".result.json"), os.O_RDONLY | os.O_NOFOLLOW), "rb") as f:
+                # Margen de 1s: el líder pudo escribirlo justo antes de que empezásemos a esperar
+                if os.fstat(f.fileno()).st_mtime < since - 1.0:
+                    return _MISSING
+                layout = fast_json.loads(f.read())
+            with open(os.open(self._path(key, ".result"), os.O_RDONLY | os.O_NOFOLLOW), "rb") as f:
+                blob = f.read()
+            if len(blob) != sum(layout["blobs"]) or layout["key"] != key:
+                return _MISSING
+            return _decode_result(layout["value"], _split(blob, layout["blobs"]))
+        except (OSError, ValueError, KeyError, TypeError):
+            return _MISSING
+
+    def _write_result(self, key: str, result: Any):
+        blobs: List[bytes] = []
+        try:
+            layout = {"key": key, "value": _encode_result(result, blobs), "blobs": [len(b) for b in blobs]}
+        except TypeError as ex:
+            logger.warning(f"SingleFlight: no se pudo compartir el resultado: {ex}")
+            return
+        try:
+            # Primero los bytes y después la estructura: quien lee empieza por la estructura
+            _write_atomic(self.lock_dir, self._path(key, ".result"), blobs)
+            _write_atomic(self.lock_dir, self._path(key, ".result.json"), [fast_json.dumps(layout)])
+        except OSError as ex:
+            logger.warning(f"SingleFlight: no se pudo compartir el resultado: {ex}")
+
+    def _sweep(self):
+        """Borra resultados y marcas de más de _RESULT_TTL segundos (como mucho una vez por TTL)."""
+        now = time.time()
+        if now - self._last_sweep < _RESULT_TTL:
+            return
+        self._last_sweep = now
+        try:
+            names = os.listdir(self.lock_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith((".result", ".result.json", ".waiting", ".lock", ".tmp")):
+                path = os.path.join(self.lock_dir, name)
+                try:
+                    if now - os.path.getmtime(path) > _RESULT_TTL:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+
+_MISSING = object()
+
+
+def _private_dir(path: str) -> Optional[str]:
+    """
+    Crea (0700) o comprueba el directorio compartido por los workers. Devuelve
+    None si no es un directorio del usuario del proceso: otro usuario podría
+    dejar ahí resultados falsos.
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    except OSError as ex:
+        logger.warning(f"SingleFlight: no se pudo crear {path} ({ex}); deduplicación solo dentro del worker")
+        return None
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        logger.warning(f"SingleFlight: {path} no es un directorio propio; deduplicación solo dentro del worker")
+        return None
+    if st.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+def _write_atomic(directory: str, path: str, parts: List[bytes]):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for part in parts:
+                f.write(part)
+        os.replace(tmp_path, path)
+    except OSError:
+        _remove(tmp_path)
+        raise
+
+
+def _encode_result(value: Any, blobs: List[bytes]) -> Any:
+    """
+    Estructura JSON de un resultado de render; los bytes van aparte (en 'blobs')
+    y se referencian por posición. Solo tipos simples: lo demás no se comparte.
+    """
+    if isinstance(value, bytes):
+        blobs.append(value)
+        return {"b": len(blobs) - 1}
+    if isinstance(value, tuple):
+        return {"t": [_encode_result(v, blobs) for v in value]}
+    if isinstance(value, list):
+        return {"l": [_encode_result(v, blobs) for v in value]}
+    if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        return {"d": {k: _encode_result(v, blobs) for k, v in value.items()}}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"tipo no compartible: {type(value).__name__}")
+
+
+def _decode_result(value: Any, blobs: List[bytes]) -> Any:
+    if not isinstance(value, dict):
+        return value
+    if "b" in value:
+        return blobs[value["b"]]
+    if "t" in value:
+        return tuple(_decode_result(v, blobs) for v in value["t"])
+    if "l" in value:
+        return [_decode_result(v, blobs) for v in value["l"]]
+    return {k: _decode_result(v, blobs) for k, v in value["d"].items()}
+
+
+def _split(blob: bytes, sizes: List[int]) -> List[bytes]:
+    parts, offset = [], 0
+    for size in sizes:
+        parts.append(blob[offset:offset + size])
+        offset += size
+    return parts
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# Instancia global
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Obtiene la instancia global (se crea al primer uso)."""
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
+
+
+async def coalesce(key: str, fn: Callable[[], Any], on_done: Optional[Callable[[], None]] = None) -> Any:
+    """Ejecuta fn deduplicando por 'key' (desactivado: en línea, como antes). Ver SingleFlight.run."""
+    if not SINGLEFLIGHT_ENABLED:
+        try:
+            return fn()
+        finally:
+            if on_done is not None:
+                on_done()
+    return await get_single_flight().run(key, fn, on_done)
@@ -3,6 +3,20 @@ import shutil
 import subprocess
 import tempfile
 
+# Directorio para ficheros temporales que necesita LibreOffice (p. ej. un tmpfs).
+# Si no se define, se usa el directorio temporal del sistema.
+SCRATCH_DIR = os.getenv("GENDOC_SCRATCH_DIR") or None
+
+
+def scratch_tempdir() -> tempfile.TemporaryDirectory:
+    """
+    Directorio temporal para los pasos que requieren una ruta en disco
+    (entrada/salida de soffice). El resto del pipeline trabaja en memoria.
+    """
+    if SCRATCH_DIR:
+        os.makedirs(SCRATCH_DIR, exist_ok=True)
+    return tempfile.TemporaryDirectory(prefix="gendoc-", dir=SCRATCH_DIR)
+
 
 def _find_soffice() -> str:
     for name in ["soffice", "/usr/bin/soffice", "/usr/local/bin/soffice"]:
@@ -15,22 +29,16 @@ def convert_to_pdf(input_path: str, output_path: str):
     soffice = _find_soffice()
     outdir = os.path.dirname(output_path)
     os.makedirs(outdir, exist_ok=True)
-    with tempfile.TemporaryDirectory() as tmp:
-        cmd = [
-            soffice,
-            "--headless",
-            "--norestore",
-            "--nolockcheck",
-            "--nodefault",
-            "--convert-to",
-            "pdf",
-            "--outdir",
-            tmp,
-            input_path,
-        ]
-        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    base = os.path.splitext(os.path.basename(input_path))[0]
+    if os.path.join(outdir, base + ".pdf") == output_path and not os.path.exists(output_path):
+        # soffice ya genera el nombre esperado: sin directorio intermedio ni move
+        _run_convert(soffice, outdir, input_path)
+        if not os.path.isfile(output_path):
+            raise RuntimeError("No se pudo convertir a PDF")
+        return
+    with scratch_tempdir() as tmp:
+        _run_convert(soffice, tmp, input_path)
         # Move resulting pdf (same basename but .pdf) to desired output
-        base = os.path.splitext(os.path.basename(input_path))[0]
         produced = os.path.join(tmp, base + ".pdf")
         if not os.path.isfile(produced):
             # Try to find any PDF in tmp
@@ -42,6 +50,22 @@ def convert_to_pdf(input_path: str, output_path: str):
         shutil.move(produced, output_path)
 
 
+def _run_convert(soffice: str, outdir: str, input_path: str):
+    cmd = [
+        soffice,
+        "--headless",
+        "--norestore",
+        "--nolockcheck",
+        "--nodefault",
+        "--convert-to",
+        "pdf",
+        "--outdir",
+        outdir,
+        input_path,
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
 def convert_pdf_to_image(pdf_path: str, output_path: str) -> bool:
     """
     Convierte un PDF a imagen PNG usando LibreOffice.
@@ -58,7 +82,7 @@ def convert_pdf_to_image(pdf_path: str, output_path: str) -> bool:
         outdir = os.path.dirname(output_path)
         os.makedirs(outdir, exist_ok=True)
         
-        with tempfile.TemporaryDirectory() as tmp:
+        with scratch_tempdir() as tmp:
             # LibreOffice puede convertir PDF a imagen usando el formato PNG
             cmd = [
                 soffice,
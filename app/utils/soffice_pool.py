@@ -1,11 +1,11 @@
 import os
 import shutil
 import subprocess
-import tempfile
 import asyncio
 from concurrent.futures import ProcessPoolExecutor
 from typing import Optional
 import logging
+from .soffice import scratch_tempdir
 
 logger = logging.getLogger(__name__)
 
@@ -50,7 +50,7 @@ class SofficePool:
             outdir = os.path.dirname(output_path)
             os.makedirs(outdir, exist_ok=True)
             
-            with tempfile.TemporaryDirectory() as tmp:
+            with scratch_tempdir() as tmp:
                 cmd = [
                     self._soffice_path,
                     "--headless",
@@ -0,0 +1,79 @@
+"""
+spool_pipe.py — productor/consumidor sobre un SpooledTemporaryFile
+------------------------------------------------------------------
+El render de un PDF por partes (ver pdf_stream) escribe aquí y la respuesta
+HTTP lee a su ritmo. El render no espera al cliente: ocupa su turno de render
+solo lo que tarda en dibujar, aunque el cliente descargue despacio. Lo pendiente
+de enviar se guarda en memoria hasta GENDOC_STREAM_SPOOL_MB y después en disco.
+"""
+
+import tempfile
+import threading
+from typing import Iterator, Optional
+from .row_stream import STREAM_SPOOL_BYTES
+from .soffice import SCRATCH_DIR
+
+_READ_SIZE = 64 * 1024
+
+
+class SpoolPipe:
+    """Tubería de bytes entre un hilo que escribe y uno que lee desde el principio."""
+
+    def __init__(self, max_size: int = STREAM_SPOOL_BYTES):
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_size, prefix="gendoc-pdf-", dir=SCRATCH_DIR)
+        self._cond = threading.Condition()
+        self._size = 0
+        self._done = False
+        self._closed = False
+        self._error: Optional[BaseException] = None
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def write(self, data: bytes):
+        """Añade 'data'. Lanza ValueError si el lector ya ha cerrado la tubería."""
+        with self._cond:
+            if self._closed:
+                raise ValueError("La respuesta se ha cerrado")
+            self._file.seek(self._size)
+            self._file.write(data)
+            self._size += len(data)
+            self._cond.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None):
+        """Fin de la escritura; con 'error', el lector lo recibe tras leer lo ya escrito."""
+        with self._cond:
+            self._done = True
+            self._error = error
+            self._cond.notify_all()
+
+    def read(self, offset: int, size: int = _READ_SIZE) -> bytes:
+        """
+        Hasta 'size' bytes a partir de 'offset'; espera si aún no están escritos.
+        Devuelve b"" al final y lanza el error del productor si terminó con error.
+        """
+        with self._cond:
+            while self._size <= offset and not self._done:
+                self._cond.wait()
+            if self._size > offset:
+                self._file.seek(offset)
+                return self._file.read(min(size, self._size - offset))
+            if self._error is not None:
+                raise self._error
+            return b""
+
+    def chunks(self, offset: int = 0) -> Iterator[bytes]:
+        """Trozos desde 'offset' hasta el final (bloquea mientras el productor escribe)."""
+        while True:
+            data = self.read(offset)
+            if not data:
+                return
+            offset += len(data)
+            yield data
+
+    def close(self):
+        """Libera el fichero; el productor recibe ValueError en su siguiente write()."""
+        with self._cond:
+            self._closed = True
+            self._file.close()
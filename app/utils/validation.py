@@ -1,6 +1,45 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, Optional, Tuple
 from jsonschema import validate, Draft202012Validator
 from jsonschema.exceptions import ValidationError
+from .row_stream import RowStream
+
+
+def _row_streams(payload: Dict[str, Any], prefix: Tuple[str, ...] = ()) -> Iterator[Tuple[Tuple[str, ...], RowStream]]:
+    for key, value in payload.items():
+        if isinstance(value, RowStream):
+            yield prefix + (key,), value
+        elif isinstance(value, dict):
+            yield from _row_streams(value, prefix + (key,))
+
+
+# Restricciones sobre el array completo: un array NDJSON no se tiene entero en
+# memoria, así que se quitan del esquema y los items se validan al leerlos
+_ARRAY_KEYWORDS = ("items", "prefixItems", "contains", "minContains", "maxContains", "uniqueItems", "unevaluatedItems", "minItems", "maxItems")
+
+
+def _array_schema(schema: Dict[str, Any], path: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    """Subesquema del array en 'path' (solo properties anidados)."""
+    cur: Any = schema
+    for part in path:
+        cur = cur.get("properties", {}).get(part) if isinstance(cur, dict) else None
+    return cur if isinstance(cur, dict) else None
+
+
+def _without_array_keywords(schema: Dict[str, Any], path: Tuple[str, ...]) -> Dict[str, Any]:
+    """Copia de 'schema' sin las restricciones de array (_ARRAY_KEYWORDS) del array en 'path'."""
+    if not path:
+        return {key: value for key, value in schema.items() if key not in _ARRAY_KEYWORDS}
+    properties = schema.get("properties")
+    if not isinstance(properties, dict) or not isinstance(properties.get(path[0]), dict):
+        return schema
+    return {**schema, "properties": {**properties, path[0]: _without_array_keywords(properties[path[0]], path[1:])}}
+
+
+def _without_streams(payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        key: [] if isinstance(value, RowStream) else _without_streams(value) if isinstance(value, dict) else value
+        for key, value in payload.items()
+    }
 
 
 def validate_payload(payload: Dict[str, Any], schema: Optional[Dict[str, Any]]):
@@ -8,4 +47,19 @@ def validate_payload(payload: Dict[str, Any], schema: Optional[Dict[str, Any]]):
         return
     # Will raise ValidationError if invalid
     Draft202012Validator.check_schema(schema)
-    validate(instance=payload, schema=schema)
\ No newline at end of file
+    streams = list(_row_streams(payload))
+    if streams:
+        # Arrays NDJSON: el resto del payload se valida ahora y cada item al leerlo;
+        # minItems/maxItems se comprueban con el número de líneas (sin parsearlas)
+        for path, stream in streams:
+            array_schema = _array_schema(schema, path) or {}
+            items = array_schema.get("items")
+            stream.set_item_schema(items if isinstance(items, dict) else None)
+            name = ".".join(path)
+            if "minItems" in array_schema and len(stream) < array_schema["minItems"]:
+                raise ValidationError(f"'{name}' debe tener al menos {array_schema['minItems']} items")
+            if "maxItems" in array_schema and len(stream) > array_schema["maxItems"]:
+                raise ValidationError(f"'{name}' admite como máximo {array_schema['maxItems']} items")
+            schema = _without_array_keywords(schema, path)
+        payload = _without_streams(payload)
+    validate(instance=payload, schema=schema)
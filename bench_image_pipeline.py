@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark del pipeline de imagen (bitmap de pdfium -> codificador WebP).
+
+Compara el recorrido anterior (PIL -> PNG -> optimize_image_bytes con copia de
+píxeles vía list(getdata()) -> Image.open para medir -> Image.open en la API)
+con el actual (rasterize_page -> optimize_image con dimensiones devueltas).
+Cada variante corre en un subproceso propio para medir el pico de RSS sobre la
+línea base tras rasterizar. No necesita el servidor.
+"""
+
+import sys
+import os
+import io
+import time
+import resource
+import subprocess
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+RUNS = 5
+SCALE = 2.0
+
+
+def _sample_pdf() -> bytes:
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.colors import HexColor
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=(595.32, 841.92))
+    c.setFillColor(HexColor("#dde6f0"))
+    c.rect(40, 640, 515, 160, fill=1, stroke=0)
+    c.setFillColor(HexColor("#111111"))
+    for i in range(60):
+        c.setFont("Helvetica", 9)
+        c.drawString(50, 620 - i * 10, f"Línea {i}: texto de ejemplo para el documento generado, importe {i * 37.5:.2f} EUR")
+    c.save()
+    return buf.getvalue()
+
+
+def _legacy(pil_image):
+    from PIL import Image, ImageOps
+    from app.utils.image_optimizer import _maybe_downscale, save_with_target_filesize
+    img_buffer = io.BytesIO()
+    pil_image.save(img_buffer, format="PNG")
+    with Image.open(io.BytesIO(img_buffer.getvalue())) as im:
+        im = ImageOps.exif_transpose(im)
+        data = list(im.getdata())
+        new = Image.new(im.mode, im.size)
+        new.putdata(data)
+        im = _maybe_downscale(new, 1600, 1600)
+        out = save_with_target_filesize(im, target_kb=259, fmt="webp", extra_kwargs={"method": 6})
+    size = Image.open(io.BytesIO(out)).size
+    size = Image.open(io.BytesIO(out)).size
+    return out, size
+
+
+def _current(pil_image):
+    from app.utils.image_optimizer import optimize_image
+    out, w, h = optimize_image(pil_image, target_kb=259, format_hint="webp", max_width=1600, max_height=1600)
+    return out, (w, h)
+
+
+def _child(variant: str):
+    import pypdfium2 as pdfium
+    from app.utils.raster_canvas import rasterize_page
+    pdf = _sample_pdf()
+    if variant == "anterior":
+        def rasterize():
+            return pdfium.PdfDocument(pdf)[0].render(scale=SCALE).to_pil()
+        encode = _legacy
+    else:
+        def rasterize():
+            return rasterize_page(pdf, 0, SCALE)
+        encode = _current
+    from PIL import Image
+    encode(Image.new("RGB", (64, 64), "white"))  # calentamiento (carga de codecs) sin tocar el pico
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    for _ in range(RUNS):
+        out, size = encode(rasterize())
+    elapsed = (time.perf_counter() - t0) / RUNS
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{elapsed:.4f} {(peak_kb - base_kb) / 1024:.1f} {len(out)} {size[0]}x{size[1]}")
+
+
+def main():
+    print("🔄 Benchmark del pipeline de imagen (pdfium -> WebP)")
+    print("=" * 60)
+    for variant in ("anterior", "actual"):
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", variant],
+            capture_output=True, text=True, check=True,
+        )
+        elapsed, rss_mb, size, dims = result.stdout.split()[-4:]
+        print(f"📊 {variant:<9} | {float(elapsed) * 1000:8.1f} ms/imagen | pico RSS +{float(rss_mb):6.1f} MB | {int(size) / 1024:6.1f} KB {dims}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        _child(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la capa JSON de /api/render.
+
+Compara el camino por defecto de FastAPI (json.loads del cuerpo, validación
+pydantic de todo el RenderRequest incluido 'data', jsonable_encoder + json.dumps
+de la respuesta) con el actual (fast_json.loads, validación solo de las
+opciones y FastJSONResponse, que serializa directamente a bytes) para payloads
+de 1 y 5 MB con arrays de items grandes y una respuesta con imagen en base64.
+No necesita el servidor.
+"""
+
+import sys
+import os
+import json
+import base64
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.encoders import jsonable_encoder
+from app.routes.api import RenderRequest
+from app.utils import fast_json
+from app.utils.fast_json import FastJSONResponse
+
+RUNS = 10
+
+
+def _payload(target_mb: float) -> bytes:
+    item = {"desc": "Artículo de ejemplo con descripción larga", "qty": 3, "price": 12.5, "ref": "REF-000000", "tags": ["a", "b", "c"]}
+    count = int(target_mb * 1024 * 1024 / len(json.dumps(item)))
+    data = {"nombre": "Ana", "curso": "Matemáticas", "items": [{**item, "ref": f"REF-{i:06d}"} for i in range(count)]}
+    return json.dumps({"template_id": "tpl", "data": data, "output_format": "image", "image_format": "webp"}).encode()
+
+
+def _response() -> dict:
+    return {
+        "image_base64": base64.b64encode(os.urandom(1200 * 1024)).decode("ascii"),
+        "image_info": {"format": "webp", "mime_type": "image/webp", "width": 1132, "height": 1600},
+        "signatures": {f"firma_{i}": {"x": 100 + i, "y": 200, "width": 150, "height": 50} for i in range(20)},
+    }
+
+
+def _legacy(body: bytes, response: dict) -> bytes:
+    req = RenderRequest.model_validate(json.loads(body))
+    assert req.data
+    return json.dumps(jsonable_encoder(response), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def _current(body: bytes, response: dict) -> bytes:
+    payload = fast_json.loads(body)
+    data = payload.pop("data")
+    req = RenderRequest.model_validate({**payload, "data": {}})
+    req.data = data
+    return FastJSONResponse(response).body
+
+
+def _time(fn, *args) -> float:
+    fn(*args)
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        fn(*args)
+    return (time.perf_counter() - start) / RUNS * 1000
+
+
+def main():
+    print(f"🧪 Capa JSON de /api/render (orjson: {'sí' if fast_json.orjson is not None else 'no'}), {RUNS} repeticiones")
+    response = _response()
+    for mb in (1, 5):
+        body = _payload(mb)
+        legacy_ms = _time(_legacy, body, response)
+        current_ms = _time(_current, body, response)
+        print(f"📊 Payload {len(body) / 1024 / 1024:.1f}MB + respuesta con imagen de 1.2MB: "
+              f"anterior {legacy_ms:.1f}ms, actual {current_ms:.1f}ms ({legacy_ms / current_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los backends de fusión overlay + plantilla (GENDOC_MERGE_BACKEND).
+
+Genera una plantilla base de una página y un overlay de 10, 100 y 1000 páginas
+con reportlab, y mide para cada backend (pypdf, xobject, pdfium) el tiempo de
+fusión y el tamaño del PDF resultante. No necesita el servidor.
+"""
+
+import sys
+import os
+import io
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from reportlab.pdfgen import canvas
+from app.utils.pdf_merge import MERGE_BACKENDS, merge_overlay
+
+WIDTH, HEIGHT = 595.32, 841.92
+
+
+def _base_pdf() -> bytes:
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=(WIDTH, HEIGHT))
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(40, 800, "PLANTILLA BASE")
+    for i in range(60):
+        c.line(40, 760 - i * 12, WIDTH - 40, 760 - i * 12)
+        c.setFont("Helvetica", 7)
+        c.drawString(42, 762 - i * 12, f"Texto fijo de la plantilla, línea {i}")
+    c.save()
+    return buf.getvalue()
+
+
+def _overlay_pdf(pages: int) -> bytes:
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=(WIDTH, HEIGHT))
+    for p in range(pages):
+        if p:
+            c.showPage()
+        c.setFont("Helvetica", 9)
+        for r in range(50):
+            c.drawString(60, 750 - r * 12, f"Página {p + 1} fila {r} valor {p * 50 + r}")
+    c.save()
+    return buf.getvalue()
+
+
+def main():
+    print("🔄 Benchmark de backends de fusión overlay")
+    print("=" * 60)
+    base = _base_pdf()
+    for pages in (10, 100, 1000):
+        overlay = _overlay_pdf(pages)
+        for backend in MERGE_BACKENDS:
+            t0 = time.perf_counter()
+            try:
+                out = merge_overlay(base, overlay, pages, backend=backend)
+            except ImportError as e:
+                print(f"⚠️  {backend}: no disponible ({e})")
+                continue
+            elapsed = time.perf_counter() - t0
+            print(f"📊 {pages:>5} páginas | {backend:<8} | {elapsed:7.3f}s | {len(out) / 1024:9.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark del motor de filas repetidas (_repeat_rows) de las plantillas overlay.
+
+Mide el tiempo y el pico de memoria de dibujar la capa overlay para 1k, 10k y
+100k items, comparando el motor actual (RepeatRowLayout) con el recorrido
+anterior (startswith sobre todas las posiciones + get_path por celda).
+No necesita el servidor ni plantillas en storage/.
+"""
+
+import sys
+import os
+import io
+import time
+import tracemalloc
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.colors import HexColor
+from app.services.repeat_rows import RepeatRowLayout
+
+WIDTH, HEIGHT = 595.32, 841.92
+ARR_DEF = {"startY": 700, "deltaY": 14, "endY": 80}
+STYLES = {}
+DEFAULT_STYLE = {"font": "Helvetica", "size": 9, "color": "#111111"}
+# 6 columnas de la tabla + 20 campos fijos que el recorrido anterior también escaneaba
+POSITIONS = {f"items.col{i}": (40 + i * 90, 700) for i in range(6)}
+POSITIONS.update({f"campo{i}": (40, 780 - i * 10) for i in range(20)})
+
+
+def _items(n):
+    return [{f"col{i}": f"valor {r}-{i}" for i in range(6)} for r in range(n)]
+
+
+def _legacy(items):
+    def get_path(d, path):
+        cur = d
+        for part in path.split('.'):
+            cur = cur.get(part) if isinstance(cur, dict) else None
+            if cur is None:
+                break
+        return cur
+
+    rows_per_page = max(1, int((ARR_DEF["startY"] - ARR_DEF["endY"]) / ARR_DEF["deltaY"]) + 1)
+    total_pages = max(1, -(-len(items) // rows_per_page))
+    c = canvas.Canvas(io.BytesIO(), pagesize=(WIDTH, HEIGHT))
+    for page_idx in range(total_pages):
+        for _ in range(2):  # el bucle de debug repetía el recorrido completo
+            start_idx = page_idx * rows_per_page
+            end_idx = min(len(items), start_idx + rows_per_page)
+            for idx in range(start_idx, end_idx):
+                y_item = ARR_DEF["startY"] - (idx - start_idx) * ARR_DEF["deltaY"]
+                for key, (x, _) in POSITIONS.items():
+                    if key.startswith("items."):
+                        val = get_path(items[idx], key[len("items."):])
+                        c.setFont("Helvetica", 9)
+                        c.setFillColor(HexColor("#111111"))
+                        c.drawString(x, y_item, str(val))
+        c.showPage()
+    c.save()
+
+
+def _engine(items):
+    layout = RepeatRowLayout("items", ARR_DEF, POSITIONS, STYLES, DEFAULT_STYLE)
+    c = canvas.Canvas(io.BytesIO(), pagesize=(WIDTH, HEIGHT))
+    for page_idx, page_items in enumerate(layout.paginate(iter(items))):
+        if page_idx:
+            c.showPage()
+        layout.draw_page(c, page_items)
+    c.save()
+
+
+def _measure(fn, items):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn(items)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / (1024 * 1024)
+
+
+def main():
+    print("🔄 Benchmark de filas repetidas (overlay)")
+    print("=" * 60)
+    for n in (1_000, 10_000, 100_000):
+        items = _items(n)
+        legacy_t, legacy_mb = _measure(_legacy, items)
+        engine_t, engine_mb = _measure(_engine, items)
+        print(f"📊 {n:>7} filas | anterior: {legacy_t:6.2f}s {legacy_mb:7.1f}MB | motor: {engine_t:6.2f}s {engine_mb:7.1f}MB | x{legacy_t / engine_t:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark del PDF por partes ("stream": true) frente al render completo.
+
+Crea una plantilla overlay temporal con _repeat_rows y, para 1k, 10k y 20k
+items, mide el tiempo hasta el primer trozo, el tiempo total y el pico de
+memoria (tracemalloc, en una pasada aparte) de render_to_pdf (PDF entero en
+memoria, backend de fusión por defecto) y de render_to_pdf_chunks (los trozos
+se descartan según llegan, como al enviarlos). No necesita el servidor.
+"""
+
+import sys
+import os
+import io
+import time
+import tempfile
+import tracemalloc
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import UploadFile
+from reportlab.pdfgen import canvas
+from app.services.template_store import TemplateStore
+from app.services.renderer import Renderer
+
+WIDTH, HEIGHT = 595.32, 841.92
+COLUMNS = 6
+
+
+def _base_pdf() -> bytes:
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=(WIDTH, HEIGHT))
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(40, 800, "PLANTILLA BASE")
+    for i in range(60):
+        c.line(40, 760 - i * 12, WIDTH - 40, 760 - i * 12)
+    c.save()
+    return buf.getvalue()
+
+
+def _template(store: TemplateStore) -> str:
+    template_id = store.save_template(UploadFile(file=io.BytesIO(_base_pdf()), filename="base.pdf"))
+    positions = {"nombre": [40, 780]}
+    positions.update({f"items.col{i}": [40 + i * 90, 700] for i in range(COLUMNS)})
+    store.save_mapping(template_id, {
+        "_preview_scale": 1,
+        "_positions": positions,
+        "_header_positions": {"_page_number": [520, 810], "_page_count": [550, 810]},
+        "_repeat_rows": {"items": {"startY": 700, "deltaY": 14, "endY": 80}},
+    })
+    return template_id
+
+
+def _data(n: int) -> dict:
+    return {"nombre": "Ana", "items": [{f"col{i}": f"valor {r}-{i}" for i in range(COLUMNS)} for r in range(n)]}
+
+
+def _measure(chunks_fn):
+    """(1er trozo s, total s, pico MB, tamaño): tiempos sin tracemalloc y pico en otra pasada."""
+    t0 = time.perf_counter()
+    first = None
+    size = 0
+    for chunk in chunks_fn():
+        if first is None:
+            first = time.perf_counter() - t0
+        size += len(chunk)
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    for chunk in chunks_fn():
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first, elapsed, peak / (1024 * 1024), size
+
+
+def main():
+    print("🔄 Benchmark de PDF por partes")
+    print("=" * 60)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TemplateStore(tmp)
+        renderer = Renderer(store)
+        template_id = _template(store)
+        for n in (1_000, 10_000, 20_000):
+            data = _data(n)
+            full = _measure(lambda: [renderer.render_to_pdf(template_id, data)])
+            stream = _measure(lambda: renderer.render_to_pdf_chunks(template_id, data))
+            print(f"📊 {n:>6} filas | completo: 1er byte {full[0]:6.2f}s total {full[1]:6.2f}s {full[2]:7.1f}MB {full[3] / 1e6:5.1f}MB PDF"
+                  f" | por partes: 1er byte {stream[0]:5.2f}s total {stream[1]:6.2f}s {stream[2]:6.1f}MB {stream[3] / 1e6:5.1f}MB PDF")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Script para probar las imágenes en binario: el almacén de assets reutilizables
+(AssetStore) y la resolución de "asset:<id>" en la caché de imágenes
+decodificadas, tanto de assets guardados como de imágenes subidas con la
+petición. No necesita el servidor.
+"""
+
+import sys
+import os
+import io
+import base64
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+from app.services.asset_store import AssetStore
+from app.utils import image_cache
+from app.utils.image_cache import content_key, get_image_reader, pinned_images, set_asset_loader
+
+
+def _png(color=(200, 0, 0), size=(12, 4)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def test_asset_store():
+    """El id es el hash del contenido: la misma imagen da el mismo id; lo que no es imagen se rechaza."""
+    with tempfile.TemporaryDirectory() as tmp:
+        assets = AssetStore(tmp)
+        png = _png()
+        saved = assets.save_asset(png)
+        assert saved["asset_id"] == content_key(png) and saved["ref"] == "asset:" + saved["asset_id"]
+        assert (saved["format"], saved["width"], saved["height"]) == ("png", 12, 4)
+        assert assets.save_asset(png)["asset_id"] == saved["asset_id"]
+        assert assets.get_asset(saved["asset_id"]) == png
+        assert assets.get_asset("../meta.json") is None
+        try:
+            assets.save_asset(b"no es una imagen")
+            assert False, "Debe rechazar lo que no es imagen"
+        except ValueError:
+            pass
+        assert assets.delete_asset(saved["asset_id"]) and not assets.has_asset(saved["asset_id"])
+    print("✅ AssetStore guarda, deduplica y valida")
+
+
+def test_asset_ref():
+    """"asset:<id>" se resuelve con el almacén y la imagen decodificada se reutiliza."""
+    with tempfile.TemporaryDirectory() as tmp:
+        assets = AssetStore(tmp)
+        png = _png((0, 120, 0))
+        ref = assets.save_asset(png)["ref"]
+        loads = []
+        set_asset_loader(lambda asset_id: loads.append(asset_id) or assets.get_asset(asset_id))
+        try:
+            key, reader = get_image_reader(ref)
+            assert reader.getSize() == (12, 4)
+            assert get_image_reader(ref)[1] is reader
+            assert len(loads) == 1
+            assert get_image_reader("asset:" + "0" * 40) is None
+        finally:
+            set_asset_loader(None)
+        # Misma imagen que la data URL equivalente
+        data_url = "data:image/png;base64," + base64.b64encode(png).decode()
+        assert get_image_reader(data_url)[1].getRGBData() == reader.getRGBData()
+    print("✅ asset:<id> se resuelve y se cachea")
+
+
+def test_pinned_images():
+    """Las imágenes subidas se resuelven mientras dura la petición y se sueltan al terminar."""
+    png = _png((0, 0, 200), size=(5, 5))
+    key = content_key(png)
+    with pinned_images({key: png}):
+        with pinned_images({key: png}):
+            assert get_image_reader("asset:" + key)[1].getSize() == (5, 5)
+        assert key in image_cache._pinned
+    assert key not in image_cache._pinned
+    print("✅ Imágenes subidas retenidas durante la petición")
+
+
+if __name__ == "__main__":
+    print("🧪 Probando imágenes en binario y assets")
+    test_asset_store()
+    test_asset_ref()
+    test_pinned_images()
+    print("🎉 Pruebas completadas")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Script para probar el modo de PDF determinista: fechas e identificadores
+normalizados (LibreOffice/pdfium) y mismos bytes para mismos datos. No necesita el servidor.
+"""
+
+import sys
+import os
+import io
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from pypdf import PdfReader, PdfWriter
+from app.utils.pdf_normalize import normalize_pdf
+
+XMP = """<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+<rdf:Description rdf:about="" xmlns:xmp="http://ns.adobe.com/xap/1.0/" xmlns:xmpMM="http://ns.adobe.com/xap/1.0/mm/">
+<xmp:CreateDate>{date}</xmp:CreateDate>
+<xmpMM:DocumentID>uuid:{uuid}</xmpMM:DocumentID>
+</rdf:Description></rdf:RDF></x:xmpmeta>
+<?xpacket end="w"?>"""
+
+
+def _office_like_pdf(now: float) -> bytes:
+    """PDF escrito a mano con las partes variables que escribe LibreOffice: fechas, /ID y XMP."""
+    import uuid
+    stamp = time.strftime("D:%Y%m%d%H%M%S+02'00'", time.localtime(now))
+    xmp = XMP.format(date=time.strftime("%Y-%m-%dT%H:%M:%S+02:00", time.localtime(now)), uuid=uuid.uuid4())
+    objects = [
+        "<</Type/Catalog/Pages 2 0 R/Metadata 5 0 R>>",
+        "<</Type/Pages/Count 1/Kids[3 0 R]>>",
+        "<</Type/Page/Parent 2 0 R/MediaBox[0 0 595 842]/Resources<<>>>>",
+        f"<</Creator(Writer)/Producer(LibreOffice 7.6)/CreationDate({stamp})>>",
+        f"<</Type/Metadata/Subtype/XML/Length {len(xmp)}>>\nstream\n{xmp}\nendstream",
+    ]
+    out = b"%PDF-1.6\n"
+    offsets = []
+    for num, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{num} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    ids = f"<{os.urandom(16).hex().upper()}><{os.urandom(16).hex().upper()}>"
+    out += f"trailer\n<</Size {len(objects) + 1}/Root 1 0 R/Info 4 0 R/ID[{ids}]>>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
+def test_normalizacion():
+    """Dos PDFs generados en momentos distintos -> mismos bytes tras normalizar, y siguen siendo válidos."""
+    a, b = _office_like_pdf(time.time() - 3600), _office_like_pdf(time.time())
+    assert a != b
+    seed = b"version-1|payload-hash"
+    na, nb = normalize_pdf(a, seed, 1700000000.0), normalize_pdf(b, seed, 1700000000.0)
+    assert na == nb and len(na) == len(a)
+    reader = PdfReader(io.BytesIO(na))
+    assert reader.metadata["/CreationDate"] == "D:20231114221320+00'00'"
+    assert reader.trailer["/ID"][0] != reader.trailer["/ID"][1]
+    assert b"2023-11-14T22:13:20+00:00" in na
+    # Otra semilla (otros datos) -> otro /ID
+    assert normalize_pdf(a, b"otra", 1700000000.0) != na
+    print("✅ Fechas, /ID y XMP normalizados sin cambiar la longitud")
+
+
+def test_render_overlay_estable():
+    """Render overlay sencillo: los mismos datos dan los mismos bytes aunque pase el tiempo."""
+    from reportlab.pdfgen import canvas
+    from app.utils.pdf_merge import merge_overlay
+
+    def overlay() -> bytes:
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf, pagesize=(595, 842), invariant=1)
+        c.drawString(100, 700, "Hola")
+        c.save()
+        return buf.getvalue()
+
+    base = io.BytesIO()
+    writer = PdfWriter()
+    writer.add_blank_page(595, 842)
+    writer.write(base)
+    first = merge_overlay(base.getvalue(), overlay(), 1, backend="pypdf")
+    time.sleep(1.1)
+    assert merge_overlay(base.getvalue(), overlay(), 1, backend="pypdf") == first
+    print("✅ Overlay estable byte a byte")
+
+
+if __name__ == "__main__":
+    print("🧪 Probando PDF determinista")
+    test_normalizacion()
+    test_render_overlay_estable()
+    print("🎉 Pruebas completadas")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Script para probar el clasificador de páginas de documento del optimizador de
+imágenes (1-bit / paleta sin pérdida sin búsqueda de calidad). No necesita el servidor.
+"""
+
+import sys
+import os
+import time
+from io import BytesIO
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image, ImageDraw
+from app.utils import image_optimizer, metrics
+
+
+def _page(color: bool) -> Image.Image:
+    img = Image.new("RGB", (1190, 1684), "white")
+    draw = ImageDraw.Draw(img)
+    # Texto sin antialiasing: la página es blanco y negro puro
+    draw.fontmode = "1"
+    if color:
+        draw.rectangle([0, 0, 300, 90], fill=(204, 32, 32))
+    draw.line([0, 150, 1190, 150], fill=(17, 17, 17), width=3)
+    for i in range(60):
+        draw.text((60, 200 + i * 24), f"Item {i} pedido {i * 7919 % 1000} importe {i * 12.5:.2f} EUR", fill=(0, 0, 0))
+    return img
+
+
+def test_clasificacion():
+    """Texto negro sobre blanco -> 1-bit (con antialiasing, paleta); con un logo de color -> paleta; degradado -> None."""
+    kind, _ = image_optimizer.classify_document(_page(False))
+    assert kind == "1"
+    antialiased = _page(False)
+    ImageDraw.Draw(antialiased).text((60, 1600), "Texto con antialiasing", fill=(0, 0, 0))
+    assert image_optimizer.classify_document(antialiased)[0] == "P"
+    kind, palette = image_optimizer.classify_document(_page(True))
+    assert kind == "P" and (255, 255, 255) in palette and len(palette) <= image_optimizer.DOC_PALETTE_COLORS
+    gradient = Image.linear_gradient("L").resize((600, 600)).convert("RGB")
+    assert image_optimizer.classify_document(gradient) is None
+    noise = Image.effect_noise((600, 600), 40).convert("RGB")
+    assert image_optimizer.classify_document(noise) is None
+    print("✅ Clasificación: 1-bit, paleta y fotos/degradados descartados")
+
+
+def test_relleno_gris():
+    """Un recuadro gris claro u oscuro con líneas negras no es 1-bit: el gris se conserva."""
+    for gray in (225, 90):
+        img = Image.new("RGB", (800, 1000), "white")
+        draw = ImageDraw.Draw(img)
+        draw.rectangle([100, 100, 700, 400], fill=(gray, gray, gray))
+        for y in range(450, 950, 40):
+            draw.line([50, y, 750, y], fill=(0, 0, 0), width=2)
+        kind, palette = image_optimizer.classify_document(img)
+        assert kind == "P" and (gray, gray, gray) in palette
+        doc, w, h = image_optimizer.optimize_image(img, target_kb=180, format_hint="png", max_width=None, max_height=None)
+        with Image.open(BytesIO(doc)) as out:
+            assert out.convert("RGB").getpixel((400, 250)) == (gray, gray, gray)
+    print("✅ Rellenos grises conservados (paleta, no 1-bit)")
+
+
+def test_documento_sin_busqueda():
+    """Las páginas de documento salen más pequeñas y sin encodes de búsqueda de calidad."""
+    img = _page(True)
+    for fmt in ("webp", "png"):
+        metrics.reset()
+        t0 = time.perf_counter()
+        doc, w, h = image_optimizer.optimize_image(img, target_kb=180, format_hint=fmt, max_width=1600, max_height=1600)
+        doc_t = time.perf_counter() - t0
+        stats = metrics.snapshot()
+        assert stats.get("image_encode.document_pages") == 1
+        assert "image_encode.probes" not in stats
+        t0 = time.perf_counter()
+        full, _, _ = image_optimizer.optimize_image(img, target_kb=180, format_hint=fmt, max_width=1600, max_height=1600, classify_documents=False)
+        full_t = time.perf_counter() - t0
+        with Image.open(BytesIO(doc)) as out:
+            assert out.size == (w, h) and out.format.lower() == fmt
+            # el fondo blanco se conserva exacto (sin tramado)
+            assert out.convert("RGB").getpixel((w - 5, h - 5)) == (255, 255, 255)
+        print(f"✅ {fmt}: documento {len(doc) / 1024:.1f}KB {doc_t:.2f}s | normal {len(full) / 1024:.1f}KB {full_t:.2f}s")
+        assert len(doc) < len(full)
+
+
+if __name__ == "__main__":
+    test_clasificacion()
+    test_relleno_gris()
+    test_documento_sin_busqueda()
+    print("🏁 Pruebas del clasificador de documentos completadas")
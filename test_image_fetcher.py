@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Script para probar la descarga concurrente y la caché de imágenes remotas
+contra un servidor HTTP local (no necesita el servicio GenDoc en marcha).
+"""
+
+import sys
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.utils import image_fetcher
+
+PNG_1PX = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+DELAY = 0.3
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    hits = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        StubHandler.hits[self.path] = StubHandler.hits.get(self.path, 0) + 1
+        time.sleep(DELAY)
+        if self.path.startswith("/etag"):
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.send_header("ETag", '"v1"')
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Cache-Control", "no-cache")
+        elif self.path.startswith("/nostore"):
+            self.send_response(200)
+            self.send_header("Cache-Control", "no-store")
+        elif self.path.startswith("/missing"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        else:
+            self.send_response(200)
+            self.send_header("Cache-Control", "max-age=60")
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(PNG_1PX)))
+        self.end_headers()
+        self.wfile.write(PNG_1PX)
+
+
+def _start_stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_prefetch_concurrente_y_cache():
+    """Varias URLs se descargan en paralelo y la segunda vez salen de caché."""
+    server, base = _start_stub()
+    try:
+        image_fetcher._cache.clear()
+        urls = [f"{base}/logo{i}.png" for i in range(4)]
+        print(f"🔄 Descargando {len(urls)} imágenes (retardo {DELAY}s cada una)...")
+        t0 = time.time()
+        result = image_fetcher.prefetch_images(urls + urls)
+        elapsed = time.time() - t0
+        print(f"✅ Descarga en {elapsed:.2f}s")
+        assert all(result[u] == PNG_1PX for u in urls)
+        assert elapsed < DELAY * len(urls), "las descargas no fueron concurrentes"
+        assert all(StubHandler.hits[f"/logo{i}.png"] == 1 for i in range(4))
+
+        t0 = time.time()
+        image_fetcher.prefetch_images(urls)
+        print(f"✅ Segunda pasada (caché) en {time.time() - t0:.3f}s")
+        assert all(StubHandler.hits[f"/logo{i}.png"] == 1 for i in range(4))
+    finally:
+        server.shutdown()
+
+
+def test_revalidacion_etag_y_no_store():
+    """no-cache revalida con If-None-Match (304); no-store nunca se guarda."""
+    server, base = _start_stub()
+    try:
+        image_fetcher._cache.clear()
+        assert image_fetcher.fetch_image(f"{base}/etag.png") == PNG_1PX
+        assert image_fetcher.fetch_image(f"{base}/etag.png") == PNG_1PX
+        assert StubHandler.hits["/etag.png"] == 2
+        print("✅ Revalidación con ETag correcta")
+
+        image_fetcher.fetch_image(f"{base}/nostore.png")
+        image_fetcher.fetch_image(f"{base}/nostore.png")
+        assert StubHandler.hits["/nostore.png"] == 2
+        assert image_fetcher.fetch_image(f"{base}/missing.png") is None
+        print("✅ no-store y errores HTTP correctos")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_prefetch_concurrente_y_cache()
+    test_revalidacion_etag_y_no_store()
+    print("🏁 Pruebas de image_fetcher completadas")
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Script para probar los backends de fusión overlay (pypdf, xobject, pdfium)
+cuando la página base se repite. No necesita el servidor.
+"""
+
+import sys
+import os
+import io
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from pypdf import PdfReader
+from reportlab.pdfgen import canvas
+from app.utils.pdf_merge import MERGE_BACKENDS, merge_overlay
+
+
+def _pdf(pages):
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=(595, 842), invariant=1)
+    for n, text in enumerate(pages):
+        if n:
+            c.showPage()
+        c.drawString(100, 700 - 20 * n, text)
+    c.save()
+    return buf.getvalue()
+
+
+def test_pagina_base_repetida():
+    """Cada página lleva solo su overlay, también al repetir la última página base."""
+    base = _pdf(["Base"])
+    overlay = _pdf([f"Pagina {n}" for n in range(4)])
+    for backend in MERGE_BACKENDS:
+        reader = PdfReader(io.BytesIO(merge_overlay(base, overlay, 4, backend=backend)))
+        texts = [page.extract_text() for page in reader.pages]
+        assert len(texts) == 4, backend
+        for n, text in enumerate(texts):
+            assert "Base" in text, backend
+            others = [f"Pagina {m}" for m in range(4) if m != n]
+            assert f"Pagina {n}" in text and not any(o in text for o in others), (backend, n, text)
+        print(f"✅ {backend}: overlay correcto en las 4 páginas")
+
+
+if __name__ == "__main__":
+    print("🧪 Probando backends de fusión")
+    test_pagina_base_repetida()
+    print("🎉 Pruebas completadas")
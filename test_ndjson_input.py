@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Script para probar la entrada NDJSON de /api/render: volcado del cuerpo a
+fichero temporal, lectura perezosa de los items y validación por item. No necesita el servidor.
+"""
+
+import sys
+import os
+import json
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.utils.row_stream import spool_ndjson
+from app.utils.validation import validate_payload
+from app.services.repeat_rows import RepeatRowLayout
+
+
+def _chunks(body: bytes, size: int = 7):
+    """Cuerpo troceado como lo entrega Request.stream() (los cortes caen a mitad de línea)."""
+    async def gen():
+        for i in range(0, len(body), size):
+            yield body[i:i + size]
+    return gen()
+
+
+def _spool(header: dict, items: list, blank_lines: bool = False):
+    sep = "\n\n" if blank_lines else "\n"
+    body = (json.dumps(header) + "\n" + sep.join(json.dumps(it) for it in items) + "\n").encode()
+    return asyncio.run(spool_ndjson(_chunks(body)))
+
+
+def test_lectura_perezosa():
+    """La primera línea es la petición; el resto, items que se pueden recorrer varias veces."""
+    items = [{"desc": f"Item {i}", "qty": i} for i in range(250)]
+    header, rows = _spool({"template_id": "t1", "data": {"nombre": "Ana"}}, items, blank_lines=True)
+    try:
+        assert json.loads(header) == {"template_id": "t1", "data": {"nombre": "Ana"}}
+        assert len(rows) == 250
+        assert list(rows) == items
+        assert list(rows) == items  # segunda pasada desde el principio
+        assert str(rows).startswith("<ndjson sha256:")
+    finally:
+        rows.close()
+    print("✅ Items NDJSON leídos bajo demanda")
+
+
+def test_paginado_igual_que_lista():
+    """El motor de filas pagina un RowStream igual que la lista equivalente."""
+    items = [{"desc": f"Item {i}"} for i in range(100)]
+    _, rows = _spool({"template_id": "t1"}, items)
+    try:
+        layout = RepeatRowLayout("items", {"startY": 600, "deltaY": 14, "endY": 200}, {"items.desc": {"x": 50}}, {}, {})
+        assert layout.page_count(len(rows)) == layout.page_count(len(items)) > 1
+        assert list(layout.paginate(rows)) == list(layout.paginate(items))
+    finally:
+        rows.close()
+    print("✅ Paginado de RowStream idéntico al de la lista")
+
+
+def test_validacion_por_item():
+    """El esquema del array se aplica a cada item al leerlo; el resto del payload, al validar."""
+    schema = {
+        "type": "object",
+        "required": ["nombre"],
+        "properties": {
+            "nombre": {"type": "string"},
+            "items": {"type": "array", "items": {"type": "object", "required": ["desc"]}},
+        },
+    }
+    _, rows = _spool({"template_id": "t1"}, [{"desc": "ok"}, {"qty": 1}])
+    rows.path = "items"
+    try:
+        validate_payload({"nombre": "Ana", "items": rows}, schema)
+        try:
+            list(rows)
+            assert False, "El item 2 no cumple el esquema"
+        except ValueError as ex:
+            assert "Item 2 de 'items'" in str(ex)
+    finally:
+        rows.close()
+    print("✅ Items validados al leerlos")
+
+
+def test_restricciones_de_array():
+    """minItems/contains no rechazan un NDJSON válido; minItems/maxItems se comprueban con el número de items."""
+    schema = {
+        "type": "object",
+        "properties": {"items": {"type": "array", "minItems": 2, "maxItems": 5, "contains": {"required": ["desc"]}, "items": {"type": "object"}}},
+    }
+    _, rows = _spool({"template_id": "t1"}, [{"desc": "a"}, {"desc": "b"}, {"desc": "c"}])
+    rows.path = "items"
+    try:
+        validate_payload({"items": rows}, schema)
+        assert len(list(rows)) == 3
+        assert schema["properties"]["items"]["minItems"] == 2  # el esquema de la plantilla no se toca
+    finally:
+        rows.close()
+    _, rows = _spool({"template_id": "t1"}, [{"desc": "a"}])
+    try:
+        validate_payload({"items": rows}, schema)
+        assert False, "minItems: 2"
+    except Exception as ex:
+        assert "al menos 2" in str(ex)
+    finally:
+        rows.close()
+    print("✅ Restricciones de array con NDJSON")
+
+
+def test_iteraciones_simultaneas():
+    """Dos recorridos a la vez no se pisan la posición; paginate no cuenta las líneas."""
+    items = [{"desc": f"Item {i}"} for i in range(3000)]
+    _, rows = _spool({"template_id": "t1"}, items)
+    try:
+        first, second = iter(rows), iter(rows)
+        pairs = list(zip(first, second))
+        assert [a for a, _ in pairs] == items and [b for _, b in pairs] == items
+        layout = RepeatRowLayout("items", {"startY": 600, "deltaY": 14, "endY": 200}, {"items.desc": {"x": 50}}, {}, {})
+        next(layout.paginate(rows))
+        assert rows._count is None
+    finally:
+        rows.close()
+    print("✅ Recorridos simultáneos independientes")
+
+
+if __name__ == "__main__":
+    print("🧪 Probando entrada NDJSON")
+    test_lectura_perezosa()
+    test_paginado_igual_que_lista()
+    test_validacion_por_item()
+    test_restricciones_de_array()
+    test_iteraciones_simultaneas()
+    print("🎉 Pruebas completadas")
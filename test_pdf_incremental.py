@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Script para probar el relleno incremental de formularios AcroForm: los bytes
+originales quedan como prefijo intacto, los valores se leen con pypdf y la
+nueva sección xref es del mismo tipo que la original (tabla o stream /XRef).
+No necesita el servidor.
+"""
+
+import sys
+import os
+import io
+import re
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from pypdf import PdfReader
+from reportlab.pdfgen import canvas
+from app.utils.pdf_incremental import fill_acroform_incremental
+
+
+def _form_pdf() -> bytes:
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=(595, 842))
+    c.drawString(50, 800, "Formulario")
+    c.acroForm.textfield(name="nombre", x=50, y=700, width=200, height=20)
+    c.acroForm.textfield(name="ciudad", x=50, y=650, width=200, height=20)
+    c.acroForm.checkbox(name="acepta", x=50, y=600, size=15)
+    c.acroForm.choice(name="pais", value="Chile", options=["Chile", "Peru", ("Argentina", "AR")], x=50, y=550, width=150, height=20)
+    c.acroForm.listbox(name="color", value="rojo", options=["rojo", "azul"], x=50, y=480, width=150, height=40)
+    c.save()
+    return buf.getvalue()
+
+
+def _with_xref_stream(pdf: bytes) -> bytes:
+    """Sustituye la tabla xref clásica de 'pdf' por un stream /XRef equivalente (PDF 1.5)."""
+    xref_pos = int(pdf[pdf.rindex(b"startxref") + 9:].split()[0])
+    table, trailer = pdf[xref_pos:].split(b"trailer", 1)
+    offsets = {}
+    lines = table.split(b"\n")[1:]
+    i = 0
+    while i < len(lines) and lines[i].strip():
+        first, count = map(int, lines[i].split())
+        for n in range(count):
+            offset, _, kind = lines[i + 1 + n].split()[:3]
+            if kind == b"n":
+                offsets[first + n] = int(offset)
+        i += count + 1
+    size = max(offsets) + 1
+    offsets[size] = xref_pos
+    rows = b"\x00\x00\x00\x00\x00\xff\xff" + b"".join(b"\x01" + offsets[n].to_bytes(4, "big") + b"\x00\x00" for n in range(1, size + 1))
+    extra = b"".join(re.findall(rb"/(?:Root|Info) \d+ 0 R|/ID\s*\[[^\]]*\]", trailer))
+    body = pdf[:xref_pos].replace(b"%PDF-1.3", b"%PDF-1.5", 1)
+    return (body + f"{size} 0 obj\n<< /Type /XRef /Size {size + 1} /W [1 4 2] /Length {len(rows)} ".encode() + extra
+            + b" >>\nstream\n" + rows + b"\nendstream\nendobj\n" + f"startxref\n{xref_pos}\n%%EOF\n".encode())
+
+
+def _check_fill(original: bytes):
+    filled = fill_acroform_incremental(original, {"nombre": "Ana (López)", "acepta": "true"}, revision_id=b"\x02" * 16)
+    assert filled.startswith(original)
+    reader = PdfReader(io.BytesIO(filled), strict=True)
+    fields = reader.get_fields()
+    assert fields["nombre"]["/V"] == "Ana (López)"
+    assert fields["acepta"]["/V"] != "/Off"
+    assert fields["ciudad"].get("/V") in (None, "")
+    return filled[len(original):]
+
+
+def test_tabla_xref():
+    """Con una tabla xref clásica la actualización añade otra tabla y su trailer."""
+    update = _check_fill(_form_pdf())
+    assert b"\nxref\n" in update and b"trailer" in update and b"/XRef" not in update
+    print("✅ Relleno incremental con tabla xref")
+
+
+def test_stream_xref():
+    """Con un stream /XRef la actualización añade otro stream /XRef (sin tabla clásica)."""
+    original = _with_xref_stream(_form_pdf())
+    assert PdfReader(io.BytesIO(original), strict=True).get_fields()["nombre"]
+    update = _check_fill(original)
+    assert b"/Type /XRef" in update and b"/Prev" in update
+    assert b"\nxref\n" not in update and b"trailer" not in update
+    print("✅ Relleno incremental con stream /XRef")
+
+
+def test_campos_de_seleccion():
+    """/Ch: la lista desplegable muestra el texto de la opción; el cuadro de lista pide /NeedAppearances."""
+    original = _form_pdf()
+    filled = fill_acroform_incremental(original, {"pais": "AR"})
+    assert filled.startswith(original)
+    reader = PdfReader(io.BytesIO(filled), strict=True)
+    assert reader.get_fields()["pais"]["/V"] == "AR"
+    widget = next(a.get_object() for a in reader.pages[0]["/Annots"] if a.get_object().get("/T") == "pais")
+    assert b"(Argentina) Tj" in widget["/AP"]["/N"].get_data()
+    assert "/NeedAppearances" not in reader.trailer["/Root"]["/AcroForm"]
+
+    filled = fill_acroform_incremental(original, {"color": "azul"})
+    assert filled.startswith(original)
+    reader = PdfReader(io.BytesIO(filled), strict=True)
+    assert reader.get_fields()["color"]["/V"] == "azul"
+    assert reader.trailer["/Root"]["/AcroForm"]["/NeedAppearances"] == True
+    print("✅ Campos de selección rellenados")
+
+
+def test_sin_formulario():
+    """Un PDF sin /AcroForm no admite el relleno incremental."""
+    buf = io.BytesIO()
+    canvas.Canvas(buf).save()
+    try:
+        fill_acroform_incremental(buf.getvalue(), {"nombre": "Ana"})
+        assert False, "Debe fallar sin /AcroForm"
+    except ValueError:
+        pass
+    print("✅ PDF sin formulario rechazado")
+
+
+if __name__ == "__main__":
+    print("🧪 Probando el relleno incremental de formularios")
+    test_tabla_xref()
+    test_stream_xref()
+    test_campos_de_seleccion()
+    test_sin_formulario()
+    print("🎉 Pruebas completadas")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Script para probar el memo de calidad por plantilla del optimizador de imágenes
+(save_with_target_filesize con quality_key) y la búsqueda de calidad en
+paralelo. No necesita el servidor.
+"""
+
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image, ImageDraw
+from app.utils import image_optimizer, metrics
+
+TARGET_KB = 55
+
+
+def _page(seed: int) -> Image.Image:
+    img = Image.new("RGB", (600, 850), "white")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([30, 30, 570, 120], fill=(221, 230, 240))
+    for i in range(70):
+        draw.text((40, 140 + i * 10), f"Fila {i} pedido {seed}-{i * 7919 % 1000} importe {i * 12.5:.2f} EUR", fill=(17, 17, 17))
+    return img
+
+
+def _encode(img, key, threads=1):
+    metrics.reset()
+    t0 = time.perf_counter()
+    out = image_optimizer.save_with_target_filesize(img, TARGET_KB, fmt="webp", extra_kwargs={"method": 6}, quality_key=key, threads=threads)
+    probes = metrics.snapshot()["image_encode.probes"]["sum"]
+    return out, probes, time.perf_counter() - t0
+
+
+def test_memo_reduce_probes():
+    """El segundo render de la misma plantilla arranca en la calidad memorizada."""
+    image_optimizer._quality_memo.clear()
+    first, first_probes, first_t = _encode(_page(1), ("plantilla", "v1"))
+    print(f"✅ Primer encode: {first_probes} encodes, {first_t:.2f}s, {len(first) / 1024:.1f}KB")
+    second, second_probes, second_t = _encode(_page(2), ("plantilla", "v1"))
+    print(f"✅ Con memo: {second_probes} encodes, {second_t:.2f}s, {len(second) / 1024:.1f}KB")
+    assert second_probes < first_probes
+    assert metrics.snapshot().get("image_encode.memo_hits") == 1
+    assert abs(len(second) / 1024 - TARGET_KB) <= TARGET_KB * 0.25
+
+    _, other_probes, _ = _encode(_page(2), ("otra", "v1"))
+    assert other_probes == first_probes, "otra plantilla no debe usar el memo"
+
+
+def test_memo_fallo_busqueda_completa():
+    """Si el objetivo cae fuera del intervalo, se repite la búsqueda completa."""
+    image_optimizer._quality_memo.clear()
+    img = _page(3)
+    key = ("plantilla", "v2")
+    params = tuple(sorted({"optimize": True, "method": 6}.items()))
+    memo_key = (key, "webp", params, TARGET_KB, img.size)
+    image_optimizer._quality_memo[memo_key] = 35  # calidad memorizada muy baja
+    out, probes, _ = _encode(img, key)
+    assert metrics.snapshot().get("image_encode.memo_misses") == 1
+    assert image_optimizer._quality_memo[memo_key] > 35 + image_optimizer.QUALITY_BRACKET
+    print(f"✅ Fallo del memo resuelto con búsqueda completa ({probes} encodes, {len(out) / 1024:.1f}KB)")
+
+
+def test_busqueda_paralela_equivalente():
+    """La búsqueda por rondas en paralelo llega al mismo objetivo que la secuencial."""
+    img = _page(4)
+    sequential, seq_probes, seq_t = _encode(img, None, threads=1)
+    for threads in (2, 3, 4):
+        parallel, par_probes, par_t = _encode(img, None, threads=threads)
+        print(f"✅ {threads} hilos: {par_probes} encodes, {par_t:.2f}s (secuencial: {seq_probes} encodes, {seq_t:.2f}s)")
+        assert abs(len(parallel) - len(sequential)) / 1024 <= TARGET_KB * 0.05
+
+
+if __name__ == "__main__":
+    test_memo_reduce_probes()
+    test_memo_fallo_busqueda_completa()
+    test_busqueda_paralela_equivalente()
+    print("🏁 Pruebas del memo de calidad completadas")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Prueba de regresión de fugas de memoria de pdfium.
+
+Rasteriza miles de páginas con las mismas funciones que ejecutan los workers de
+raster_pool y comprueba que el RSS del proceso se estabiliza (documentos,
+páginas y bitmaps cerrados explícitamente). Después fuerza el reciclado del pool
+por RSS y comprueba que sigue respondiendo. No necesita el servidor.
+
+  GENDOC_LEAK_PAGES=5000 python test_raster_leak.py
+"""
+
+import sys
+import os
+import io
+import gc
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from reportlab.pdfgen import canvas
+from app.utils import metrics
+from app.utils.raster_canvas import rasterize_page
+from app.utils.pdf_preview import _render_page_png
+from app.utils.raster_pool import RasterPool, current_rss
+
+PAGES = int(os.getenv("GENDOC_LEAK_PAGES", "2000"))
+# Crecimiento de RSS tolerado tras el calentamiento
+MAX_GROWTH_MB = 20
+
+
+def _pdf(pages: int = 4) -> bytes:
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=(595.32, 841.92))
+    for i in range(pages):
+        c.setFont("Helvetica", 14)
+        for row in range(40):
+            c.drawString(40, 800 - row * 18, f"Página {i + 1} fila {row} importe {row * 12.5:.2f} EUR")
+        c.rect(40, 40, 200, 60, fill=1)
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def _rss_mb() -> float:
+    gc.collect()
+    return current_rss() / (1024 * 1024)
+
+
+def test_rss_estable():
+    """Miles de páginas en el mismo proceso no hacen crecer el RSS."""
+    pdf = _pdf()
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".leak_test.pdf")
+    with open(path, "wb") as f:
+        f.write(pdf)
+    try:
+        warmup = max(50, PAGES // 10)
+        for i in range(warmup):
+            rasterize_page(pdf, i % 4, 0.5)
+        baseline = _rss_mb()
+        t0 = time.perf_counter()
+        for i in range(PAGES):
+            if i % 2:
+                rasterize_page(pdf, i % 4, 0.5)
+            else:
+                _render_page_png(path, i % 4, 0.5)
+        growth = _rss_mb() - baseline
+        print(f"✅ {PAGES} páginas en {time.perf_counter() - t0:.1f}s, RSS {baseline:.1f}MB -> {baseline + growth:.1f}MB")
+        assert growth < MAX_GROWTH_MB, f"RSS creció {growth:.1f}MB"
+    finally:
+        os.remove(path)
+
+
+def test_reciclado_por_rss():
+    """Con un umbral mínimo, cada tarea recicla el pool y las siguientes siguen funcionando."""
+    pdf = _pdf(1)
+    metrics.reset()
+    pool = RasterPool(max_workers=1, recycle_mb=1)
+    try:
+        sizes = [pool.run(rasterize_page, pdf, 0, 0.5).size for _ in range(3)]
+    finally:
+        pool.shutdown()
+    assert len(set(sizes)) == 1
+    assert pool.recycles == 3
+    assert metrics.snapshot().get("raster_pool.recycles") == 3
+    print(f"✅ Pool reciclado {pool.recycles} veces sin perder tareas")
+
+
+def test_rss_sin_proc():
+    """Sin /proc el RSS actual sale de psutil; sin ninguno de los dos es None y el pool no se recicla."""
+    from concurrent.futures import Future
+    from app.utils import raster_pool
+
+    def no_proc(*args, **kwargs):
+        raise OSError("sin /proc")
+
+    raster_pool.open = no_proc
+    try:
+        import psutil
+        assert abs(current_rss() - psutil.Process().memory_info().rss) < 64 * 1024 * 1024
+        saved, sys.modules["psutil"] = sys.modules["psutil"], None
+        try:
+            assert current_rss() is None
+        finally:
+            sys.modules["psutil"] = saved
+    finally:
+        del raster_pool.open
+
+    pool = RasterPool(max_workers=0, recycle_mb=1)
+    future = Future()
+    future.set_result(("ok", {}, None))
+    assert pool._finish(future, pool.executor) == "ok" and pool.recycles == 0
+    print("✅ RSS actual sin /proc")
+
+
+if __name__ == "__main__":
+    test_rss_estable()
+    test_reciclado_por_rss()
+    test_rss_sin_proc()
+    print("🏁 Prueba de fugas de pdfium completada")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Script para probar la salida "image" de las plantillas overlay dibujada
+directamente con Pillow (RasterCanvas) frente a la ruta PDF: render_to_pdf y
+rasterizado con pdfium a la misma escala. No necesita el servidor.
+"""
+
+import sys
+import os
+import io
+import base64
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import UploadFile
+from PIL import Image, ImageChops, ImageFilter
+from reportlab.pdfgen import canvas
+from app.services.template_store import TemplateStore
+from app.services.renderer import Renderer, _template_page_size, raster_scale
+from app.utils.raster_canvas import rasterize_page
+
+# Tras desenfocar ambas imágenes (el antialias y el hinting de FreeType frente a
+# pdfium solo cambian los bordes), píxeles con diferencia > 48: como mucho el 0,1%.
+# Un texto más ancho o desplazado, una imagen o un recuadro fuera de sitio lo superan.
+_BLUR = 1.5
+_MAX_DIFF = 48
+_MAX_DIFF_RATIO = 0.001
+
+
+def _png(color, size=(120, 40)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _template(store):
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=(595, 842))
+    c.drawString(40, 800, "BASE")
+    c.rect(30, 30, 535, 782)
+    c.save()
+    template_id = store.save_template(UploadFile(file=io.BytesIO(buf.getvalue()), filename="base.pdf"))
+    store.save_mapping(template_id, {
+        "_preview_scale": 1,
+        "_positions": {"nombre": [40, 700], "total": [300, 700], "items.desc": [40, 600], "items.importe": [400, 600]},
+        "_styles": {
+            "nombre": {"font": "Helvetica-Bold", "size": 18, "color": "#003366"},
+            "total": {"font": "Times-Roman", "size": 13, "color": "#aa0000"},
+        },
+        "_repeat_rows": {"items": {"startY": 600, "deltaY": 14, "endY": 80}},
+        "_images": {"logo": {"x": 100, "y": 300, "width": 120, "height": 40}},
+        "_signatures": {"firma": {"x": 350, "y": 200, "width": 180, "height": 60}},
+    })
+    return template_id
+
+
+def _data():
+    return {
+        "nombre": "Ana María López",
+        "total": "1.234,50 EUR",
+        "logo": "data:image/png;base64," + base64.b64encode(_png((0, 120, 200))).decode(),
+        "items": [{"desc": f"Concepto número {n}", "importe": f"{n * 12.5:.2f}"} for n in range(30)],
+    }
+
+
+def test_igual_que_la_ruta_pdf():
+    """Textos con estilos, filas repetidas, imagen y firma: mismo resultado que rasterizar el PDF."""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TemplateStore(tmp)
+        renderer = Renderer(store)
+        template_id = _template(store)
+        data = _data()
+        version = store.get_template_version(template_id)
+        page_size = _template_page_size(store.get_template_file(template_id), version)
+        pdf_bytes = renderer.render_to_pdf(template_id, data)
+        for dpi in (None, 72, 150):
+            direct = renderer._raster_overlay_first_page(template_id, data, version, dpi, None, None)
+            assert direct is not None, "La plantilla overlay debe usar el camino directo"
+            via_pdf = rasterize_page(pdf_bytes, 0, raster_scale(*page_size, dpi))
+            assert direct.size == via_pdf.size
+            diff = ImageChops.difference(
+                direct.convert("L").filter(ImageFilter.GaussianBlur(_BLUR)),
+                via_pdf.convert("L").filter(ImageFilter.GaussianBlur(_BLUR)),
+            )
+            different = sum(1 for v in diff.getdata() if v > _MAX_DIFF)
+            assert different <= _MAX_DIFF_RATIO * direct.width * direct.height, f"dpi={dpi}: {different} píxeles distintos"
+    print("✅ Rasterizado directo equivalente a la ruta PDF")
+
+
+def test_dimensiones():
+    """dpi / max_width / max_height: mismo tamaño por el camino directo y por el PDF, siempre dentro de la caja."""
+    from app.services import renderer as renderer_module
+    combos = [
+        (None, None, None), (72, None, None), (100, None, None), (150, None, None),
+        (None, 800, None), (None, None, 600), (None, 595, 842), (None, 1190, 1684),
+        (150, 500, None), (300, None, 1000), (None, 333, 333),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TemplateStore(tmp)
+        renderer = Renderer(store)
+        template_id = _template(store)
+        data = _data()
+        version = store.get_template_version(template_id)
+        page_w, page_h = _template_page_size(store.get_template_file(template_id), version)
+        pdf_bytes = renderer.render_to_pdf(template_id, data)
+        for dpi, max_width, max_height in combos:
+            box_w, box_h = renderer_module.raster_box(dpi, max_width, max_height)
+            scale = raster_scale(page_w, page_h, dpi, max_width, max_height)
+            # El recorte de 1e-6 deja la escala un pelo por debajo del lado limitante
+            assert (not box_w or page_w * scale < box_w) and (not box_h or page_h * scale < box_h)
+            expected = round(page_w * scale), round(page_h * scale)
+
+            direct = renderer._raster_overlay_first_page(template_id, data, version, dpi, max_width, max_height)
+            via_pdf = rasterize_page(pdf_bytes, 0, scale)
+            for image in (direct, via_pdf):
+                assert abs(image.width - expected[0]) <= 1 and abs(image.height - expected[1]) <= 1, (dpi, max_width, max_height, image.size)
+                assert (not box_w or image.width <= box_w) and (not box_h or image.height <= box_h), (dpi, max_width, max_height, image.size)
+            assert direct.size == via_pdf.size
+
+            # De extremo a extremo (imagen codificada), con y sin el camino directo
+            sizes = []
+            for fast_path in (True, False):
+                renderer_module.RASTER_FAST_PATH = fast_path
+                try:
+                    image_bytes, width, height = renderer.render_to_image(template_id, data, dpi, max_width, max_height, image_format="png")
+                finally:
+                    renderer_module.RASTER_FAST_PATH = True
+                assert Image.open(io.BytesIO(image_bytes)).size == (width, height)
+                sizes.append((width, height))
+            assert sizes[0] == sizes[1] == direct.size, (dpi, max_width, max_height, sizes)
+    print("✅ Dimensiones según dpi / max_width / max_height")
+
+
+if __name__ == "__main__":
+    print("🧪 Probando el rasterizado directo de plantillas overlay")
+    test_igual_que_la_ruta_pdf()
+    test_dimensiones()
+    print("🎉 Pruebas completadas")
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Script para probar /api/render con el TestClient de FastAPI: ETag/304,
+negociación por Accept (binario y multipart/mixed), salidas múltiples
+("outputs"), varias páginas en zip, PDF por partes, entrada NDJSON, imágenes
+en multipart, referencias "asset:<id>" y la liberación de los recursos de la
+petición cuando el cliente se va antes de que termine el render. Usa
+almacenes temporales (los globales de app.routes.api se restauran al terminar
+cada prueba); no necesita el servidor.
+"""
+
+import sys
+import os
+import io
+import json
+import asyncio
+import base64
+import tempfile
+import threading
+import zipfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from contextlib import ExitStack, contextmanager
+from fastapi import FastAPI, UploadFile
+from fastapi.testclient import TestClient
+from PIL import Image
+from pypdf import PdfReader
+from reportlab.pdfgen import canvas
+from app.routes import api
+from app.services.asset_store import AssetStore
+from app.services.renderer import Renderer
+from app.services.template_store import TemplateStore
+from app.utils import image_cache
+from app.utils.image_cache import content_key, pinned_images, set_asset_loader
+
+
+def _png(color=(200, 0, 0)):
+    buf = io.BytesIO()
+    Image.new("RGB", (120, 40), color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+@contextmanager
+def _api():
+    """
+    Cliente de /api con una plantilla overlay (un texto, filas repetidas y un
+    campo imagen) en almacenes temporales. Al salir se restauran los globales
+    de app.routes.api y el cargador de assets.
+    """
+    saved = api.store, api.renderer, api.assets, image_cache._asset_loader
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            api.store = TemplateStore(os.path.join(tmp, "templates"))
+            api.renderer = Renderer(api.store)
+            api.assets = AssetStore(os.path.join(tmp, "assets"))
+            set_asset_loader(api.assets.get_asset)
+            buf = io.BytesIO()
+            c = canvas.Canvas(buf, pagesize=(595, 842))
+            c.drawString(40, 800, "BASE")
+            c.save()
+            template_id = api.store.save_template(UploadFile(file=io.BytesIO(buf.getvalue()), filename="base.pdf"))
+            api.store.save_mapping(template_id, {
+                "_preview_scale": 1,
+                "_positions": {"nombre": [40, 700], "items.desc": [40, 600]},
+                "_repeat_rows": {"items": {"startY": 600, "deltaY": 14, "endY": 80}},
+                "_images": {"logo": {"x": 100, "y": 300, "width": 120, "height": 40}},
+            })
+            app = FastAPI()
+            app.include_router(api.router, prefix="/api")
+            yield TestClient(app), template_id
+        finally:
+            api.store, api.renderer, api.assets = saved[:3]
+            set_asset_loader(saved[3])
+
+
+def _rows(count):
+    return [{"desc": f"Fila {n}"} for n in range(count)]
+
+
+def test_etag_y_304():
+    """Misma petición -> mismo ETag; con If-None-Match la respuesta es 304 sin cuerpo."""
+    with _api() as (client, template_id):
+        body = {"template_id": template_id, "data": {"nombre": "Ana"}}
+        first = client.post("/api/render", json=body)
+        assert first.status_code == 200 and first.headers["etag"]
+        assert client.post("/api/render", json=body).headers["etag"] == first.headers["etag"]
+        cached = client.post("/api/render", json=body, headers={"If-None-Match": first.headers["etag"]})
+        assert cached.status_code == 304 and cached.content == b""
+        print("✅ ETag y 304")
+
+
+def test_paginas_zip():
+    """'pages' devuelve un zip con una imagen por página; una página inexistente es 400."""
+    with _api() as (client, template_id):
+        body = {"template_id": template_id, "data": {"nombre": "Ana", "items": _rows(100)}, "output_format": "image"}
+        response = client.post("/api/render", json={**body, "pages": "all"})
+        assert response.status_code == 200
+        count = int(response.headers["x-page-count"])
+        names = zipfile.ZipFile(io.BytesIO(response.content)).namelist()
+        assert count > 1 and "manifest.json" in names and len(names) == count + 1
+        assert client.post("/api/render", json={**body, "pages": str(count + 1)}).status_code == 400
+        print("✅ Varias páginas en zip")
+
+
+def test_pdf_por_partes():
+    """"stream": true devuelve el mismo documento que el PDF completo."""
+    with _api() as (client, template_id):
+        data = {"nombre": "Ana", "items": _rows(120)}
+        streamed = client.post("/api/render", json={"template_id": template_id, "data": data, "stream": True})
+        assert streamed.status_code == 200 and streamed.headers["etag"]
+        full = client.post("/api/render", json={"template_id": template_id, "data": data}, headers={"Accept": "application/pdf"})
+        streamed_pages = PdfReader(io.BytesIO(streamed.content)).pages
+        full_pages = PdfReader(io.BytesIO(full.content)).pages
+        assert len(streamed_pages) == len(full_pages) > 1
+        assert streamed_pages[-1].extract_text() == full_pages[-1].extract_text()
+        assert client.post("/api/render", json={"template_id": template_id, "data": data, "stream": True, "output_format": "image"}).status_code == 400
+        print("✅ PDF por partes")
+
+
+def test_entrada_ndjson():
+    """Con NDJSON los items de _repeat_rows llegan uno por línea y el PDF es el mismo que con JSON."""
+    with _api() as (client, template_id):
+        rows = _rows(60)
+        header = {"template_id": template_id, "data": {"nombre": "Ana"}}
+        ndjson = "\n".join(json.dumps(line) for line in [header] + rows).encode()
+        response = client.post("/api/render", content=ndjson, headers={"Content-Type": "application/x-ndjson", "Accept": "application/pdf"})
+        assert response.status_code == 200
+        expected = client.post("/api/render", json={**header, "data": {"nombre": "Ana", "items": rows}}, headers={"Accept": "application/pdf"})
+        assert response.content == expected.content
+        print("✅ Entrada NDJSON")
+
+
+def test_multipart_y_assets():
+    """Imágenes en multipart y "asset:<id>"; solo los campos imagen exigen que el asset exista."""
+    with _api() as (client, template_id):
+        png = _png((0, 120, 0))
+        request = json.dumps({"template_id": template_id, "data": {"nombre": "Ana"}})
+        uploaded = client.post("/api/render", data={"request": request}, files={"logo": ("logo.png", png, "image/png")},
+                               headers={"Accept": "application/pdf"})
+        assert uploaded.status_code == 200
+        assert content_key(png) not in image_cache._pinned
+
+        ref = client.post("/api/assets", files={"file": ("logo.png", png, "image/png")}).json()["ref"]
+        stored = client.post("/api/render", json={"template_id": template_id, "data": {"nombre": "Ana", "logo": ref}},
+                             headers={"Accept": "application/pdf"})
+        assert stored.status_code == 200 and stored.content == uploaded.content
+        missing = client.post("/api/render", json={"template_id": template_id, "data": {"nombre": "Ana", "logo": "asset:" + "0" * 40}})
+        assert missing.status_code == 400
+        # En un campo de texto "asset:..." es texto normal
+        assert client.post("/api/render", json={"template_id": template_id, "data": {"nombre": "asset:hola"}}).status_code == 200
+        print("✅ Multipart y referencias a assets")
+
+
+def _multipart_parts(response):
+    """Partes (cabeceras, cuerpo) de una respuesta multipart/mixed."""
+    boundary = response.headers["content-type"].split("boundary=")[1].encode()
+    parts = []
+    for chunk in response.content.split(b"--" + boundary)[1:-1]:
+        head, _, body = chunk[2:].partition(b"\r\n\r\n")
+        headers = dict(line.split(": ", 1) for line in head.decode().split("\r\n"))
+        parts.append(({k.lower(): v for k, v in headers.items()}, body[:-2]))
+    return parts
+
+
+def test_accept_binario():
+    """Accept: application/pdf o un tipo de imagen devuelve el binario; los metadatos van en cabeceras."""
+    with _api() as (client, template_id):
+        pdf = client.post("/api/render", json={"template_id": template_id, "data": {"nombre": "Ana"}}, headers={"Accept": "application/pdf"})
+        assert pdf.status_code == 200 and pdf.headers["content-type"] == "application/pdf"
+        assert "Ana" in PdfReader(io.BytesIO(pdf.content)).pages[0].extract_text()
+        assert json.loads(pdf.headers["x-signatures"]) == {} and "accept" in pdf.headers["vary"].lower()
+        body = {"template_id": template_id, "data": {"nombre": "Ana"}, "output_format": "image"}
+        image = client.post("/api/render", json=body, headers={"Accept": "image/png"})
+        assert image.status_code == 200 and image.headers["content-type"] == "image/png"
+        assert image.content.startswith(b"\x89PNG")
+        info = json.loads(image.headers["x-image-info"])
+        assert Image.open(io.BytesIO(image.content)).size == (info["width"], info["height"])
+        # Sin Accept explícito (o con application/json), el JSON de siempre
+        assert "image_base64" in client.post("/api/render", json=body, headers={"Accept": "application/json"}).json()
+        assert "image_base64" in client.post("/api/render", json=body, headers={"Accept": "*/*"}).json()
+    print("✅ Negociación por Accept")
+
+
+def test_accept_multipart():
+    """Accept: multipart/mixed: primero los metadatos en JSON y después el binario; se respetan los q."""
+    with _api() as (client, template_id):
+        body = {"template_id": template_id, "data": {"nombre": "Ana"}}
+        binary = client.post("/api/render", json=body, headers={"Accept": "application/pdf"})
+        response = client.post("/api/render", json=body, headers={"Accept": "multipart/mixed, application/pdf;q=0.5"})
+        assert response.status_code == 200 and response.headers["content-type"].startswith("multipart/mixed; boundary=")
+        (meta_headers, meta), (pdf_headers, pdf) = _multipart_parts(response)
+        assert meta_headers["content-type"] == "application/json" and json.loads(meta) == {"signatures": {}}
+        assert pdf_headers["content-type"] == "application/pdf" and pdf == binary.content
+        # Con más peso para el PDF gana el binario
+        weighted = client.post("/api/render", json=body, headers={"Accept": "multipart/mixed;q=0.1, application/pdf;q=0.2"})
+        assert weighted.headers["content-type"] == "application/pdf" and weighted.content == binary.content
+    print("✅ Respuesta multipart/mixed")
+
+
+def test_salidas_multiples():
+    """'outputs' devuelve PDF, imagen y miniaturas de un único render, en JSON o en multipart/mixed."""
+    with _api() as (client, template_id):
+        body = {
+            "template_id": template_id, "data": {"nombre": "Ana"},
+            "outputs": ["pdf", "image", "thumbnail"], "thumbnail_sizes": [64, 128], "image_format": "png",
+        }
+        response = client.post("/api/render", json=body)
+        assert response.status_code == 200
+        result = response.json()
+        pdf = client.post("/api/render", json={"template_id": template_id, "data": {"nombre": "Ana"}}, headers={"Accept": "application/pdf"})
+        assert base64.b64decode(result["pdf_base64"]) == pdf.content
+        image = Image.open(io.BytesIO(base64.b64decode(result["image_base64"])))
+        assert image.size == (result["image_info"]["width"], result["image_info"]["height"])
+        assert [thumb["max_side"] for thumb in result["thumbnails"]] == [128, 64]  # de mayor a menor
+        for thumb in result["thumbnails"]:
+            assert max(thumb["width"], thumb["height"]) <= thumb["max_side"]
+            assert Image.open(io.BytesIO(base64.b64decode(thumb["image_base64"]))).size == (thumb["width"], thumb["height"])
+
+        # multipart/mixed: metadatos y una parte binaria por salida, con los mismos bytes
+        parts = _multipart_parts(client.post("/api/render", json=body, headers={"Accept": "multipart/mixed"}))
+        meta = json.loads(parts[0][1])
+        assert meta["image_info"] == result["image_info"] and "image_base64" not in meta
+        assert [headers["x-output"] for headers, _ in parts[1:]] == ["pdf", "image", "thumbnail", "thumbnail"]
+        assert parts[1][1] == pdf.content
+        assert parts[2][1] == base64.b64decode(result["image_base64"])
+
+        # Solo miniaturas: se rasteriza al tamaño de la mayor (±1 px por el redondeo del lado corto)
+        thumbs = client.post("/api/render", json={**body, "outputs": ["thumbnail"]}).json()["thumbnails"]
+        for thumb, reference in zip(thumbs, result["thumbnails"]):
+            assert thumb["max_side"] == reference["max_side"] == max(thumb["width"], thumb["height"])
+            assert abs(thumb["width"] - reference["width"]) <= 1 and abs(thumb["height"] - reference["height"]) <= 1
+        assert client.post("/api/render", json={**body, "outputs": []}).status_code == 422
+    print("✅ Salidas múltiples")
+
+
+def test_cliente_desconectado():
+    """Si el cliente se va a mitad del render, los recursos se liberan al terminar el render, no antes."""
+    with _api() as (_, template_id):
+        png = _png((10, 20, 30))
+        key = content_key(png)
+        closed = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def render(template_id, data):
+            started.set()
+            release.wait(10)
+            return b"%PDF-"
+
+        async def scenario():
+            resources = ExitStack()
+            resources.enter_context(pinned_images({key: png}))
+            resources.callback(closed.append, "rows")
+            req = api.RenderRequest(template_id=template_id, data={"cancelado": True})
+            task = asyncio.ensure_future(api._coalesced("render_to_pdf", req, resources, render))
+            while not started.is_set():
+                await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            resources.close()  # el finally de render_document
+            # El render sigue en curso: las imágenes y los items siguen disponibles
+            assert key in image_cache._pinned and closed == []
+            release.set()
+            for _ in range(500):
+                if closed:
+                    break
+                await asyncio.sleep(0.01)
+
+        asyncio.run(scenario())
+        assert closed == ["rows"] and key not in image_cache._pinned
+        print("✅ Recursos liberados tras desconectarse el cliente")
+
+
+def test_globales_restaurados():
+    """Al terminar, app.routes.api vuelve a usar sus almacenes y su cargador de assets."""
+    saved = api.store, api.renderer, api.assets, image_cache._asset_loader
+    with _api():
+        assert api.store is not saved[0]
+    assert (api.store, api.renderer, api.assets, image_cache._asset_loader) == saved
+    print("✅ Globales de la API restaurados")
+
+
+if __name__ == "__main__":
+    print("🧪 Probando /api/render")
+    test_etag_y_304()
+    test_accept_binario()
+    test_accept_multipart()
+    test_salidas_multiples()
+    test_paginas_zip()
+    test_pdf_por_partes()
+    test_entrada_ndjson()
+    test_multipart_y_assets()
+    test_cliente_desconectado()
+    test_globales_restaurados()
+    print("🎉 Pruebas completadas")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Script para probar la salida de varias páginas como imágenes: rangos de páginas
+y rasterizado en el pool de procesos. No necesita el servidor.
+"""
+
+import sys
+import os
+import io
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from functools import partial
+from PIL import Image
+from reportlab.pdfgen import canvas
+from app.services.renderer import parse_page_range, raster_scale
+from app.utils.raster_pool import get_raster_pool, shutdown_raster_pool
+
+
+def _pdf(pages: int) -> bytes:
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=(595.32, 841.92))
+    for i in range(pages):
+        c.setFont("Helvetica", 48)
+        c.drawString(100, 700, f"Pagina {i + 1}")
+        # una franja negra de ancho distinto por página para reconocerlas
+        c.rect(0, 0, 20 * (i + 1), 40, fill=1)
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def test_rangos():
+    assert parse_page_range("all", 4) == [0, 1, 2, 3]
+    assert parse_page_range("1-2, 4", 4) == [0, 1, 3]
+    assert parse_page_range("3-", 5) == [2, 3, 4]
+    assert parse_page_range("2,2,1-2", 3) == [1, 0]
+    for bad in ("0", "3-1", "1-9", "a"):
+        try:
+            parse_page_range(bad, 4)
+        except ValueError:
+            continue
+        raise AssertionError(f"rango aceptado: {bad}")
+    print("✅ Rangos de páginas")
+
+
+def test_pool_orden():
+    """Las páginas vuelven en el orden pedido, al tamaño pedido."""
+    pdf = _pdf(6)
+    order = [5, 0, 3, 1]
+    t0 = time.perf_counter()
+    results = list(get_raster_pool().render_pages(
+        pdf, order, partial(raster_scale, max_width=400),
+        {"target_kb": 60, "format_hint": "png", "max_width": 400, "max_height": None},
+    ))
+    print(f"✅ {len(results)} páginas en {time.perf_counter() - t0:.2f}s")
+    assert len(results) == len(order)
+    for index, (data, width, height) in zip(order, results):
+        assert width == 400
+        with Image.open(io.BytesIO(data)) as im:
+            assert im.size == (width, height)
+            row = im.convert("L").crop((0, height - 5, width, height - 4))
+            dark = sum(1 for v in row.getdata() if v < 128)
+            expected = 20 * (index + 1) * 400 / 595.32
+            assert abs(dark - expected) <= 2, (index, dark, expected)
+
+
+if __name__ == "__main__":
+    test_rangos()
+    test_pool_orden()
+    shutdown_raster_pool()
+    print("🏁 Pruebas de salida multipágina completadas")
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Script para probar la geometría de firmas compilada al guardar el mapping
+(puntos PDF y coordenadas normalizadas). No necesita el servidor.
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.template_store import compile_signature_geometry
+from app.routes.api import _image_signatures, _pdf_signatures
+
+LETTER = (612.0, 792.0)
+
+
+def test_geometria_firmas():
+    """_signatures y firmas de _positions pasan de px de vista previa a puntos con escala y offset."""
+    mapping = {
+        "_preview_scale": 2.0,
+        "_offset": {"x": 10, "y": 0},
+        "_positions": {"nombre": [100, 100], "firma_tutor": [200, 400]},
+        "_signatures": {"firma_alumno": {"x": 400, "y": 600, "width": 300, "height": 100}},
+    }
+    geometry = compile_signature_geometry(mapping, LETTER)
+    assert geometry["page_size"] == [612.0, 792.0]
+    assert set(geometry["signatures"]) == {"firma_tutor", "firma_alumno"}
+
+    alumno = _pdf_signatures(geometry)["firma_alumno"]
+    assert alumno == {"x": 210.0, "y": 300.0, "width": 150.0, "height": 50.0}
+    tutor = _pdf_signatures(geometry)["firma_tutor"]
+    assert tutor == {"x": 110.0, "y": 200.0, "width": 200.0, "height": 100.0}
+
+    # A 2x la imagen mide 1224x1584: origen arriba-izquierda
+    image = _image_signatures(geometry, 1224, 1584)["firma_alumno"]
+    assert image == {"x": 420, "y": 984, "width": 300, "height": 100}
+    print("✅ Geometría de firmas: puntos PDF y píxeles de imagen")
+
+
+def test_sin_firmas():
+    geometry = compile_signature_geometry({}, LETTER)
+    assert geometry["signatures"] == {} and _image_signatures(geometry, 100, 100) == {}
+    print("✅ Plantilla sin firmas")
+
+
+def test_plantilla_antigua():
+    """Una plantilla sin '_compiled' se compila una sola vez y el resultado queda en su meta.json."""
+    import io
+    import json
+    import tempfile
+    from fastapi import UploadFile
+    from reportlab.pdfgen import canvas
+    from app.services.template_store import TemplateStore
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TemplateStore(tmp)
+        buf = io.BytesIO()
+        canvas.Canvas(buf, pagesize=LETTER).save()
+        template_id = store.save_template(UploadFile(file=io.BytesIO(buf.getvalue()), filename="base.pdf"))
+        meta_path = os.path.join(tmp, template_id, "meta.json")
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        meta["mapping"] = {"_preview_scale": 1, "_signatures": {"firma": {"x": 100, "y": 200, "width": 150, "height": 50}}}
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        compiled = store.get_compiled(template_id)
+        assert compiled["signatures"]["firma"]["width"] == 150
+        assert store.get_template_meta(template_id)["_compiled"] == compiled
+        # Ya compilada: no vuelve a leer el PDF
+        store._page_size = None
+        assert store.get_compiled(template_id) == compiled
+        assert not any(name.endswith(".tmp") for name in os.listdir(os.path.join(tmp, template_id)))
+    print("✅ Plantilla antigua compilada una sola vez")
+
+
+if __name__ == "__main__":
+    print("🧪 Probando geometría de firmas compilada")
+    test_geometria_firmas()
+    test_sin_firmas()
+    test_plantilla_antigua()
+    print("🎉 Pruebas completadas")
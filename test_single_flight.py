@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Script para probar la deduplicación de renders idénticos en curso (single-flight),
+dentro de un proceso y entre procesos con el directorio de locks. No necesita el servidor.
+"""
+
+import sys
+import os
+import asyncio
+import multiprocessing
+import tempfile
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.utils import metrics
+from app.utils.single_flight import _MISSING, SingleFlight, canonical_key, fcntl
+
+
+def _slow_render(counter_path: str, value: bytes, delay: float = 0.3) -> bytes:
+    with open(counter_path, "ab") as f:
+        f.write(b"x")
+    time.sleep(delay)
+    return value
+
+
+def test_clave_canonica():
+    """El orden de las claves del payload no cambia la clave; los parámetros sí."""
+    assert canonical_key("pdf", "t1", "v1", {"a": 1, "b": [1, 2]}) == canonical_key("pdf", "t1", "v1", {"b": [1, 2], "a": 1})
+    assert canonical_key("pdf", "t1", "v1", {"a": 1}) != canonical_key("pdf", "t1", "v2", {"a": 1})
+    print("✅ Clave canónica estable")
+
+
+def test_en_proceso():
+    """10 peticiones idénticas simultáneas -> un solo render; una distinta renderiza aparte."""
+    metrics.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        counter = os.path.join(tmp, "renders")
+        flight = SingleFlight(lock_dir=None, concurrency=4)
+
+        async def burst():
+            same = [flight.run("k1", lambda: _slow_render(counter, b"pdf-1")) for _ in range(10)]
+            other = flight.run("k2", lambda: _slow_render(counter, b"pdf-2"))
+            return await asyncio.gather(*same, other)
+
+        results = asyncio.run(burst())
+        assert results == [b"pdf-1"] * 10 + [b"pdf-2"]
+        assert os.path.getsize(counter) == 2
+    stats = metrics.snapshot()
+    assert stats["single_flight.leaders"] == 2 and stats["single_flight.coalesced"] == 9
+    print("✅ En proceso: 11 peticiones, 2 renders, 9 coalescidas")
+
+
+def test_excepcion_compartida():
+    """Si el render del líder falla, los que esperaban reciben la misma excepción."""
+    flight = SingleFlight(lock_dir=None)
+
+    def fail():
+        time.sleep(0.1)
+        raise ValueError("plantilla rota")
+
+    async def burst():
+        return await asyncio.gather(*[flight.run("k", fail) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(burst())
+    assert all(isinstance(r, ValueError) for r in results)
+    print("✅ Excepción del líder propagada a los coalescidos")
+
+
+def _worker(lock_dir: str, counter_path: str, start_at: float, queue):
+    metrics.reset()
+    flight = SingleFlight(lock_dir=lock_dir)
+    time.sleep(max(0.0, start_at - time.time()))
+    result = asyncio.run(flight.run("cafe" * 16, lambda: _slow_render(counter_path, b"x" * 100000, delay=1.0)))
+    queue.put((len(result), metrics.snapshot().get("single_flight.coalesced_workers", 0)))
+
+
+def test_entre_procesos():
+    """4 procesos con la misma clave y el mismo directorio de locks -> un solo render."""
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        counter = os.path.join(tmp, "renders")
+        queue = ctx.Queue()
+        start_at = time.time() + 2.0
+        procs = [ctx.Process(target=_worker, args=(os.path.join(tmp, "locks"), counter, start_at, queue)) for _ in range(4)]
+        for p in procs:
+            p.start()
+        results = [queue.get(timeout=60) for _ in procs]
+        for p in procs:
+            p.join()
+        assert all(size == 100000 for size, _ in results)
+        assert os.path.getsize(counter) == 1, f"renders: {os.path.getsize(counter)}"
+        assert sum(coalesced for _, coalesced in results) == 3
+    print("✅ Entre procesos: 4 workers, 1 render")
+
+
+def test_resultado_compartido_sin_pickle():
+    """El resultado entre workers se guarda como bytes + JSON y se recupera con los mismos tipos."""
+    with tempfile.TemporaryDirectory() as tmp:
+        flight = SingleFlight(lock_dir=os.path.join(tmp, "locks"))
+        assert oct(os.stat(flight.lock_dir).st_mode & 0o777) == "0o700"
+        result = {"pdf": b"%PDF-1", "image": (b"\x00\xff", 10, 20), "thumbnails": [(256, b"img", 5, 6)]}
+        key = "ab" * 32
+        flight._write_result(key, result)
+        assert flight._read_result(key, time.time()) == result
+        with open(os.path.join(flight.lock_dir, key + ".result"), "rb") as f:
+            assert f.read() == b"%PDF-1\x00\xffimg"
+        # Un fichero de resultado truncado no se usa
+        with open(os.path.join(flight.lock_dir, key + ".result"), "wb") as f:
+            f.write(b"%PDF")
+        assert flight._read_result(key, time.time()) is _MISSING
+    print("✅ Resultado compartido como bytes + JSON")
+
+
+def test_directorio_ajeno():
+    """Un directorio de locks que no es un directorio propio no se usa (solo deduplicación en proceso)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        target = os.path.join(tmp, "real")
+        os.mkdir(target)
+        link = os.path.join(tmp, "locks")
+        os.symlink(target, link)
+        assert SingleFlight(lock_dir=link).lock_dir is None
+        loose = os.path.join(tmp, "loose")
+        os.mkdir(loose, 0o777)
+        os.chmod(loose, 0o777)
+        assert SingleFlight(lock_dir=loose).lock_dir == loose
+        assert os.stat(loose).st_mode & 0o077 == 0
+    print("✅ Directorio de locks privado")
+
+
+def test_espera_sin_turno():
+    """Quien espera el render de otro worker no ocupa el turno: otra clave renderiza mientras tanto."""
+    with tempfile.TemporaryDirectory() as tmp:
+        flight = SingleFlight(lock_dir=os.path.join(tmp, "locks"), concurrency=1)
+        key = "cd" * 32
+        # Otro "worker" tiene el lock de la clave
+        other = os.open(os.path.join(flight.lock_dir, key + ".lock"), os.O_RDWR | os.O_CREAT)
+        fcntl.flock(other, fcntl.LOCK_EX)
+        waiting = threading.Thread(target=lambda: asyncio.run(flight.run(key, lambda: b"propio")))
+        waiting.start()
+        time.sleep(0.2)
+        t0 = time.monotonic()
+        assert asyncio.run(flight.run("ef" * 32, lambda: b"otro")) == b"otro"
+        assert time.monotonic() - t0 < 1.0
+        fcntl.flock(other, fcntl.LOCK_UN)
+        os.close(other)
+        waiting.join(timeout=5)
+        assert not waiting.is_alive()
+    print("✅ La espera entre workers no bloquea otras claves")
+
+
+def test_on_done_tras_cancelar():
+    """Si quien espera se va, on_done se llama cuando termina el render compartido, no antes."""
+    flight = SingleFlight(lock_dir=None)
+    released = []
+
+    async def scenario():
+        waiter = asyncio.ensure_future(flight.run("k", lambda: time.sleep(0.3) or b"pdf", on_done=lambda: released.append(True)))
+        await asyncio.sleep(0.1)
+        waiter.cancel()
+        await asyncio.sleep(0.05)
+        assert not released
+        await asyncio.sleep(0.4)
+
+    asyncio.run(scenario())
+    assert released == [True]
+    print("✅ on_done al terminar el render de un cliente desconectado")
+
+
+if __name__ == "__main__":
+    print("🧪 Probando single-flight")
+    test_clave_canonica()
+    test_en_proceso()
+    test_excepcion_compartida()
+    test_entre_procesos()
+    test_resultado_compartido_sin_pickle()
+    test_directorio_ajeno()
+    test_espera_sin_turno()
+    test_on_done_tras_cancelar()
+    print("🎉 Pruebas completadas")
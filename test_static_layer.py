@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Script para probar la capa estática de las plantillas overlay: lo que no
+depende del payload (imágenes de la plantilla, firmas, textos constantes) se
+dibuja una vez y queda debajo de todo lo dinámico. No necesita el servidor.
+"""
+
+import sys
+import os
+import io
+import base64
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pypdfium2 as pdfium
+from fastapi import UploadFile
+from PIL import Image
+from reportlab.pdfgen import canvas
+from app.services.template_store import TemplateStore
+from app.services.renderer import Renderer
+
+# Logo de 120x40 en (100, 300) y el texto "nombre" encima, en grande
+_LOGO = {"x": 100, "y": 300, "width": 120, "height": 40}
+
+
+def _png(color):
+    buf = io.BytesIO()
+    Image.new("RGB", (120, 40), color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _template(store, mapping):
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=(595, 842))
+    c.drawString(40, 800, "BASE")
+    c.save()
+    template_id = store.save_template(UploadFile(file=io.BytesIO(buf.getvalue()), filename="base.pdf"))
+    store.save_mapping(template_id, mapping)
+    return template_id
+
+
+def _dark_pixels_in_logo(pdf_bytes):
+    image = pdfium.PdfDocument(pdf_bytes)[0].render(scale=1).to_pil().convert("L")
+    box = image.crop((100, 842 - 340, 220, 842 - 300))
+    return sum(1 for v in box.getdata() if v < 40)
+
+
+def test_orden_de_dibujo():
+    """El texto del payload queda encima de la imagen de la plantilla, y debajo de la imagen del payload."""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TemplateStore(tmp)
+        renderer = Renderer(store)
+        preview = "data:image/png;base64," + base64.b64encode(_png((200, 0, 0))).decode()
+        template_id = _template(store, {
+            "_preview_scale": 1,
+            "_positions": {"nombre": [105, 310]},
+            "_styles": {"nombre": {"font": "Helvetica-Bold", "size": 30, "color": "#000000"}},
+            "_images": {"logo": _LOGO},
+            "_image_previews": {"logo": preview},
+        })
+        # Imagen de la plantilla (capa estática): el texto se ve sobre ella
+        assert _dark_pixels_in_logo(renderer.render_to_pdf(template_id, {"nombre": "MMMM"})) > 50
+        # Imagen del payload (dinámica): se dibuja después del texto y lo tapa
+        logo = "data:image/png;base64," + base64.b64encode(_png((120, 200, 255))).decode()
+        assert _dark_pixels_in_logo(renderer.render_to_pdf(template_id, {"nombre": "MMMM", "logo": logo})) == 0
+    print("✅ Capa estática por debajo de lo dinámico")
+
+
+def test_capa_vacia():
+    """Una imagen estática sin vista previa ni valor no deja una capa sin páginas."""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TemplateStore(tmp)
+        renderer = Renderer(store)
+        template_id = _template(store, {
+            "_preview_scale": 1,
+            "_positions": {"nombre": [40, 700]},
+            "_images": {"logo": _LOGO},
+        })
+        pdf = renderer.render_to_pdf(template_id, {"nombre": "Ana"})
+        assert len(pdfium.PdfDocument(pdf)) == 1
+    print("✅ Plantilla sin contenido estático")
+
+
+def test_version_sin_leer_meta():
+    """La versión de la plantilla sale de stat, sin leer meta.json, y cambia al guardar el mapping."""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TemplateStore(tmp)
+        template_id = _template(store, {"_positions": {"nombre": [40, 700]}})
+        version = store.get_template_version(template_id)
+        store.get_template_meta = None  # cualquier lectura de meta.json fallaría
+        assert store.get_template_version(template_id) == version
+        del store.get_template_meta
+        meta_path = os.path.join(tmp, template_id, "meta.json")
+        os.utime(meta_path, ns=(0, 0))
+        assert store.get_template_version(template_id) != version
+        try:
+            store.get_template_version("no-existe")
+            assert False, "Debe fallar con una plantilla inexistente"
+        except FileNotFoundError:
+            pass
+    print("✅ Versión de plantilla por stat")
+
+
+if __name__ == "__main__":
+    print("🧪 Probando la capa estática de las plantillas overlay")
+    test_orden_de_dibujo()
+    test_capa_vacia()
+    test_version_sin_leer_meta()
+    print("🎉 Pruebas completadas")
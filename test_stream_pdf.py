@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Script para probar el PDF por partes: escritura incremental de la fusión
+overlay (pdf_stream) y la tubería entre el render y la respuesta (SpoolPipe).
+No necesita el servidor.
+"""
+
+import sys
+import os
+import io
+import threading
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from pypdf import PdfReader
+from reportlab.pdfgen import canvas
+from app.utils.pdf_merge import merge_overlay
+from app.utils.pdf_stream import stream_overlay
+from app.utils.spool_pipe import SpoolPipe
+
+
+def _pdf(pages, first=0):
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=(595, 842), invariant=1)
+    for n, text in enumerate(pages):
+        if n:
+            c.showPage()
+        c.drawString(100, 700 - 20 * ((first + n) % 30), text)
+    c.save()
+    return buf.getvalue()
+
+
+def test_pdf_por_lotes():
+    """Los lotes de overlay dan el mismo documento que la fusión "xobject" del overlay completo."""
+    base = _pdf(["Base 1", "Base 2"])
+    texts = [f"Pagina {n}" for n in range(7)]
+    batches = [_pdf(texts[i:i + 3], first=i) for i in range(0, 7, 3)]
+    chunks = list(stream_overlay(base, iter(batches), b"\x01" * 16))
+    assert len(chunks) == 4  # un trozo por lote (el primero con la cabecera) y el trailer
+    assert chunks[0].startswith(b"%PDF-") and chunks[-1].endswith(b"%%EOF\n")
+
+    streamed = PdfReader(io.BytesIO(b"".join(chunks)))
+    merged = PdfReader(io.BytesIO(merge_overlay(base, _pdf(texts), 7, backend="xobject")))
+    assert len(streamed.pages) == 7
+    assert [p.extract_text() for p in streamed.pages] == [p.extract_text() for p in merged.pages]
+    assert "Base 1" in streamed.pages[0].extract_text() and "Base 2" in streamed.pages[6].extract_text()
+    assert b"/ID [ <" + b"01" * 16 + b">" in chunks[-1]
+    print("✅ PDF por lotes equivalente a la fusión completa")
+
+
+def test_recursos_compartidos():
+    """Fuentes e imágenes repetidas en cada lote se escriben una sola vez en el documento."""
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+    logo = io.BytesIO()
+    Image.new("RGB", (40, 20), (0, 90, 200)).save(logo, "PNG")
+
+    def batch(first):
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf, pagesize=(595, 842), invariant=1)
+        for n in range(2):
+            if n:
+                c.showPage()
+            c.setFont("Helvetica", 10)
+            c.drawString(100, 700, f"Pagina {first + n}")
+            c.drawImage(ImageReader(io.BytesIO(logo.getvalue())), 100, 600, 40, 20)
+        c.save()
+        return buf.getvalue()
+
+    pdf = b"".join(stream_overlay(_pdf(["Base"]), iter([batch(i) for i in range(0, 8, 2)]), b"\x01" * 16))
+    reader = PdfReader(io.BytesIO(pdf))
+    assert len(reader.pages) == 8
+    assert pdf.count(b"/Subtype /Image") == 1
+    assert pdf.count(b"/BaseFont /Helvetica") == 1
+    fonts = {p["/Resources"]["/Font"].raw_get("/F1").idnum for p in reader.pages}
+    assert len(fonts) == 1
+    assert "Pagina 7" in reader.pages[7].extract_text()
+    print("✅ Fuentes e imágenes compartidas entre lotes")
+
+
+def test_spool_pipe():
+    """El lector recibe lo escrito según llega (también tras pasar a disco) y luego el error del productor."""
+    pipe = SpoolPipe(max_size=1024)
+    parts = [bytes([n]) * 700 for n in range(5)]
+
+    def produce():
+        for part in parts:
+            pipe.write(part)
+        pipe.finish(RuntimeError("fallo al final"))
+
+    threading.Thread(target=produce).start()
+    received = b""
+    try:
+        for chunk in pipe.chunks():
+            received += chunk
+        assert False, "Debe propagarse el error del productor"
+    except RuntimeError:
+        pass
+    assert received == b"".join(parts)
+    pipe.close()
+    print("✅ SpoolPipe entrega los datos y el error")
+
+
+def test_spool_pipe_cerrado():
+    """Si la respuesta se cierra (cliente desconectado), el productor falla en su siguiente write."""
+    pipe = SpoolPipe()
+    pipe.write(b"hola")
+    assert pipe.read(0) == b"hola"
+    pipe.close()
+    try:
+        pipe.write(b"mas")
+        assert False, "write tras close debe fallar"
+    except ValueError:
+        pass
+    print("✅ SpoolPipe detiene al productor tras cerrarse")
+
+
+if __name__ == "__main__":
+    print("🧪 Probando PDF por partes")
+    test_pdf_por_lotes()
+    test_recursos_compartidos()
+    test_spool_pipe()
+    test_spool_pipe_cerrado()
+    print("🎉 Pruebas completadas")